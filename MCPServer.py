@@ -1,28 +1,194 @@
+import os
+import re
+from functools import lru_cache
+from threading import Lock
+from typing import Dict, List
+
 import railtracks as rt
-import asyncio
+from dotenv import load_dotenv
+from mcp.server.fastmcp import FastMCP
+
+from singleton import SingletonMeta
+from tools.arxiv_tools import download_papers, format_arxiv_results, search_arxiv as search_arxiv_results
+from tools.job_tools import JobManager, get_job_status, get_job_result, cancel_job, list_jobs
+from tools.research_tools import read_write_notes_for_papers_in_a_directory
+from tools.tavily_search_tool import download_articles, format_web_results, search_web as search_web_results
+
+load_dotenv()
+
+
+class MCPServerState(metaclass=SingletonMeta):
+    """
+    State shared by every request the MCP server handles.
+
+    Every MCP tool call runs in a fresh railtracks session, so the downloaded files of a
+    client are kept here in a named workspace, each with its own output directory. Reading
+    runs as background jobs on the shared `JobManager` pool, so at most `JOB_WORKERS` of them
+    talk to the LLM provider at once and the rest wait in line. LLM clients and agent nodes
+    are shared through the registry and the Tavily client through `get_tavily_client`.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.root = os.getenv("MCP_WORKSPACE_ROOT", "mcp_workspaces")
+        self.workspaces: Dict[str, List[dict]] = {}
+
+    def enter_workspace(self, workspace: str) -> str:
+        """
+        Points the current session's "vfs" and "output_dir" at a workspace, creating it on first use.
+
+        Args:
+            workspace (str): The name of the workspace.
+
+        Returns:
+            str: The output directory of the workspace.
+        """
+        name = re.sub(r"[^\w.-]", "_", workspace) or "default"
+        with self._lock:
+            vfs = self.workspaces.setdefault(name, [])
+        output_dir = os.path.join(self.root, name)
+        os.makedirs(output_dir, exist_ok=True)
+        rt.context.put("vfs", vfs)
+        rt.context.put("output_dir", output_dir)
+        return output_dir
+
+
+# Only the raw search results are cached. Triage and prefetching depend on the research brief
+# of the session and run on every call, see `format_arxiv_results` and `format_web_results`.
+@lru_cache(maxsize=256)
+def cached_arxiv_search(query: str) -> tuple:
+    return tuple(search_arxiv_results(query, max_results=10))
+
+
+@lru_cache(maxsize=256)
+def cached_web_search(query: str) -> tuple:
+    return tuple(search_web_results(query))
+
+
+@rt.function_node
+def search_arxiv(query: str) -> str:
+    """
+    Search arXiv and return the title, abstract and id of up to 10 matching papers.
+
+    Args:
+        query (str): An arXiv search query, e.g. "(title:attention OR abstract:attention) AND cat:cs.CL".
+
+    Returns:
+        str: The search results. Pass the paper ids of interest to `download_papers_to_workspace`.
+    """
+    return format_arxiv_results(cached_arxiv_search(query))
+
+
+@rt.function_node
+def search_web(query: str) -> str:
+    """
+    Search the web with Tavily and return the title, content and url of up to 5 results.
+
+    Args:
+        query (str): The web search query.
+
+    Returns:
+        str: The search results. Pass the urls of interest to `download_articles_to_workspace`.
+    """
+    return format_web_results(cached_web_search(query))
+
 
-def create_mcp(tool_list,server_name):
+@rt.function_node
+async def download_papers_to_workspace(paper_ids: List[str], workspace: str) -> str:
+    """
+    Download arXiv papers into a workspace.
+
+    Args:
+        paper_ids (List[str]): The arXiv ids of the papers, e.g. ["2210.06313v2"].
+        workspace (str): The workspace to download into. Use the same workspace for all tools of one research task.
+
+    Returns:
+        str: A message listing the downloaded papers.
+    """
+    MCPServerState().enter_workspace(workspace)
+    return await rt.call(download_papers, paper_ids, "papers")
+
+
+@rt.function_node
+async def download_articles_to_workspace(urls: List[str], workspace: str) -> str:
+    """
+    Download web articles into a workspace as PDFs.
+
+    Args:
+        urls (List[str]): The urls of the articles.
+        workspace (str): The workspace to download into. Use the same workspace for all tools of one research task.
+
+    Returns:
+        str: A message listing the downloaded articles.
+    """
+    MCPServerState().enter_workspace(workspace)
+    return await rt.call(download_articles, urls, "articles")
+
+
+@rt.function_node
+def list_workspace(workspace: str) -> str:
+    """
+    List the papers and articles downloaded into a workspace.
+
+    Args:
+        workspace (str): The workspace.
+
+    Returns:
+        str: The downloaded files with their description and path.
+    """
+    MCPServerState().enter_workspace(workspace)
+    vfs = rt.context.get("vfs", [])
+    if not vfs:
+        return f"Workspace {workspace} is empty."
+    return "\n".join(f"- {entry.get('description')}: {entry.get('path')}" for entry in vfs)
+
+
+@rt.function_node
+def read_papers_in_workspace(user_research_brief: str, workspace: str) -> str:
+    """
+    Start taking notes on every paper and article of a workspace, highlighting them and writing a research report.
+
+    Reading runs as a background job and this returns its job ID right away. Follow it with
+    `get_job_status` and fetch the outcome with `get_job_result`. Jobs are queued when all
+    workers are busy.
+
+    Args:
+        user_research_brief (str): The research brief that guides note taking and the report.
+        workspace (str): The workspace holding the downloaded papers and articles.
+
+    Returns:
+        str: The job ID and the output directory that will hold the highlighted papers and the report.
+    """
+    output_dir = MCPServerState().enter_workspace(workspace)
+    context = {"vfs": list(rt.context.get("vfs", [])), "output_dir": output_dir,
+               "research_brief": user_research_brief}
+    job = JobManager().submit(f"read {workspace}", read_write_notes_for_papers_in_a_directory,
+                              user_research_brief, context=context)
+    return (f"Submitted job {job.id} for {len(context['vfs'])} papers. The highlighted papers and the report "
+            f"will be written to {output_dir}.")
+
+
+MCP_TOOLS = [search_arxiv, search_web, download_papers_to_workspace, download_articles_to_workspace,
+             list_workspace, read_papers_in_workspace, get_job_status, get_job_result, cancel_job, list_jobs]
+
+
+def create_mcp(tool_list, server_name, host="127.0.0.1", port=8000):
     mcp = rt.create_mcp_server(
         tool_list,
-        server_name=server_name
+        server_name=server_name,
+        fastmcp=FastMCP(server_name, host=host, port=port),
     )
     return mcp
 
-    
-    
-
-
-async def main():
-    # Create MCP server
-    mcp = create_mcp([agent_websearch], "big")
-
-    # Run MCP server in background
-    server_task = asyncio.create_task(mcp.run(transport="streamable-http"))
 
-    # Optionally stop server if you want to end the program
-    server_task.cancel()
+def main():
+    # Every tool call runs in its own session; downloading many papers can exceed the default timeout.
+    rt.set_config(timeout=float(os.getenv("MCP_TOOL_TIMEOUT", "600")))
+    mcp = create_mcp(MCP_TOOLS, "auto-research", host=os.getenv("MCP_HOST", "127.0.0.1"),
+                     port=int(os.getenv("MCP_PORT", "8000")))
+    mcp.run(transport="streamable-http")
 
 
 # Entry point
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
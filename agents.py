@@ -1,5 +1,6 @@
 import asyncio
 import os
+import sys
 
 import railtracks as rt
 from dotenv import load_dotenv
@@ -7,12 +8,17 @@ from pydantic import BaseModel, Field
 
 from prompts import SYSTEM_PROMPT_FOR_ARXIV_AGENT, SYSTEM_PROMPT_FOR_RESEARCH_COORDINATOR, ARXIV_AGENT_DESCRIPTION, \
     ARXIV_QUERY_PARAM_DESCRIPTION, SYSTEM_PROMPT_FOR_RESEARCH_COORDINATOR_WRITING_AGENT, \
-    SYSTEM_PROMPT_FOR_WEB_SEARCH_AGENT, WEB_SEARCH_AGENT_DESCRIPTION, WEB_SEARCH_AGENT_QUERY_DESCRIPTION
+    SYSTEM_PROMPT_FOR_WEB_SEARCH_AGENT, WEB_SEARCH_AGENT_DESCRIPTION, WEB_SEARCH_AGENT_QUERY_DESCRIPTION, \
+    SYSTEM_PROMPT_FOR_BATCH_RESEARCH_COORDINATOR
 from tools.arxiv_tools import get_arxiv_query, execute_search, download_papers, execute_search_main
-from tools.research_tools import get_research_brief, generate_research_brief, read_write_notes_for_papers_in_a_directory
+from tools.compaction import HistoryCompactor, recall_tool_output
+from tools.registry import Registry, get_agent, get_stage_llm, model_key
+from tools.research_tools import get_research_brief, generate_research_brief, read_write_notes_for_papers_in_a_directory, \
+    render_highlighted_paper
+from tools.job_tools import submit_reading_job, get_job_status, get_job_result, cancel_job, list_jobs
 from tools.tavily_search_tool import generate_websearch_query, execute_web_search, download_articles, \
     execute_web_search_main
-from tools.todo_tools import write_todo, read_todo
+from tools.todo_tools import add_todo, read_todo, remove_todo, update_todo
 from tools.util_tools import think_tool
 
 load_dotenv()
@@ -71,16 +77,39 @@ def build_websearch_agent(model):
     return agent
 
 
+def get_search_agents():
+    arxiv_model = get_stage_llm("arxiv")
+    websearch_model = get_stage_llm("websearch")
+    arxiv_agent = get_agent(("ARXIV Agent", model_key(arxiv_model), False), lambda: build_arxiv_agent(arxiv_model))
+    websearch_agent = get_agent(("Web Search Agent", model_key(websearch_model)),
+                                lambda: build_websearch_agent(websearch_model))
+    return arxiv_agent, websearch_agent
+
+
+# The coordinators compact their history by wrapping their model, so pass them a separate client,
+# e.g. get_stage_llm("coordinator", client="coordinator"), never one shared with other agents.
 def build_research_coordinator(model):
-    arxiv_agent = build_arxiv_agent(model)
-    websearch_agent = build_websearch_agent(model)
+    arxiv_agent, websearch_agent = get_search_agents()
     agent = rt.agent_node(
         name="Research Coordinator",
-        llm=model,
+        llm=HistoryCompactor().wrap(model),
         system_message=SYSTEM_PROMPT_FOR_RESEARCH_COORDINATOR,
-        tool_nodes=[write_todo, read_todo, arxiv_agent, get_research_brief,
+        tool_nodes=[add_todo, update_todo, remove_todo, read_todo, arxiv_agent, get_research_brief,
                     generate_research_brief, websearch_agent, execute_search_main, execute_web_search_main,
-                    download_articles, download_papers, read_write_notes_for_papers_in_a_directory])
+                    download_articles, download_papers, submit_reading_job, get_job_status, get_job_result,
+                    cancel_job, list_jobs, render_highlighted_paper, recall_tool_output])
+    return agent
+
+
+def build_batch_research_coordinator(model):
+    arxiv_agent, websearch_agent = get_search_agents()
+    agent = rt.agent_node(
+        name="Batch Research Coordinator",
+        llm=HistoryCompactor().wrap(model),
+        system_message=SYSTEM_PROMPT_FOR_BATCH_RESEARCH_COORDINATOR,
+        tool_nodes=[add_todo, update_todo, remove_todo, read_todo, arxiv_agent, get_research_brief, websearch_agent,
+                    execute_search_main, execute_web_search_main, download_articles, download_papers,
+                    read_write_notes_for_papers_in_a_directory, recall_tool_output])
     return agent
 
 
@@ -93,9 +122,9 @@ def create_writing_agent(model, summaries):
 
 
 async def main():
-    model = rt.llm.PortKeyLLM(os.getenv("MODEL", "@openai/gpt-4.1-2025-04-14"))
+    model = get_stage_llm("arxiv")
     with_schema = False
-    agent = build_arxiv_agent(model, with_schema=with_schema)
+    agent = get_agent(("ARXIV Agent", model_key(model), with_schema), lambda: build_arxiv_agent(model, with_schema=with_schema))
     response = await rt.call(agent, "Help me find all the papers that are important in transformers")
     print(response.message_history)
     print(response)
@@ -105,13 +134,19 @@ async def main():
         print(response.text)
 
 
-@rt.session(context={"vfs": []},timeout=100000000000000)
+# Reading runs as a background job, so one chat turn only has to cover searching and downloading.
+@rt.session(context={"vfs": []}, timeout=float(os.getenv("SESSION_TIMEOUT", "1800")))
 async def main1():
-    model = rt.llm.PortKeyLLM(os.getenv("MODEL", "@openai/gpt-4.1-2025-04-14"))
-    agent = build_research_coordinator(model)
+    with Registry().timed_setup("build_research_coordinator"):
+        model = get_stage_llm("coordinator", client="coordinator")
+        agent = get_agent(("Research Coordinator", model_key(model)), lambda: build_research_coordinator(model))
     response = await rt.interactive.local_chat(agent)
     print(response.content)
 
 
 if __name__ == "__main__":
-    asyncio.run(main1())
+    if "--profile-startup" in sys.argv:
+        from tools.startup_profile import startup_report
+        print(startup_report("agents"))
+    else:
+        asyncio.run(main1())
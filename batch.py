@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List
+
+import railtracks as rt
+from dotenv import load_dotenv
+
+from agents import build_batch_research_coordinator
+from tools.cassette import Cassette
+from tools.registry import Registry, get_agent, get_stage_llm, model_key
+from tools.resource_monitor import ResourceMonitor
+
+load_dotenv()
+
+BATCH_USER_PROMPT = """
+Run the research workflow for the following pre-approved research brief and write the report.
+
+Research brief:
+{brief}
+"""
+
+
+def load_briefs(input_path: str) -> List[Dict[str, str]]:
+    """
+    Reads research briefs from a JSONL file.
+
+    Every line is a JSON object. The id is taken from "brief_id", "request_id" or "id"
+    (the line number if none is present) and the brief from "brief", "body" or "query",
+    prefixed by "title" if there is one.
+
+    Args:
+        input_path (str): The JSONL file to read.
+
+    Returns:
+        List[Dict[str, str]]: One {"id", "brief"} dictionary per non-empty line.
+    """
+    briefs = []
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            brief_id = str(data.get("brief_id") or data.get("request_id") or data.get("id") or line_number)
+            text = data.get("brief") or data.get("body") or data.get("query") or ""
+            if data.get("title"):
+                text = f"{data['title']}\n\n{text}"
+            briefs.append({"id": re.sub(r"[^\w.-]", "_", brief_id), "brief": text.strip()})
+    return briefs
+
+
+def batch_session_timeout() -> float:
+    """
+    Returns the session timeout of one brief.
+
+    The batch coordinator reads the papers inside its own session, so the timeout has to
+    cover reading every paper the brief may download. Unless `BATCH_SESSION_TIMEOUT` is set,
+    it is `BATCH_SEARCH_SECONDS` (default 1800) for searching and writing plus
+    `BATCH_SECONDS_PER_PAPER` (default 600) for each of the `DOWNLOAD_BUDGET` papers. Without
+    a download budget the number of papers is unbounded and `JOB_TIMEOUT` (default 86400) is
+    used, as for reading jobs in the chat.
+
+    Returns:
+        float: The timeout in seconds.
+    """
+    if os.getenv("BATCH_SESSION_TIMEOUT"):
+        return float(os.getenv("BATCH_SESSION_TIMEOUT"))
+    papers = int(os.getenv("DOWNLOAD_BUDGET", "10"))
+    if papers <= 0:
+        return float(os.getenv("JOB_TIMEOUT", "86400"))
+    per_paper = float(os.getenv("BATCH_SECONDS_PER_PAPER", "600"))
+    return float(os.getenv("BATCH_SEARCH_SECONDS", "1800")) + papers * per_paper
+
+
+async def run_brief(agent, brief: Dict[str, str], output_root: str, semaphore: asyncio.Semaphore,
+                    timeout: float) -> Dict[str, Any]:
+    """
+    Runs the research workflow for one brief in its own session and output directory.
+
+    Args:
+        agent: The batch research coordinator.
+        brief (Dict[str, str]): The brief, as returned by `load_briefs`.
+        output_root (str): The directory holding one output directory per brief.
+        semaphore (asyncio.Semaphore): Limits how many briefs run at the same time.
+        timeout (float): The session timeout in seconds.
+
+    Returns:
+        Dict[str, Any]: The result record with the id, status, output directory, report
+        path, final response, error and duration in seconds.
+    """
+    async with semaphore:
+        output_dir = os.path.join(output_root, brief["id"])
+        os.makedirs(output_dir, exist_ok=True)
+        report_path = os.path.join(output_dir, os.getenv("REPORT_PATH", os.path.join("output", "research_report.md")))
+        result = {"id": brief["id"], "status": "ok", "output_dir": output_dir, "report": None,
+                  "response": None, "error": None, "seconds": 0.0}
+        print(f"[{brief['id']}] started")
+        start = time.perf_counter()
+        try:
+            # The session registers its context for the current task, so it is created here
+            # rather than shared between briefs.
+            context = {"vfs": [], "output_dir": output_dir, "research_brief": brief["brief"]}
+            with rt.Session(context=context, timeout=timeout, name=f"batch-{brief['id']}"):
+                response = await rt.call(agent, BATCH_USER_PROMPT.format(brief=brief["brief"]))
+            result["response"] = response.text
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        if os.path.exists(report_path):
+            result["report"] = report_path
+        print(f"[{brief['id']}] {result['status']} in {result['seconds']:.1f}s")
+        return result
+
+
+async def run_batch(input_path: str, output_path: str, output_root: str, concurrency: int, timeout: float):
+    """
+    Runs every brief of a JSONL file, at most `concurrency` at a time, and writes the results.
+
+    Results are appended to `output_path` as JSON lines in the order the briefs finish,
+    so a partial run still leaves the finished results behind.
+
+    Args:
+        input_path (str): The JSONL file with the briefs.
+        output_path (str): The JSONL file to write the results to.
+        output_root (str): The directory holding one output directory per brief.
+        concurrency (int): The maximum number of briefs running at the same time.
+        timeout (float): The session timeout of one brief in seconds.
+    """
+    briefs = load_briefs(input_path)
+    with Registry().timed_setup("build_batch_research_coordinator"):
+        model = get_stage_llm("coordinator", client="coordinator")
+        agent = get_agent(("Batch Research Coordinator", model_key(model)),
+                          lambda: build_batch_research_coordinator(model))
+    semaphore = asyncio.Semaphore(concurrency)
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    start = time.perf_counter()
+    succeeded = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        tasks = [asyncio.create_task(run_brief(agent, brief, output_root, semaphore, timeout)) for brief in briefs]
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            succeeded += result["status"] == "ok"
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+    elapsed = time.perf_counter() - start
+    throughput = len(briefs) / elapsed * 3600 if elapsed else 0.0
+    print(f"Finished {len(briefs)} briefs ({succeeded} ok, {len(briefs) - succeeded} failed) in {elapsed:.1f}s "
+          f"with concurrency {concurrency}: {throughput:.1f} briefs/hour")
+    print(ResourceMonitor().format_report())
+    ResourceMonitor().write_report(os.path.join(output_root, "resource_report.json"))
+    if Cassette().enabled:
+        print(Cassette().report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run research briefs from a JSONL file without interaction.")
+    parser.add_argument("input", help="JSONL file with one research brief per line.")
+    parser.add_argument("--output", default=os.path.join("batch_output", "results.jsonl"),
+                        help="JSONL file to write the results to.")
+    parser.add_argument("--output-root", default="batch_output",
+                        help="Directory holding one output directory per brief.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+                        help="Maximum number of briefs running at the same time.")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Session timeout of one brief in seconds. Defaults to the timeout derived from "
+                             "the download budget, see `batch_session_timeout`.")
+    args = parser.parse_args()
+    timeout = args.timeout if args.timeout is not None else batch_session_timeout()
+    asyncio.run(run_batch(args.input, args.output, args.output_root, args.concurrency, timeout))
+
+
+if __name__ == "__main__":
+    main()
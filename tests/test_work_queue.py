@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from tools.work_queue import SQLiteWorkQueue, WorkQueue, gather_batch, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteWorkQueue(str(tmp_path / "queue.sqlite"), lease=0.2, max_attempts=2, retry_delay=0.1)
+
+
+def test_work_queue_is_abstract():
+    with pytest.raises(TypeError):
+        WorkQueue()
+
+
+def test_claims_in_order_and_gathers_results(queue):
+    queue.enqueue("batch", [{"n": 0}, {"n": 1}])
+    first = queue.claim("worker")
+    second = queue.claim("worker")
+    assert [first.payload, second.payload] == [{"n": 0}, {"n": 1}]
+    assert queue.claim("worker") is None
+    queue.complete(second.id, "worker", {"n": 10})
+    queue.complete(first.id, "worker", {"n": 0})
+    assert asyncio.run(gather_batch(queue, "batch", poll=0.01)) == [{"n": 0}, {"n": 10}]
+
+
+def test_failed_task_is_retried_after_the_delay(queue):
+    queue.enqueue("batch", [{"n": 0}])
+    task = queue.claim("worker")
+    queue.fail(task.id, "worker", "ValueError: boom")
+    assert queue.claim("worker") is None
+    time.sleep(0.15)
+    retry = queue.claim("worker")
+    assert retry.id == task.id
+    assert retry.attempts == 2
+
+
+def test_task_fails_after_max_attempts(queue):
+    queue.enqueue("batch", [{"n": 0}])
+    for attempt in range(2):
+        task = queue.claim("worker")
+        assert task.attempts == attempt + 1
+        queue.fail(task.id, "worker", "ValueError: boom")
+        time.sleep(0.15)
+    assert queue.claim("worker") is None
+    state, = queue.batch_states("batch")
+    assert state.status == "failed"
+    assert state.error == "ValueError: boom"
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(gather_batch(queue, "batch", poll=0.01))
+
+
+def test_expired_lease_is_handed_to_another_worker(queue):
+    queue.enqueue("batch", [{"n": 0}])
+    task = queue.claim("dead worker")
+    assert queue.claim("live worker") is None
+    time.sleep(0.25)
+    assert not queue.renew(task.id, "live worker")
+    retry = queue.claim("live worker")
+    assert retry.id == task.id
+    assert retry.attempts == 2
+    # The dead worker lost its lease, so it can no longer renew or fail the task.
+    assert not queue.renew(task.id, "dead worker")
+    queue.fail(task.id, "dead worker", "late failure")
+    queue.complete(retry.id, "live worker", {"n": 0})
+    state, = queue.batch_states("batch")
+    assert (state.status, state.result) == ("done", {"n": 0})
+
+
+def test_expired_lease_on_the_last_attempt_fails_the_task(queue):
+    queue.enqueue("batch", [{"n": 0}])
+    queue.claim("dead worker")
+    time.sleep(0.25)
+    queue.claim("dead worker")
+    time.sleep(0.25)
+    assert queue.claim("live worker") is None
+    state, = queue.batch_states("batch")
+    assert state.status == "failed"
+    assert state.error == "lease expired on the last attempt"
+
+
+def test_worker_retries_a_failing_handler(queue):
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload["n"])
+        if len(calls) == 1:
+            raise ValueError("flaky")
+        return {"n": payload["n"] * 2}
+
+    async def run():
+        queue.enqueue("batch", [{"n": 3}])
+        worker = asyncio.create_task(run_worker(queue, handler, batch="batch", poll=0.01))
+        try:
+            return await gather_batch(queue, "batch", poll=0.01)
+        finally:
+            worker.cancel()
+
+    assert asyncio.run(run()) == [{"n": 6}]
+    assert calls == [3, 3]
@@ -1,11 +1,70 @@
 import asyncio
 import os
+import shutil
 import time
+from datetime import datetime
 from typing import Any, Dict, List
 
-import arxiv
 import railtracks as rt
 
+from tools.cassette import Cassette
+from tools.ingest import start_ingest
+from tools.prefetch import Prefetcher, split_arxiv_id
+from tools.resource_monitor import instrumented
+from tools.triage import download_budget_status, refund_download_budget, spend_download_budget, triage_results
+from tools.util_tools import session_path
+
+
+def search_arxiv(query: str = "", id_list: List[str] = None, max_results: int = 10) -> list:
+    """
+    Searches arXiv by relevance, through the `Cassette` so the results can be recorded and replayed.
+
+    Args:
+        query (str): The arXiv search query.
+        id_list (List[str], optional): The paper ids to look up instead.
+        max_results (int): The maximum number of results.
+
+    Returns:
+        List[arxiv.Result]: The results.
+    """
+    import arxiv
+
+    def search():
+        return list(arxiv.Search(query=query, id_list=id_list or [], max_results=max_results,
+                                 sort_by=arxiv.SortCriterion.Relevance).results())
+
+    def encode(results):
+        return [{"entry_id": result.entry_id, "title": result.title, "summary": result.summary,
+                 "authors": [author.name for author in result.authors], "published": result.published.isoformat(),
+                 "pdf_url": result.pdf_url} for result in results]
+
+    def decode(data):
+        return [arxiv.Result(entry_id=item["entry_id"], title=item["title"], summary=item["summary"],
+                             authors=[arxiv.Result.Author(name) for name in item["authors"]],
+                             published=datetime.fromisoformat(item["published"]),
+                             links=[arxiv.Result.Link(item["pdf_url"], title="pdf")] if item["pdf_url"] else [])
+                for item in data]
+
+    return Cassette().call("arxiv", "search", {"query": query, "id_list": id_list or [], "max_results": max_results},
+                           search, encode, decode)
+
+
+def download_arxiv_pdf(result, dirpath: str = ".", filename: str = "") -> str:
+    """
+    Downloads the PDF of an arXiv result, through the `Cassette` so the file can be recorded and replayed.
+
+    Args:
+        result (arxiv.Result): The search result.
+        dirpath (str): The directory to save the PDF in.
+        filename (str): The file name of the PDF.
+
+    Returns:
+        str: The path of the PDF.
+    """
+    path = os.path.join(dirpath, filename)
+    return Cassette().call_file("arxiv", "pdf", {"entry_id": result.entry_id},
+                                lambda: result.download_pdf(dirpath=dirpath, filename=filename), path)
+
 
 @rt.function_node
 async def search_and_download_papers(query: str, directory: str) -> str:
@@ -38,11 +97,7 @@ async def search_and_download_papers(query: str, directory: str) -> str:
     os.makedirs(directory, exist_ok=True)
 
     # Search arXiv
-    results = arxiv.Search(
-        query=query,
-        max_results=20,
-        sort_by=arxiv.SortCriterion.Relevance
-    )
+    results = search_arxiv(query, max_results=20)
 
     # Load or init VFS
     vfs = rt.context.get("vfs", {})
@@ -55,7 +110,7 @@ async def search_and_download_papers(query: str, directory: str) -> str:
     downloaded_paths = directories[directory]
 
     # Download papers
-    for paper in results.results():
+    for paper in results:
         print("Downloading:", paper.title)
         abstract = paper.summary
         titles.append(paper.title + "-" + abstract)
@@ -77,7 +132,7 @@ async def search_and_download_papers(query: str, directory: str) -> str:
         ) + ".pdf"
 
         try:
-            path = paper.download_pdf(dirpath=directory, filename=cleaned_title)
+            path = download_arxiv_pdf(paper, dirpath=directory, filename=cleaned_title)
             downloaded_paths.append(path)
         except Exception as e:
             print(f"Failed to download {paper.title}: {e}")
@@ -112,13 +167,9 @@ def execute_search(query: str) -> List[Dict[str, Any]]:
         - Only the first 5 results are returned.
     """
     time.sleep(3)
-    results = arxiv.Search(
-        query=query,
-        max_results=10,
-        sort_by=arxiv.SortCriterion.Relevance
-    )
+    results = search_arxiv(query, max_results=10)
     test_results = []
-    for result in results.results():
+    for result in results:
         entry_dict = {
             "title": result.title,
             "abstract": result.summary,
@@ -128,6 +179,7 @@ def execute_search(query: str) -> List[Dict[str, Any]]:
     return test_results
 
 @rt.function_node
+@instrumented("download_papers")
 def download_papers(paper_ids: List[str], directory:str):
     """
     Downloads papers from arXiv given a list of paper IDs and saves them to the specified directory.
@@ -139,22 +191,51 @@ def download_papers(paper_ids: List[str], directory:str):
     Returns:
         str: A message indicating which papers were downloaded and the target directory.
     """
+    directory = session_path(directory)
     os.makedirs(directory, exist_ok=True)
     vfs = rt.context.get("vfs")
+    downloaded = {split_arxiv_id(entry["id"])[0] for entry in vfs if "id" in entry}
+    already = [paper_id for paper_id in paper_ids if split_arxiv_id(paper_id)[0] in downloaded]
+    paper_ids, skipped = spend_download_budget([paper_id for paper_id in paper_ids if paper_id not in already])
+    failed = []
     for paper_id in paper_ids:
-        paper = arxiv.Search(id_list=[paper_id]).results()
-        paper = next(paper)
-        title = paper.title
         pdf_filename = f"{paper_id}.pdf"
         output_path = os.path.join(directory, pdf_filename)
-        paper.download_pdf(filename=output_path)
+        prefetched = Prefetcher().take(("arxiv", paper_id))
+        if prefetched is not None:
+            try:
+                shutil.move(prefetched["path"], output_path)
+            except OSError as e:
+                print(f"Could not use the prefetched {paper_id} ({e}), downloading it again")
+                prefetched = None
+        try:
+            if prefetched is not None:
+                title = prefetched["title"]
+            else:
+                paper = search_arxiv(id_list=[paper_id], max_results=1)[0]
+                title = paper.title
+                download_arxiv_pdf(paper, dirpath=directory, filename=pdf_filename)
+        except Exception as e:
+            print(f"Could not download {paper_id}: {e}")
+            failed.append(paper_id)
+            continue
         vfs_entry = {
             "id": paper_id,
             "description": title,
             "path": output_path,
         }
         vfs.append(vfs_entry)
-    return f"Downloaded {len(paper_ids)} papers. The papers are : {paper_ids}."
+        start_ingest(output_path)
+    refund_download_budget(len(failed))
+    downloaded_ids = [paper_id for paper_id in paper_ids if paper_id not in failed]
+    message = f"Downloaded {len(downloaded_ids)} papers. The papers are : {downloaded_ids}."
+    if already:
+        message += f" {already} were downloaded before."
+    if failed:
+        message += f" Could not download {failed}."
+    if skipped:
+        message += f" Skipped {skipped} because the download budget of the research brief is used up."
+    return message
 
 
 
@@ -189,6 +270,7 @@ def download_papers(paper_ids: List[str], directory:str):
 #     return f"Downloaded papers for {paper_ids} in {directory}, the current directory is state looks as follows {virtual_directory} With their paper id and saved paths."
 
 @rt.function_node
+@instrumented("execute_search_main")
 def execute_search_main(query: str) -> str:
     """
     Search arXiv for papers matching a query and return a list of metadata dictionaries.
@@ -206,23 +288,39 @@ def execute_search_main(query: str) -> str:
             - "abstract" (str): The paper's abstract.
 
     Notes:
-        - Results are sorted by arXiv relevance.
-        - Only the first 5 results are returned.
+        - Once a research brief exists, results are ranked by their relevance to it, see
+          `tools.triage`, and each has a "relevance" score. Otherwise they keep the arXiv order.
+        - The top results are prefetched in that order.
+    """
+    return format_arxiv_results(search_arxiv(query, max_results=10))
+
+
+def format_arxiv_results(results: list) -> str:
+    """
+    Ranks arXiv search results by the research brief, prefetches the top ones and formats them for the agent.
+
+    Kept apart from the search so that callers caching the search results still triage and
+    prefetch on every call.
+
+    Args:
+        results (List[arxiv.Result]): The results of `search_arxiv`.
+
+    Returns:
+        str: The title, abstract and paper id of every result, followed by the download budget.
     """
-    results = arxiv.Search(
-        query=query,
-        max_results=10,
-        sort_by=arxiv.SortCriterion.Relevance
-    )
     test_results = []
-    for result in results.results():
+    for result in results:
         entry_dict = {
             "title": result.title,
             "abstract": result.summary,
             "paper_id": result.get_short_id()
         }
         test_results.append(entry_dict)
-    return f"These are the results {test_results}"
+    test_results = triage_results(test_results, "paper_id", ("title", "abstract"))
+    by_id = {result.get_short_id(): result for result in results}
+    Prefetcher().prefetch_arxiv([by_id[entry["paper_id"]] for entry in test_results])
+    budget = download_budget_status()
+    return f"These are the results {test_results}" + (f"\n\n{budget}" if budget else "")
 
 @rt.function_node
 async def get_arxiv_query(query:str):
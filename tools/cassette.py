@@ -0,0 +1,360 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+from pydantic import BaseModel
+
+from singleton import SingletonMeta
+
+MODEL_METHODS = ("_chat", "_structured", "_chat_with_tools")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    key TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    response BLOB NOT NULL,
+    latency REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interactions_key ON interactions (key, occurrence);
+CREATE INDEX IF NOT EXISTS interactions_channel ON interactions (kind, channel, id);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def request_key(kind: str, channel: str, request: Any) -> str:
+    """Returns the digest a request is recorded and looked up under."""
+    canonical = json.dumps([kind, channel, request], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette(metaclass=SingletonMeta):
+    """
+    Records every LLM, arXiv and Tavily exchange of a run to disk, or serves them back.
+
+    `CASSETTE_MODE` is "off" (the default), "record" or "replay", and the cassette is the
+    SQLite file `CASSETTE_PATH` (default "session.cassette"). Responses are stored as
+    zlib-compressed JSON and PDFs as compressed blobs keyed by their digest, so a paper
+    fetched twice is stored once. Recording appends to an existing cassette.
+
+    A request is identified by the digest of its kind, channel (model and method, or API
+    method, and output schema of a structured call) and arguments. On replay, the n-th
+    identical request gets the n-th recorded response, or the last one if it was recorded
+    fewer times. A request that was never recorded raises `CassetteMiss`, so a benchmark
+    fails loudly when its requests drift. With `CASSETTE_STRICT=0` it instead gets the next
+    unserved response of the same channel in recording order, e.g. when a prompt contains a
+    fresh job id, so a rerun of the same session stays on track; only when the channel is
+    exhausted is `CassetteMiss` raised. Replayed calls
+    take no time with `CASSETTE_LATENCY=zero` (the default) and as long as they originally
+    did with `CASSETTE_LATENCY=original`.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.mode = os.getenv("CASSETTE_MODE", "off")
+        if self.mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unknown CASSETTE_MODE {self.mode!r}: use \"off\", \"record\" or \"replay\".")
+        self.latency = os.getenv("CASSETTE_LATENCY", "zero")
+        self.path = os.getenv("CASSETTE_PATH", "session.cassette")
+        self.strict = os.getenv("CASSETTE_STRICT", "1") != "0"
+        self.stats = {"recorded": 0, "replayed": 0, "replayed_out_of_order": 0, "missed": 0}
+        self._occurrences: Dict[str, int] = {}
+        self._served: Set[int] = set()
+        self._connection = None
+        if self.mode == "off":
+            return
+        if self.mode == "replay" and not os.path.exists(self.path):
+            raise FileNotFoundError(f"No cassette to replay at {self.path}.")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _next_occurrence(self, key: str) -> int:
+        occurrence = self._occurrences.get(key)
+        if occurrence is None and self.mode == "record":
+            occurrence = self._connection.execute(
+                "SELECT COUNT(*) FROM interactions WHERE key = ?", (key,)).fetchone()[0]
+        occurrence = occurrence or 0
+        self._occurrences[key] = occurrence + 1
+        return occurrence
+
+    def _record(self, kind: str, channel: str, key: str, response: Any, latency: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO interactions (kind, channel, key, occurrence, response, latency, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, channel, key, self._next_occurrence(key), _pack(response), latency, time.time()))
+            self.stats["recorded"] += 1
+
+    def _replay(self, kind: str, channel: str, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, response, latency FROM interactions WHERE key = ? AND occurrence <= ? "
+                "ORDER BY occurrence DESC LIMIT 1", (key, self._next_occurrence(key))).fetchone()
+            if row is not None:
+                self.stats["replayed"] += 1
+            elif self.strict:
+                self.stats["missed"] += 1
+                raise CassetteMiss(f"No recorded {kind} response for this {channel} request in {self.path}; "
+                                   f"set CASSETTE_STRICT=0 to replay the next response of the channel instead.")
+            else:
+                served = ",".join(str(served_id) for served_id in self._served) or "-1"
+                row = self._connection.execute(
+                    f"SELECT id, response, latency FROM interactions WHERE kind = ? AND channel = ? "
+                    f"AND id NOT IN ({served}) ORDER BY id LIMIT 1", (kind, channel)).fetchone()
+                if row is None:
+                    self.stats["missed"] += 1
+                    raise CassetteMiss(f"No recorded {kind} response for {channel} in {self.path}.")
+                self.stats["replayed_out_of_order"] += 1
+            self._served.add(row[0])
+        if self.latency == "original":
+            time.sleep(row[2])
+        return _unpack(row[1])
+
+    def call(self, kind: str, channel: str, request: Any, func: Callable[[], Any],
+             encode: Callable[[Any], Any] = None, decode: Callable[[Any], Any] = None):
+        """
+        Makes a call through the cassette.
+
+        Off, `func` is called. Recording, `func` is called and its encoded result stored;
+        failed calls are not recorded. Replaying, the recorded result is decoded and returned
+        without calling `func`.
+
+        Args:
+            kind (str): The service, e.g. "llm", "arxiv" or "tavily".
+            channel (str): The model and method or API method, e.g. "search".
+            request (Any): The JSON-serializable arguments identifying the call.
+            func (Callable[[], Any]): Makes the live call.
+            encode (Callable[[Any], Any], optional): Turns the result into JSON-serializable data.
+            decode (Callable[[Any], Any], optional): Turns recorded data back into a result.
+
+        Returns:
+            Any: The live or the replayed result.
+        """
+        if self.mode == "off":
+            return func()
+        key = request_key(kind, channel, request)
+        if self.mode == "replay":
+            data = self._replay(kind, channel, key)
+            return decode(data) if decode else data
+        start = time.perf_counter()
+        result = func()
+        latency = time.perf_counter() - start
+        self._record(kind, channel, key, encode(result) if encode else result, latency)
+        return result
+
+    def put_blob(self, data: bytes) -> str:
+        """Stores a blob, e.g. a PDF, once per content, and returns its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (digest, zlib.compress(data)))
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise CassetteMiss(f"No recorded blob {digest} in {self.path}.")
+        return zlib.decompress(row[0])
+
+    def call_file(self, kind: str, channel: str, request: Any, func: Callable[[], Any], path: str):
+        """
+        Makes a call that writes a file, e.g. a PDF download, through the cassette.
+
+        The file's content is recorded as a blob and written back to `path` on replay.
+
+        Args:
+            kind (str): The service.
+            channel (str): The API method.
+            request (Any): The JSON-serializable arguments identifying the call.
+            func (Callable[[], Any]): Makes the live call, which writes `path`.
+            path (str): The file the call writes.
+
+        Returns:
+            Any: The result of `func`, or `path` on replay.
+        """
+        def encode(_):
+            with open(path, "rb") as f:
+                return {"blob": self.put_blob(f.read())}
+
+        def decode(data):
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self.get_blob(data["blob"]))
+            return path
+
+        return self.call(kind, channel, request, func, encode, decode)
+
+    def prepare_model(self):
+        """Lets model clients be created without credentials when every call is replayed."""
+        if self.mode == "replay":
+            os.environ.setdefault("PORTKEY_API_KEY", "cassette-replay")
+
+    def wrap(self, model):
+        """
+        Routes the model's completion methods through the cassette.
+
+        Like `AIMDController.wrap`, the instance methods are replaced rather than hooked.
+        Wrap the model before the controller, so only the final response of a retried call
+        is recorded and replayed calls skip the controller's backoff.
+
+        Args:
+            model: The model, e.g. an `rt.llm.PortKeyLLM`.
+
+        Returns:
+            The same model.
+        """
+        if not self.enabled:
+            return model
+        model_name = model.model_name()
+        for name in MODEL_METHODS:
+            method = getattr(model, name)
+
+            @wraps(method)
+            def recorded(messages, *args, _method=method, _name=name, **kwargs):
+                # _structured takes the output schema and _chat_with_tools the tools after the messages.
+                request = {"messages": [[message.role.value, encode_content(message.content)]
+                                        for message in messages]}
+                schema = None
+                if _name == "_structured":
+                    schema = args[0]
+                    request["schema"] = schema.model_json_schema()
+                elif _name == "_chat_with_tools":
+                    request["tools"] = sorted(tool.name for tool in args[0])
+                # The schema is part of the channel, so an out-of-order replay never crosses schemas.
+                channel = f"{model_name}.{_name}:{schema.__name__}" if schema is not None else f"{model_name}.{_name}"
+                return self.call("llm", channel, request,
+                                 lambda: _method(messages, *args, **kwargs), encode_response,
+                                 lambda data: decode_response(data, schema))
+
+            setattr(model, name, recorded)
+        return model
+
+    def report(self) -> str:
+        """
+        Summarizes the cassette's use in this process.
+
+        Returns:
+            str: The mode, the file and how many calls were recorded, replayed or missed.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        return (f"cassette {self.mode} ({self.path}): {stats['recorded']} recorded, {stats['replayed']} replayed, "
+                f"{stats['replayed_out_of_order']} replayed out of order, {stats['missed']} missed")
+
+
+def encode_content(content: Any) -> Any:
+    """Turns the content of a message into JSON-serializable data."""
+    from railtracks.llm import ToolResponse
+
+    if isinstance(content, str):
+        return content
+    if isinstance(content, ToolResponse):
+        return {"tool_response": {"identifier": content.identifier, "name": content.name,
+                                  "result": str(content.result)}}
+    if isinstance(content, list):
+        return {"tool_calls": [{"identifier": call.identifier, "name": call.name, "arguments": call.arguments}
+                               for call in content]}
+    if isinstance(content, BaseModel):
+        return {"structured": content.model_dump(mode="json")}
+    return str(content)
+
+
+def encode_response(response) -> Dict[str, Any]:
+    """Turns a model `Response` into JSON-serializable data."""
+    info = response.message_info
+    return {"content": encode_content(response.message.content),
+            "info": {"input_tokens": info.input_tokens, "output_tokens": info.output_tokens,
+                     "latency": info.latency, "model_name": info.model_name, "total_cost": info.total_cost,
+                     "system_fingerprint": info.system_fingerprint}}
+
+
+def decode_response(data: Dict[str, Any], schema: Optional[type] = None):
+    """
+    Rebuilds a model `Response` from `encode_response` data.
+
+    Args:
+        data (Dict[str, Any]): The recorded data.
+        schema (type, optional): The output schema of a structured call.
+
+    Returns:
+        Response: The response.
+    """
+    from railtracks.llm import AssistantMessage, ToolCall
+    from railtracks.llm.response import MessageInfo, Response
+
+    content = data["content"]
+    if isinstance(content, dict) and "tool_calls" in content:
+        content = [ToolCall(**call) for call in content["tool_calls"]]
+    elif isinstance(content, dict) and "structured" in content:
+        content = schema(**content["structured"])
+    return Response(message=AssistantMessage(content), message_info=MessageInfo(**data["info"]))
+
+
+class RecordedClient:
+    """
+    A lazily created API client whose `methods` go through the cassette.
+
+    The client is only created when a call is made live, so replay needs neither the
+    SDK's credentials nor its network access. Other attributes are taken from the client.
+    """
+
+    def __init__(self, kind: str, factory: Callable[[], Any], methods: Iterable[str]):
+        """
+        Args:
+            kind (str): The service, e.g. "tavily".
+            factory (Callable[[], Any]): Creates the client.
+            methods (Iterable[str]): The methods to record, returning JSON-serializable results.
+        """
+        self._kind = kind
+        self._factory = factory
+        self._methods = frozenset(methods)
+        self._client = None
+        self._lock = Lock()
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._factory()
+            return self._client
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name not in self._methods:
+            return getattr(self._get_client(), name)
+
+        def recorded(*args, **kwargs):
+            return Cassette().call(self._kind, name, {"args": list(args), "kwargs": kwargs},
+                                   lambda: getattr(self._get_client(), name)(*args, **kwargs))
+
+        return recorded
@@ -0,0 +1,363 @@
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from tools.evidence import Paragraph, Rect
+from tools.util_tools import count_tokens
+
+# Sections whose text never goes to the note-taking agent.
+SKIPPED_SECTION_PATTERN = re.compile(
+    r"^(references|bibliography|works cited|literature cited|acknowledge?ments?|funding|"
+    r"author contributions?|competing interests|conflicts? of interest|declaration of competing interest|"
+    r"ethics statement|data availability( statement)?|code availability|(table of )?contents)$", re.IGNORECASE)
+APPENDIX_PATTERN = re.compile(r"^(appendix|appendices|supplementary material|supplemental material)\b", re.IGNORECASE)
+KNOWN_HEADING_PATTERN = re.compile(
+    r"^(abstract|introduction|background|related work|method(s|ology)?|approach|experiments?|results|evaluation|"
+    r"discussion|limitations|conclusions?|future work)$", re.IGNORECASE)
+NUMBERED_HEADING_PATTERN = re.compile(r"^((\d+(\.\d+)*)|([IVX]+))\.?\s+[A-Z]")
+APPENDIX_HEADING_PATTERN = re.compile(r"^[A-Z](\.\d+)*\.?\s+[A-Z]")
+PAGE_NUMBER_PATTERN = re.compile(r"^((page\s+)?\d+(\s+of\s+\d+)?|[ivx]+)$", re.IGNORECASE)
+BOILERPLATE_PATTERN = re.compile(
+    r"^(arXiv:\d{4}\.\d{4,5}|preprint\b|under review\b|copyright\b|©|\(c\) \d{4}|"
+    r"permission to make digital or hard copies|licensed under)", re.IGNORECASE)
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s+")
+# Sections a skim reads, see `skim_chunk_indices`.
+SKIM_SECTION_PATTERN = re.compile(
+    r"^(abstract|introduction|conclusions?|concluding remarks|summary|discussion and conclusions?|"
+    r"conclusions? and future work)$", re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class TextBlock:
+    """A text block of a PDF with the layout hints the chunker needs."""
+    paragraph: Paragraph
+    font_size: float
+    bold: bool
+    lines: int
+
+
+@dataclass
+class ChunkingStats:
+    """How a document was reduced from text blocks to note-taking chunks."""
+    blocks: int = 0
+    block_tokens: int = 0
+    boilerplate: int = 0
+    skipped_sections: int = 0
+    chunks: int = 0
+    chunk_tokens: int = 0
+
+    def __str__(self) -> str:
+        return (f"{self.blocks} blocks (~{self.block_tokens} tokens) -> {self.chunks} chunks "
+                f"(~{self.chunk_tokens} tokens); dropped {self.boilerplate} boilerplate blocks and "
+                f"{self.skipped_sections} blocks of references, acknowledgements and appendices")
+
+
+def load_pdf_blocks(pdf_path: str) -> List[TextBlock]:
+    """
+    Extracts the text blocks of a PDF with their dominant font size and weight.
+
+    The text and character offsets are the same as those of `load_pdf_paragraphs`.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+
+    Returns:
+        List[TextBlock]: The blocks of the PDF in reading order.
+    """
+    import fitz  # PyMuPDF
+
+    doc = fitz.open(pdf_path)
+    blocks = []
+    offset = 0
+
+    for page_number, page in enumerate(doc):
+        for block in page.get_text("dict")["blocks"]:
+            # Only process text blocks
+            if block.get("type") != 0:
+                continue
+            sizes = Counter()
+            bold = Counter()
+            lines = []
+            for line in block["lines"]:
+                lines.append("".join(span["text"] for span in line["spans"]))
+                for span in line["spans"]:
+                    sizes[round(span["size"], 1)] += len(span["text"])
+                    bold[bool(span["flags"] & 16)] += len(span["text"])
+            text = "\n".join(lines).replace("\r", "").strip()
+            if not text:
+                continue
+            paragraph = Paragraph(text, page_number, tuple(block["bbox"]), offset)
+            blocks.append(TextBlock(paragraph, sizes.most_common(1)[0][0], bold.most_common(1)[0][0], len(lines)))
+            offset += len(text) + 2
+
+    doc.close()
+    return blocks
+
+
+def _normalized(text: str) -> str:
+    return re.sub(r"\d+", "#", " ".join(text.lower().split()))
+
+
+def _repeated_margin_texts(blocks: List[TextBlock], pages: int) -> set:
+    # Running headers and footers repeat on many pages, usually with a changing page number.
+    if pages < 3:
+        return set()
+    seen = Counter()
+    for block in blocks:
+        if block.lines <= 2:
+            seen[_normalized(block.paragraph.text)] += 1
+    return {text for text, count in seen.items() if count >= max(3, pages * 0.3)}
+
+
+def is_boilerplate(block: TextBlock, repeated: set, heading: bool = False) -> bool:
+    """
+    Tells whether a block is page furniture rather than content.
+
+    Page numbers, running headers and footers, arXiv stamps, copyright and license lines
+    and fragments of fewer than three words that are not headings, e.g. figure axis labels,
+    are boilerplate.
+
+    Args:
+        block (TextBlock): The block.
+        repeated (set): The normalized texts of blocks repeated across pages.
+        heading (bool): Whether the block is a section heading.
+
+    Returns:
+        bool: True if the block should not be read.
+    """
+    text = " ".join(block.paragraph.text.split())
+    if PAGE_NUMBER_PATTERN.match(text) or BOILERPLATE_PATTERN.match(text):
+        return True
+    if _normalized(text) in repeated:
+        return True
+    return not heading and len(re.findall(r"[^\W\d_]{2,}", text)) < 3 and len(re.findall(r"[^\W\d_]", text)) < 20
+
+
+def heading_title(block: TextBlock, body_size: float) -> Optional[str]:
+    """
+    Returns the title of a block that is a section heading.
+
+    A heading is a short block of at most two lines that is numbered ("3.1 Results",
+    "IV. Method", "A Proofs"), is a well-known section name, or is set larger or bolder than
+    the body text.
+
+    Args:
+        block (TextBlock): The block.
+        body_size (float): The font size of the body text.
+
+    Returns:
+        Optional[str]: The heading without its number, or None if the block is not a heading.
+    """
+    text = " ".join(block.paragraph.text.split())
+    if block.lines > 2 or len(text.split()) > 12 or text.endswith((".", ",", ";", ":")) and len(text.split()) > 3:
+        return None
+    title = re.sub(r"^((\d+(\.\d+)*)|([IVX]+)|([A-Z](\.\d+)*))\.?\s+", "", text) if (
+            NUMBERED_HEADING_PATTERN.match(text) or APPENDIX_HEADING_PATTERN.match(text)) else text
+    if KNOWN_HEADING_PATTERN.match(title) or SKIPPED_SECTION_PATTERN.match(title) or APPENDIX_PATTERN.match(title):
+        return title
+    if NUMBERED_HEADING_PATTERN.match(text):
+        return title
+    if (block.font_size >= body_size * 1.15 or block.bold) and (
+            title != text or len(re.findall(r"[^\W\d_]{2,}", title)) >= 2):
+        return title
+    return None
+
+
+def _split_block(paragraph: Paragraph, max_tokens: int) -> List[Paragraph]:
+    # Splits an oversized block at sentence boundaries, keeping character offsets exact.
+    pieces = []
+    start = 0
+    end = 0
+    for match in SENTENCE_END_PATTERN.finditer(paragraph.text + " "):
+        if end > start and count_tokens(paragraph.text[start:match.start()]) > max_tokens:
+            pieces.append((start, end))
+            start = end
+        end = match.end()
+    if start < len(paragraph.text):
+        pieces.append((start, len(paragraph.text)))
+    return [Paragraph(paragraph.text[s:e].strip(), paragraph.page, paragraph.bbox, paragraph.start + s)
+            for s, e in pieces if paragraph.text[s:e].strip()]
+
+
+def _merge(paragraphs: List[Paragraph]) -> Paragraph:
+    # A chunk keeps the page of its first block and the area its blocks cover on that page.
+    first = paragraphs[0]
+    rects = [p.bbox for p in paragraphs if p.page == first.page]
+    bbox: Rect = (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects),
+                  max(r[3] for r in rects))
+    return Paragraph("\n\n".join(p.text for p in paragraphs), first.page, bbox, first.start)
+
+
+def chunk_blocks(blocks: List[TextBlock], pages: int, min_tokens: int = None, max_tokens: int = None,
+                 skip_appendix: bool = None) -> Tuple[List[Paragraph], ChunkingStats]:
+    """
+    Turns the text blocks of a document into note-taking chunks of a bounded token size.
+
+    Boilerplate is dropped, and so is every section titled like the references,
+    acknowledgements or appendices, up to the next regular section heading. The remaining
+    blocks of a section are merged until a chunk reaches `min_tokens`, without exceeding
+    `max_tokens`; blocks larger than `max_tokens` are split at sentence boundaries. A section
+    heading starts a new chunk unless the chunk so far is under half of `min_tokens`, e.g. a
+    title page or a one-paragraph section, which then shares its chunk with the next section.
+
+    Merged chunks keep the page of their first block, the rectangle their blocks cover on
+    that page and the character offset of their first block. Sentence spans inside a chunk
+    are approximate when a dropped block, e.g. a page number, sat between its blocks.
+
+    Args:
+        blocks (List[TextBlock]): The blocks, as returned by `load_pdf_blocks`.
+        pages (int): The number of pages of the document.
+        min_tokens (int, optional): Defaults to `CHUNK_MIN_TOKENS` or 300.
+        max_tokens (int, optional): Defaults to `CHUNK_MAX_TOKENS` or 1000.
+        skip_appendix (bool, optional): Defaults to `CHUNK_SKIP_APPENDIX` ("1").
+
+    Returns:
+        Tuple[List[Paragraph], ChunkingStats]: The chunks in reading order and how they were made.
+    """
+    min_tokens = min_tokens or int(os.getenv("CHUNK_MIN_TOKENS", "300"))
+    max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+    if skip_appendix is None:
+        skip_appendix = os.getenv("CHUNK_SKIP_APPENDIX", "1") == "1"
+    stats = ChunkingStats(blocks=len(blocks), block_tokens=sum(count_tokens(b.paragraph.text) for b in blocks))
+    if not blocks:
+        return [], stats
+
+    sizes = Counter()
+    for block in blocks:
+        sizes[block.font_size] += len(block.paragraph.text)
+    body_size = sizes.most_common(1)[0][0]
+    repeated = _repeated_margin_texts(blocks, pages)
+
+    chunks: List[Paragraph] = []
+    chunk_tokens: List[int] = []
+    current: List[Paragraph] = []
+    current_tokens = 0
+    skipping = False
+    in_appendix = False
+
+    def flush():
+        nonlocal current, current_tokens
+        if current and chunks and current_tokens < min_tokens // 2 and chunk_tokens[-1] + current_tokens <= max_tokens:
+            # A leftover too small to be worth a call joins the chunk before it.
+            chunks[-1] = _merge([chunks[-1]] + current)
+            chunk_tokens[-1] += current_tokens
+        elif current:
+            chunks.append(_merge(current))
+            chunk_tokens.append(current_tokens)
+        current, current_tokens = [], 0
+
+    for block in blocks:
+        title = heading_title(block, body_size)
+        if is_boilerplate(block, repeated, heading=title is not None):
+            stats.boilerplate += 1
+            continue
+        if title is not None:
+            if SKIPPED_SECTION_PATTERN.match(title):
+                skipping = True
+            elif APPENDIX_PATTERN.match(title):
+                in_appendix, skipping = True, skip_appendix
+            elif in_appendix:
+                skipping = skip_appendix
+            elif skipping and APPENDIX_HEADING_PATTERN.match(" ".join(block.paragraph.text.split())):
+                # Lettered sections after the references are appendices.
+                in_appendix, skipping = True, skip_appendix
+            else:
+                skipping = False
+            if skipping or current_tokens >= min_tokens // 2:
+                flush()
+        if skipping:
+            stats.skipped_sections += 1
+            continue
+        tokens = count_tokens(block.paragraph.text)
+        if tokens > max_tokens:
+            flush()
+            for piece in _split_block(block.paragraph, max_tokens):
+                chunks.append(piece)
+                chunk_tokens.append(count_tokens(piece.text))
+            continue
+        if current and (current_tokens + tokens > max_tokens or current_tokens >= min_tokens):
+            flush()
+        current.append(block.paragraph)
+        current_tokens += tokens
+    flush()
+
+    stats.chunks = len(chunks)
+    stats.chunk_tokens = sum(chunk_tokens)
+    return chunks, stats
+
+
+def load_pdf_chunks(pdf_path: str) -> List[Paragraph]:
+    """
+    Loads a PDF as note-taking chunks, see `chunk_blocks`, and prints how it was chunked.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+
+    Returns:
+        List[Paragraph]: The chunks of the PDF in reading order.
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        pages = doc.page_count
+    chunks, stats = chunk_blocks(load_pdf_blocks(pdf_path), pages)
+    print(f"Chunked {os.path.basename(pdf_path)}: {stats}")
+    return chunks
+
+
+def _heading_lines(text: str) -> List[str]:
+    # Short lines that look like section headings, without their numbers. Numbers of more than
+    # two digits and lines ending in a period are usually years and reference entries.
+    titles = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line or len(line.split()) > 8 or line.endswith("."):
+            continue
+        numbered = re.match(r"^((\d{1,2}(\.\d+)*)|([IVX]+))\.?\s+[A-Z]", line)
+        title = re.sub(r"^((\d+(\.\d+)*)|([IVX]+))\.?\s+", "", line) if numbered else line
+        if numbered or KNOWN_HEADING_PATTERN.match(title) or SKIM_SECTION_PATTERN.match(title):
+            titles.append(title)
+    return titles
+
+
+def skim_chunk_indices(chunks: List[Paragraph], max_chunks: int = None) -> List[int]:
+    """
+    Picks the chunks a skim of a paper reads: the abstract, the introduction and the conclusion.
+
+    Chunks do not carry their section, so the sections are followed through the heading
+    lines inside the chunk texts. The first chunk (title and abstract) and the last one
+    (usually the conclusion, as references and appendices are dropped) are always picked;
+    if no introduction is recognized, the opening chunks stand in for it. At most
+    `max_chunks` chunks are picked, the introduction being cut short first.
+
+    Args:
+        chunks (List[Paragraph]): The chunks of the paper in reading order, see `chunk_blocks`.
+        max_chunks (int, optional): Defaults to `SKIM_MAX_CHUNKS` or 6.
+
+    Returns:
+        List[int]: The indices of the picked chunks, in reading order.
+    """
+    max_chunks = max_chunks or int(os.getenv("SKIM_MAX_CHUNKS", "6"))
+    if not chunks:
+        return []
+    section = ""
+    picked = []
+    found_introduction = False
+    for index, chunk in enumerate(chunks):
+        titles = _heading_lines(chunk.text)
+        first_line = " ".join(chunk.text.strip().split("\n", 1)[0].split())
+        # A chunk opening with a heading does not belong to the section before it.
+        sections = titles if titles and first_line.endswith(titles[0]) else [section] + titles
+        section = sections[-1] if sections else section
+        found_introduction = found_introduction or any(title.lower() == "introduction" for title in titles)
+        if index == 0 or index == len(chunks) - 1 or any(SKIM_SECTION_PATTERN.match(title) for title in sections):
+            picked.append(index)
+    if not found_introduction:
+        picked = sorted(set(picked) | set(range(min(3, len(chunks)))))
+    if len(picked) > max_chunks:
+        # Keep the first chunks and the conclusion, dropping the middle of the introduction.
+        tail = max(1, max_chunks // 2)
+        picked = picked[:max_chunks - tail] + picked[-tail:]
+    return picked
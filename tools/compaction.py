@@ -0,0 +1,245 @@
+import os
+from functools import wraps
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import railtracks as rt
+from railtracks.llm import AssistantMessage, Message, MessageHistory, SystemMessage, ToolMessage, ToolResponse, \
+    UserMessage
+
+from tools.todo_tools import format_todo
+from tools.util_tools import count_tokens
+
+COMPACTED_PREFIX = "[Compacted"
+
+
+class ToolOutputArchive:
+    """
+    Full tool outputs of a session that were compacted out of the prompt, by handle.
+
+    The archive lives in the railtracks context under "tool_output_archive", so the
+    `recall_tool_output` tool of the same session can return the original text.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._handles: Dict[str, str] = {}
+        self._outputs: Dict[str, Tuple[str, str]] = {}
+
+    def add(self, identifier: str, name: str, result: str) -> str:
+        """
+        Stores a tool output, once per tool call.
+
+        Args:
+            identifier (str): The identifier of the tool call.
+            name (str): The name of the tool.
+            result (str): The full output.
+
+        Returns:
+            str: The handle of the output, e.g. "out-3".
+        """
+        with self._lock:
+            handle = self._handles.get(identifier)
+            if handle is None:
+                handle = f"out-{len(self._handles) + 1}"
+                self._handles[identifier] = handle
+                self._outputs[handle] = (name, result)
+            return handle
+
+    def get(self, handle: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._outputs.get(handle)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._outputs)
+
+
+def get_tool_output_archive() -> ToolOutputArchive:
+    archive = rt.context.get("tool_output_archive", False)
+    if not archive:
+        archive = ToolOutputArchive()
+        rt.context.put("tool_output_archive", archive)
+    return archive
+
+
+@rt.function_node
+def recall_tool_output(handle: str) -> str:
+    """
+    Return the full output of an earlier tool call that was compacted out of the conversation.
+
+    Args:
+        handle (str): The handle shown in the compacted message, e.g. "out-3".
+
+    Returns:
+        str: The original tool output, or a message if the handle is unknown.
+    """
+    output = get_tool_output_archive().get(handle.strip())
+    if output is None:
+        return f"No compacted tool output with handle {handle}."
+    name, result = output
+    return f"Output of {name} ({handle}):\n\n{result}"
+
+
+def _message_tokens(message: Message) -> int:
+    content = message.content
+    if isinstance(content, ToolResponse):
+        content = content.result
+    return count_tokens(str(content))
+
+
+def _format_call(name: str, arguments: dict, max_chars: int = 120) -> str:
+    text = f"{name}({', '.join(f'{key}={value!r}' for key, value in (arguments or {}).items())})"
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class HistoryCompactor:
+    """
+    Keeps the prompt of a long-running tool-calling agent, like the Research Coordinator, bounded.
+
+    Once the message history of a request exceeds `threshold` tokens, it is compacted
+    before it is sent; the agent's own history is left untouched, so every request is
+    compacted from the full history again and compacted messages stay identical across
+    turns. Two steps are applied:
+
+    1. Every tool output older than the last `keep_recent` messages is archived in the
+       session's `ToolOutputArchive` and replaced with its first `summary_chars` characters
+       and a handle the agent can pass to `recall_tool_output`.
+    2. If that is not enough, everything older than the last `keep_recent` messages is
+       folded into one message listing the earlier requests, replies and tool calls with
+       their handles, the last `fold_lines` of them.
+
+    The research brief and the todo list are pinned: a compacted prompt always carries their
+    current values from the context right after the system prompt.
+    """
+
+    def __init__(self, threshold: int = None, keep_recent: int = None, summary_chars: int = None,
+                 fold_lines: int = None):
+        """
+        Args:
+            threshold (int, optional): The prompt size in tokens that triggers compaction. Defaults to
+                `COMPACTION_THRESHOLD_TOKENS` or 30000; 0 disables compaction.
+            keep_recent (int, optional): The number of latest messages never compacted. Defaults to
+                `COMPACTION_KEEP_RECENT` or 10.
+            summary_chars (int, optional): The length of the excerpt kept of a compacted tool output.
+                Defaults to `COMPACTION_SUMMARY_CHARS` or 300.
+            fold_lines (int, optional): The number of entries listed for the folded messages.
+                Defaults to `COMPACTION_FOLD_LINES` or 60.
+        """
+        self.threshold = int(threshold if threshold is not None else os.getenv("COMPACTION_THRESHOLD_TOKENS", "30000"))
+        self.keep_recent = int(keep_recent if keep_recent is not None else os.getenv("COMPACTION_KEEP_RECENT", "10"))
+        self.summary_chars = int(summary_chars if summary_chars is not None
+                                 else os.getenv("COMPACTION_SUMMARY_CHARS", "300"))
+        self.fold_lines = int(fold_lines if fold_lines is not None else os.getenv("COMPACTION_FOLD_LINES", "60"))
+
+    def _recent_start(self, body: List[Message]) -> int:
+        start = max(0, len(body) - self.keep_recent)
+        # Tool outputs must follow the assistant message that called them.
+        while start > 0 and isinstance(body[start], ToolMessage):
+            start -= 1
+        return start
+
+    def _archive(self, message: ToolMessage, archive: ToolOutputArchive) -> ToolMessage:
+        response = message.content
+        result = str(response.result)
+        if result.startswith(COMPACTED_PREFIX) or len(result) <= 2 * self.summary_chars:
+            return message
+        handle = archive.add(response.identifier, response.name, result)
+        excerpt = " ".join(result.split())[:self.summary_chars]
+        text = (f"{COMPACTED_PREFIX} output of {response.name}, {count_tokens(result)} tokens. "
+                f"Call recall_tool_output(\"{handle}\") for the full text.] {excerpt}...")
+        return ToolMessage(ToolResponse(identifier=response.identifier, name=response.name, result=text))
+
+    def _fold(self, messages: List[Message], archive: ToolOutputArchive) -> UserMessage:
+        calls = {}
+        lines = []
+        for message in messages:
+            if isinstance(message, ToolMessage):
+                response = message.content
+                handle = archive.add(response.identifier, response.name, str(response.result))
+                lines.append(f"- {calls.get(response.identifier, response.name)} -> recall_tool_output(\"{handle}\")")
+            elif isinstance(message, AssistantMessage) and isinstance(message.content, list):
+                for call in message.content:
+                    calls[call.identifier] = _format_call(call.name, call.arguments)
+            elif isinstance(message, (UserMessage, AssistantMessage)):
+                text = " ".join(str(message.content).split())
+                lines.append(f"- {message.role.value}: {text[:200]}{'...' if len(text) > 200 else ''}")
+        omitted = len(lines) - self.fold_lines
+        if omitted > 0:
+            lines = [f"- ({omitted} earlier entries omitted)"] + lines[-self.fold_lines:]
+        return UserMessage("[Earlier conversation compacted to keep the prompt short. Handles can be "
+                           "passed to recall_tool_output.]\n" + "\n".join(lines), inject_prompt=False)
+
+    def _pinned(self) -> Optional[SystemMessage]:
+        parts = []
+        brief = rt.context.get("research_brief", "")
+        if brief:
+            parts.append(f"Research brief (pinned):\n{brief}")
+        todo = rt.context.get("todo", [])
+        if todo:
+            parts.append(f"Current todo list (pinned):\n{format_todo(todo)}")
+        if not parts:
+            return None
+        return SystemMessage("\n\n".join(parts), inject_prompt=False)
+
+    def compact(self, messages: MessageHistory) -> MessageHistory:
+        """
+        Returns the messages to send, compacted if they exceed the threshold.
+
+        Args:
+            messages (MessageHistory): The full message history of the request.
+
+        Returns:
+            MessageHistory: The same history if it is small enough, otherwise a compacted copy.
+        """
+        if self.threshold <= 0:
+            return messages
+        tokens = sum(_message_tokens(message) for message in messages)
+        if tokens <= self.threshold:
+            return messages
+        head = 0
+        while head < len(messages) and isinstance(messages[head], SystemMessage):
+            head += 1
+        system, body = list(messages[:head]), list(messages[head:])
+        recent = self._recent_start(body)
+        archive = get_tool_output_archive()
+
+        older = [self._archive(message, archive) if isinstance(message, ToolMessage) else message
+                 for message in body[:recent]]
+        pinned = self._pinned()
+        compacted = system + ([pinned] if pinned else []) + older + body[recent:]
+        compacted_tokens = sum(_message_tokens(message) for message in compacted)
+        folded = 0
+        if compacted_tokens > self.threshold and recent > 0:
+            compacted = system + ([pinned] if pinned else []) + [self._fold(body[:recent], archive)] + body[recent:]
+            compacted_tokens = sum(_message_tokens(message) for message in compacted)
+            folded = recent
+        print(f"Compacted message history: {len(messages)} messages, {tokens} tokens -> {len(compacted)} messages, "
+              f"{compacted_tokens} tokens ({len(archive)} tool outputs archived, {folded} messages folded)")
+        return MessageHistory(compacted)
+
+    def wrap(self, model):
+        """
+        Compacts the history of every tool-calling request of a model.
+
+        Like `AIMDController.wrap`, the instance method is replaced rather than hooked, and a
+        model is only wrapped once.
+
+        Args:
+            model: The model, a client only the wrapping agent uses, e.g. the Research Coordinator's
+                `get_stage_llm("coordinator", client="coordinator")`.
+
+        Returns:
+            The same model.
+        """
+        if getattr(model, "_history_compactor", None) is not None:
+            return model
+        method = model._chat_with_tools
+
+        @wraps(method)
+        def compacted(messages, tools, *args, **kwargs):
+            return method(self.compact(messages), tools, *args, **kwargs)
+
+        model._chat_with_tools = compacted
+        model._history_compactor = self
+        return model
@@ -0,0 +1,143 @@
+import json
+import re
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
+
+Rect = Tuple[float, float, float, float]
+
+
+@dataclass(frozen=True, slots=True)
+class Paragraph:
+    """A text block of a PDF together with where it was extracted from."""
+    text: str
+    page: int
+    bbox: Rect
+    start: int
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+
+@dataclass(frozen=True, slots=True)
+class EvidenceRecord:
+    """
+    A pointer from a note or an important sentence back to its source.
+
+    `page` is zero-based, `bbox` is the (x0, y0, x1, y1) rectangle of the source block
+    on that page and `start`/`end` is the character span in the document text, i.e.
+    the paragraphs joined by blank lines. A sentence that could not be located inside
+    its paragraph keeps the paragraph span.
+    """
+    document: str
+    kind: str
+    text: str
+    page: int
+    bbox: Rect
+    start: int
+    end: int
+
+
+def _locate(sentence: str, paragraph: Paragraph) -> Tuple[int, int]:
+    offset = paragraph.text.find(sentence)
+    if offset >= 0:
+        return paragraph.start + offset, paragraph.start + offset + len(sentence)
+    # Extraction keeps line breaks that the LLM usually collapses into spaces.
+    words = sentence.split()
+    if words:
+        pattern = r"\s+".join(re.escape(word) for word in words)
+        match = re.search(pattern, paragraph.text)
+        if match:
+            return paragraph.start + match.start(), paragraph.start + match.end()
+    return paragraph.start, paragraph.end
+
+
+class EvidenceStore:
+    """Evidence records of every document read in a session, grouped by document."""
+
+    def __init__(self):
+        self.records: Dict[str, List[EvidenceRecord]] = {}
+
+    def add_note(self, document: str, paragraph: Paragraph, note: str) -> EvidenceRecord:
+        """
+        Records a note taken on a paragraph.
+
+        Args:
+            document (str): The path of the source document.
+            paragraph (Paragraph): The paragraph the note was taken on.
+            note (str): The note.
+
+        Returns:
+            EvidenceRecord: The stored record, spanning the whole paragraph.
+        """
+        record = EvidenceRecord(document, "note", note, paragraph.page, paragraph.bbox, paragraph.start, paragraph.end)
+        self.records.setdefault(document, []).append(record)
+        return record
+
+    def add_sentence(self, document: str, paragraph: Paragraph, sentence: str) -> EvidenceRecord:
+        """
+        Records an important sentence quoted from a paragraph.
+
+        Args:
+            document (str): The path of the source document.
+            paragraph (Paragraph): The paragraph the sentence was quoted from.
+            sentence (str): The sentence.
+
+        Returns:
+            EvidenceRecord: The stored record with the character span of the sentence.
+        """
+        start, end = _locate(sentence, paragraph)
+        record = EvidenceRecord(document, "sentence", sentence, paragraph.page, paragraph.bbox, start, end)
+        self.records.setdefault(document, []).append(record)
+        return record
+
+    def for_document(self, document: str, kind: str = None) -> List[EvidenceRecord]:
+        """
+        Returns the records of one document, optionally only those of one kind.
+
+        Args:
+            document (str): The path of the source document.
+            kind (str, optional): "note" or "sentence".
+
+        Returns:
+            List[EvidenceRecord]: The records in the order they were added.
+        """
+        records = self.records.get(document, [])
+        if kind is None:
+            return list(records)
+        return [record for record in records if record.kind == kind]
+
+    def save(self, file_path: str, document: str = None):
+        """
+        Writes the records as JSON lines, one record per line.
+
+        Args:
+            file_path (str): The file to write.
+            document (str, optional): Only write the records of this document.
+        """
+        documents = [document] if document is not None else list(self.records)
+        with open(file_path, "w", encoding="utf-8") as f:
+            for name in documents:
+                for record in self.records.get(name, []):
+                    f.write(json.dumps(asdict(record)) + "\n")
+
+    @classmethod
+    def load(cls, file_path: str) -> "EvidenceStore":
+        """
+        Reads records written by `save`.
+
+        Args:
+            file_path (str): The file to read.
+
+        Returns:
+            EvidenceStore: A store holding the records.
+        """
+        store = cls()
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    data["bbox"] = tuple(data["bbox"])
+                    record = EvidenceRecord(**data)
+                    store.records.setdefault(record.document, []).append(record)
+        return store
@@ -0,0 +1,162 @@
+import asyncio
+import os
+from concurrent.futures import Future, InvalidStateError
+from threading import Event, Lock, Thread
+from typing import Dict, Optional, Tuple
+
+import railtracks as rt
+
+
+def _settle(future: Future, result=None, error: BaseException = None):
+    """Resolves a reading's future, unless its reader already cancelled it."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class StreamingIngest:
+    """
+    Reads every document as soon as its download completes, while the rest still download.
+
+    The download tools hand each finished file to `submit`. The documents are read on a
+    dedicated thread, in a railtracks session of their own, by one long-running worker node
+    that starts a reading task per document, so reading outlives the download tool call
+    and the coordinator's turn. The reading tool then only waits, through `get`, for the
+    documents that are still in flight. Enabled with `STREAMING_INGEST=1`; it needs the
+    research brief, so documents downloaded before the brief exists are read later as usual.
+
+    The reading tool closes the ingest when it is done. A document whose reading failed, or
+    that was still queued when the worker stopped, e.g. because its session timed out, has
+    its future failed, so the reading tool reads it itself.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._futures: Dict[str, Tuple[str, Future]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready = Event()
+        self._thread: Optional[Thread] = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=asyncio.run, args=(self._run(),), name="streaming-ingest", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        try:
+            with rt.Session(context={"ingest_queue": self._queue},
+                            timeout=float(os.getenv("INGEST_TIMEOUT", "86400")), name="streaming-ingest"):
+                await rt.call(run_ingest_worker)
+        except Exception as e:
+            print(f"Streaming ingest stopped: {e}")
+        finally:
+            with self._lock:
+                # A later submit starts a new worker.
+                self._thread = None
+                self._ready.clear()
+                pending = [future for _, future in self._futures.values() if not future.done()]
+            for future in pending:
+                _settle(future, error=RuntimeError("Streaming ingest stopped before the document was read."))
+
+    def submit(self, file: str, user_research_brief: str) -> Future:
+        """
+        Queues a downloaded document for reading.
+
+        Args:
+            file (str): The path of the PDF.
+            user_research_brief (str): The research brief to take notes against.
+
+        Returns:
+            Future: Resolves to the `PaperReading` of the document.
+        """
+        self._start()
+        future = Future()
+        with self._lock:
+            self._futures[file] = (user_research_brief, future)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (file, user_research_brief, future))
+        return future
+
+    def get(self, file: str, user_research_brief: str) -> Optional[Future]:
+        """
+        Returns the reading of a document if it was ingested against the same brief.
+
+        Args:
+            file (str): The path of the PDF.
+            user_research_brief (str): The brief the caller reads against.
+
+        Returns:
+            Optional[Future]: The future of the reading, or None if the document has to be read now.
+        """
+        with self._lock:
+            brief, future = self._futures.get(file, (None, None))
+        if future is None or brief != user_research_brief:
+            return None
+        return future
+
+    def close(self):
+        """Stops the worker, and with it its thread and session, once the queued documents have been read."""
+        with self._lock:
+            if self._thread is None:
+                return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+
+@rt.function_node
+async def run_ingest_worker():
+    """
+    Reads the documents put on the "ingest_queue" of the session until it receives None.
+    """
+    from tools.research_tools import read_paper
+
+    queue = rt.context.get("ingest_queue")
+    tasks = set()
+
+    async def read(file, user_research_brief, future):
+        try:
+            reading = await read_paper(file, user_research_brief, f"ingest ({os.path.basename(file)})")
+        except Exception as e:
+            _settle(future, error=e)
+        except BaseException as e:
+            # Cancelled, e.g. by the session timeout: fail the future so the reading tool does not wait forever.
+            _settle(future, error=RuntimeError(f"Streaming ingest stopped while reading: {type(e).__name__}"))
+            raise
+        else:
+            _settle(future, reading)
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        task = asyncio.create_task(read(*item))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+
+
+def start_ingest(file: str):
+    """
+    Hands a freshly downloaded document to the session's streaming ingest, if it is enabled.
+
+    Args:
+        file (str): The path of the PDF.
+    """
+    if os.getenv("STREAMING_INGEST", "0") != "1":
+        return
+    user_research_brief = rt.context.get("research_brief", "")
+    if not user_research_brief:
+        return
+    ingest = rt.context.get("ingest", False)
+    if not ingest:
+        ingest = StreamingIngest()
+        rt.context.put("ingest", ingest)
+    ingest.submit(file, user_research_brief)
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import RLock
+from typing import Any, Dict, List, Optional
+
+import railtracks as rt
+
+from singleton import SingletonMeta
+
+
+@dataclass
+class Job:
+    """A long-running node call executed in the background by the `JobManager`."""
+    id: str
+    label: str
+    status: str = "queued"
+    progress: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    _future: Optional[Future] = field(default=None, repr=False)
+    _loop: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False)
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+    _cancel_requested: bool = field(default=False, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def describe(self) -> str:
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        line = f"Job {self.id} ({self.label}): {self.status}, {elapsed:.0f}s elapsed"
+        if self.progress:
+            line += f", {self.progress}"
+        if self.error:
+            line += f", error: {self.error}"
+        return line
+
+
+class JobManager(metaclass=SingletonMeta):
+    """
+    Runs node calls as background jobs on a bounded pool of worker threads.
+
+    Submitting returns a job ID right away. Every job runs on its own event loop in its
+    own railtracks session, so it outlives the tool call that submitted it and does not
+    block the caller's event loop. At most `JOB_WORKERS` jobs run at once; later jobs wait
+    in the pool's queue. Jobs report progress through the "progress" context callback.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.jobs: Dict[str, Job] = {}
+        self.workers = int(os.getenv("JOB_WORKERS", "2"))
+        self.timeout = float(os.getenv("JOB_TIMEOUT", "86400"))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+
+    def submit(self, label: str, node, *args, context: Dict[str, Any] = None, **kwargs) -> Job:
+        """
+        Queues a call of `node` as a background job.
+
+        Args:
+            label (str): A short description of the job.
+            node: The node to call.
+            *args: The positional arguments of the node.
+            context (Dict[str, Any], optional): The railtracks context of the job's session.
+            **kwargs: The keyword arguments of the node.
+
+        Returns:
+            Job: The queued job.
+        """
+        job = Job(id=uuid.uuid4().hex[:8], label=label)
+        # The job is published only once it has its future, so cancel() never sees it without one.
+        job._future = self._pool.submit(self._run, job, node, args, kwargs, dict(context or {}))
+        with self._lock:
+            self.jobs[job.id] = job
+        return job
+
+    def _run(self, job: Job, node, args, kwargs, context: Dict[str, Any]):
+        # cancel() may have run after the pool picked the job up but before its loop existed.
+        if job._cancel_requested:
+            job.status = "cancelled"
+            job.finished = time.time()
+            return
+        job.status = "running"
+        job.started = time.time()
+
+        def progress(message: str):
+            job.progress = message
+
+        async def run():
+            job._loop = asyncio.get_running_loop()
+            job._task = asyncio.current_task()
+            if job._cancel_requested:
+                raise asyncio.CancelledError
+            with rt.Session(context={**context, "progress": progress}, timeout=self.timeout,
+                            name=f"job-{job.id}"):
+                return await rt.call(node, *args, **kwargs)
+
+        try:
+            response = asyncio.run(run())
+            job.result = getattr(response, "text", response)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued or running job.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            bool: False if the job does not exist or has already finished.
+        """
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel_requested = True
+        if job._future.cancel():
+            job.status = "cancelled"
+            job.finished = time.time()
+        elif job._loop is not None and job._task is not None:
+            job._loop.call_soon_threadsafe(job._task.cancel)
+        return True
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+
+@rt.function_node
+def submit_reading_job(user_research_brief: str) -> str:
+    """
+    Start reading, note-taking, highlighting and report writing for all downloaded papers as a background job.
+
+    Returns immediately with a job ID. Use `get_job_status` to follow its progress and
+    `get_job_result` once it is done. Papers downloaded after submitting are not included.
+
+    Args:
+        user_research_brief (str): A textual summary of the user's research goals,
+            provided to guide the note-taking and summarization process.
+
+    Returns:
+        str: The job ID.
+    """
+    from tools.research_tools import read_write_notes_for_papers_in_a_directory
+
+    context = {
+        "vfs": list(rt.context.get("vfs", [])),
+        "output_dir": rt.context.get("output_dir", "."),
+        "research_brief": rt.context.get("research_brief", user_research_brief),
+        "ingest": rt.context.get("ingest", False),
+    }
+    job = JobManager().submit("read and write report", read_write_notes_for_papers_in_a_directory,
+                              user_research_brief, context=context)
+    return f"Submitted job {job.id} for {len(context['vfs'])} papers."
+
+
+@rt.function_node
+def get_job_status(job_id: str) -> str:
+    """
+    Get the status and progress of a background job.
+
+    Args:
+        job_id (str): The job ID returned when the job was submitted.
+
+    Returns:
+        str: The status (queued, running, done, failed or cancelled), elapsed time and latest progress.
+    """
+    job = JobManager().get(job_id)
+    if job is None:
+        return f"No job with ID {job_id}."
+    return job.describe()
+
+
+@rt.function_node
+def get_job_result(job_id: str) -> str:
+    """
+    Get the result of a finished background job.
+
+    Args:
+        job_id (str): The job ID returned when the job was submitted.
+
+    Returns:
+        str: The result of the job, or its status if it has not finished successfully.
+    """
+    job = JobManager().get(job_id)
+    if job is None:
+        return f"No job with ID {job_id}."
+    if job.status != "done":
+        return job.describe()
+    return str(job.result)
+
+
+@rt.function_node
+def cancel_job(job_id: str) -> str:
+    """
+    Cancel a queued or running background job.
+
+    Args:
+        job_id (str): The job ID returned when the job was submitted.
+
+    Returns:
+        str: Whether the job was cancelled.
+    """
+    if JobManager().cancel(job_id):
+        return f"Cancelling job {job_id}."
+    return f"Job {job_id} does not exist or has already finished."
+
+
+@rt.function_node
+def list_jobs() -> str:
+    """
+    List all background jobs with their status and progress.
+
+    Returns:
+        str: One line per job.
+    """
+    jobs = JobManager().list()
+    if not jobs:
+        return "No jobs have been submitted."
+    return "\n".join(job.describe() for job in jobs)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from singleton import SingletonMeta
+from tools.evidence import Paragraph
+
+ARXIV_VERSIONED_ID_PATTERN = re.compile(r"\d{4}\.\d{4,5}v\d+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document TEXT NOT NULL,
+    extraction TEXT NOT NULL,
+    paragraphs TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (document, extraction)
+);
+CREATE TABLE IF NOT EXISTS paragraph_notes (
+    document TEXT NOT NULL,
+    extraction TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    notes TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (document, extraction, start)
+);
+CREATE TABLE IF NOT EXISTS readings (
+    document TEXT NOT NULL,
+    extraction TEXT NOT NULL,
+    brief TEXT NOT NULL,
+    notes TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (document, extraction, brief)
+);
+"""
+
+
+def document_key(file: str) -> str:
+    """
+    Identifies a document across sessions.
+
+    arXiv papers downloaded under their versioned id ("2210.06313v2.pdf") are keyed by it;
+    any other file, including unversioned arXiv ids whose content can change, by the
+    SHA-256 of its content.
+
+    Args:
+        file (str): The path of the PDF.
+
+    Returns:
+        str: "arxiv:<id>" or "sha256:<hex digest>".
+    """
+    match = ARXIV_VERSIONED_ID_PATTERN.fullmatch(os.path.splitext(os.path.basename(file))[0])
+    if match:
+        return f"arxiv:{match.group(0)}"
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def brief_fingerprint(user_research_brief: str) -> str:
+    """
+    Fingerprints a research brief, ignoring case and whitespace.
+
+    Args:
+        user_research_brief (str): The research brief.
+
+    Returns:
+        str: A hex digest identifying the brief.
+    """
+    normalized = " ".join(user_research_brief.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def extraction_fingerprint() -> str:
+    """
+    Describes the settings the paragraphs of a document were extracted with.
+
+    Returns:
+        str: The chunking mode and its token range, so chunks made with other settings are not reused.
+    """
+    if os.getenv("PDF_CHUNKING", "sections") == "blocks":
+        return "blocks"
+    return (f"sections:{os.getenv('CHUNK_MIN_TOKENS', '300')}:{os.getenv('CHUNK_MAX_TOKENS', '1000')}:"
+            f"{os.getenv('CHUNK_SKIP_APPENDIX', '1')}")
+
+
+class KnowledgeBase(metaclass=SingletonMeta):
+    """
+    A persistent SQLite store of what was read from every paper, shared by all sessions.
+
+    The brief-independent part of reading, the paragraphs extracted from a document and the
+    notes and important sentences taken on each of them without a brief, is stored per
+    document and extraction settings. The brief-specific part, which notes are relevant to
+    the brief and the summary, is stored per document, extraction settings and brief
+    fingerprint. A session reading a paper already read for another brief only re-runs the
+    relevance and summary pass over the stored notes; for the same brief it reuses
+    everything and makes no LLM calls. The database is `KNOWLEDGE_BASE_PATH` (default
+    "knowledge_base.sqlite"); set `KNOWLEDGE_BASE=0` to disable it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.path = os.getenv("KNOWLEDGE_BASE_PATH", "knowledge_base.sqlite")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Papers are read on worker threads, so one connection is shared under the lock.
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self.stats = {"paragraphs_reused": 0, "notes_reused": 0, "readings_reused": 0, "paragraphs_stored": 0,
+                      "notes_stored": 0, "readings_stored": 0}
+
+    @staticmethod
+    def enabled() -> bool:
+        return os.getenv("KNOWLEDGE_BASE", "1") != "0"
+
+    def get_paragraphs(self, document: str, extraction: str) -> Optional[List[Paragraph]]:
+        """
+        Returns the stored paragraphs of a document.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+
+        Returns:
+            Optional[List[Paragraph]]: The paragraphs, or None if the document was never read with these settings.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT paragraphs FROM documents WHERE document = ? AND extraction = ?",
+                                           (document, extraction)).fetchone()
+            if row is None:
+                return None
+            self.stats["paragraphs_reused"] += 1
+        return [Paragraph(item["text"], item["page"], tuple(item["bbox"]), item["start"])
+                for item in json.loads(row[0])]
+
+    def put_paragraphs(self, document: str, extraction: str, paragraphs: List[Paragraph]):
+        """
+        Stores the paragraphs of a document.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+            paragraphs (List[Paragraph]): The paragraphs.
+        """
+        data = json.dumps([{"text": p.text, "page": p.page, "bbox": list(p.bbox), "start": p.start}
+                           for p in paragraphs])
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                                     (document, extraction, data, time.time()))
+            self.stats["paragraphs_stored"] += 1
+
+    def get_paragraph_notes(self, document: str, extraction: str) -> Dict[int, dict]:
+        """
+        Returns the brief-independent notes taken on the paragraphs of a document.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+
+        Returns:
+            Dict[int, dict]: The notes, a dictionary with "notes" and "important_sentences", by
+            the start of their paragraph; only paragraphs noted before are included.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT start, notes FROM paragraph_notes WHERE document = ? AND extraction = ?",
+                (document, extraction)).fetchall()
+            self.stats["notes_reused"] += len(rows)
+        return {start: json.loads(notes) for start, notes in rows}
+
+    def put_paragraph_notes(self, document: str, extraction: str, notes: Dict[int, dict]):
+        """
+        Stores brief-independent notes taken on paragraphs of a document.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+            notes (Dict[int, dict]): The notes, a dictionary with "notes" and "important_sentences",
+                by the start of their paragraph.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO paragraph_notes VALUES (?, ?, ?, ?, ?)",
+                                         [(document, extraction, start, json.dumps(note), now)
+                                          for start, note in notes.items()])
+            self.stats["notes_stored"] += len(notes)
+
+    def get_reading(self, document: str, extraction: str, brief: str) -> Optional[Tuple[List[dict], str]]:
+        """
+        Returns the notes and summary of a document selected for a brief.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+            brief (str): The value of `brief_fingerprint`.
+
+        Returns:
+            Optional[Tuple[List[dict], str]]: The notes, one dictionary with "notes",
+            "important_sentences" and the "start" of its paragraph per noted paragraph, and the
+            summary; None if there are none.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT notes, summary FROM readings WHERE document = ? AND extraction = ? AND brief = ?",
+                (document, extraction, brief)).fetchone()
+            if row is None:
+                return None
+            self.stats["readings_reused"] += 1
+        return json.loads(row[0]), row[1]
+
+    def put_reading(self, document: str, extraction: str, brief: str, notes: List[dict], summary: str):
+        """
+        Stores the notes and summary of a document selected for a brief.
+
+        Args:
+            document (str): The key returned by `document_key`.
+            extraction (str): The value of `extraction_fingerprint`.
+            brief (str): The value of `brief_fingerprint`.
+            notes (List[dict]): One dictionary with "notes", "important_sentences" and the "start"
+                of its paragraph per noted paragraph, empty for paragraphs not relevant to the
+                brief; a skim only notes some paragraphs.
+            summary (str): The summary of the notes.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO readings VALUES (?, ?, ?, ?, ?, ?)",
+                                     (document, extraction, brief, json.dumps(notes), summary, time.time()))
+            self.stats["readings_stored"] += 1
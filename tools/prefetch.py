@@ -0,0 +1,178 @@
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from singleton import SingletonMeta
+from tools.resource_monitor import resource_stage
+
+ARXIV_ID_PATTERN = re.compile(r"(?:.*/(?:abs|pdf)/)?(?P<id>.+?)(?P<version>v\d+)?(?:\.pdf)?$")
+
+
+def split_arxiv_id(paper_id: str) -> Tuple[str, str]:
+    """
+    Splits an arXiv id, e.g. "2210.06313v2" or "http://arxiv.org/abs/2210.06313v2", into its
+    unversioned id and its version.
+
+    Args:
+        paper_id (str): The id, with or without version, or its abs or pdf url.
+
+    Returns:
+        Tuple[str, str]: The unversioned id, e.g. "2210.06313", and the version, e.g. "v2", or "".
+    """
+    match = ARXIV_ID_PATTERN.match(paper_id.strip())
+    return match.group("id"), match.group("version") or ""
+
+
+class Prefetcher(metaclass=SingletonMeta):
+    """
+    Fetches the top search results in the background before anyone asks for them.
+
+    Search tools call `prefetch_arxiv` / `prefetch_web` with their results, and the
+    download tools call `take` before fetching anything themselves. While the coordinator
+    deliberates over the results, the PDFs and extracts of the top `PREFETCH_TOP_K` hits
+    (0, the default, disables prefetching) are fetched on `PREFETCH_WORKERS` threads into
+    `PREFETCH_DIR`. At most `PREFETCH_CACHE_SIZE` entries are kept; the least recently
+    used are evicted, cancelling the fetch if it has not started and deleting its file.
+
+    arXiv papers are keyed by their unversioned id, see `split_arxiv_id`, so a request with
+    or without version finds them. Taking a paper hands its file over: the entry leaves the
+    cache, so it is never evicted, nor its file deleted, while the taker moves it.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.top_k = int(os.getenv("PREFETCH_TOP_K", "0"))
+        self.cache_size = int(os.getenv("PREFETCH_CACHE_SIZE", "32"))
+        self.directory = os.getenv("PREFETCH_DIR", ".prefetch")
+        self._pool = ThreadPoolExecutor(max_workers=int(os.getenv("PREFETCH_WORKERS", "4")),
+                                        thread_name_prefix="prefetch")
+        self._cache: "OrderedDict[Hashable, Future]" = OrderedDict()
+        self.stats = {"prefetched": 0, "hits": 0, "misses": 0, "evicted": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.top_k > 0
+
+    def _submit(self, key: Hashable, fetch: Callable[[], Any]):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return
+            self._cache[key] = self._pool.submit(fetch)
+            self.stats["prefetched"] += 1
+            while len(self._cache) > self.cache_size:
+                self._evict(*self._cache.popitem(last=False))
+
+    def _evict(self, key: Hashable, future: Future):
+        self.stats["evicted"] += 1
+        # Web extracts share one request per search and are kept in memory, so only PDF
+        # downloads are cancelled or have their file removed.
+        if key[0] != "arxiv" or future.cancel():
+            return
+        future.add_done_callback(self._remove_file)
+
+    @staticmethod
+    def _remove_file(future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        path = future.result()["path"]
+        if os.path.exists(path):
+            os.remove(path)
+
+    def take(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Returns a prefetched result, waiting for it if the fetch is still running.
+
+        Args:
+            key (Hashable): ("arxiv", paper_id) or ("web", url). A paper id with a version only
+                matches a paper prefetched in that version.
+
+        Returns:
+            Optional[Dict[str, Any]]: The result, or None if it was never prefetched or the fetch failed.
+            An arXiv result's "path" is then the caller's to move or delete.
+        """
+        version = ""
+        if key[0] == "arxiv":
+            paper_id, version = split_arxiv_id(key[1])
+            key = ("arxiv", paper_id)
+        with self._lock:
+            if key[0] == "arxiv":
+                future = self._cache.pop(key, None)
+            else:
+                future = self._cache.get(key)
+                if future is not None:
+                    self._cache.move_to_end(key)
+        if future is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Prefetch of {key} failed: {e}")
+            self.stats["failed"] += 1
+            return None
+        if key[0] == "web":
+            result = result.get(key[1])
+        elif version and version != result["version"]:
+            print(f"Prefetched {key[1]}{result['version']} instead of the requested {version}")
+            if os.path.exists(result["path"]):
+                os.remove(result["path"])
+            result = None
+        if result is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return result
+
+    def prefetch_arxiv(self, results: List[Any]):
+        """
+        Starts downloading the PDFs of the top arXiv results.
+
+        Args:
+            results (List[arxiv.Result]): The search results, best first.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for result in results[:self.top_k]:
+            paper_id, version = split_arxiv_id(result.get_short_id())
+
+            def fetch(result=result, paper_id=paper_id, version=version):
+                from tools.arxiv_tools import download_arxiv_pdf
+
+                with resource_stage("prefetch arxiv"):
+                    path = download_arxiv_pdf(result, dirpath=self.directory, filename=f"{paper_id}{version}.pdf")
+                return {"title": result.title, "path": path, "version": version}
+
+            self._submit(("arxiv", paper_id), fetch)
+
+    def prefetch_web(self, urls: List[str]):
+        """
+        Starts extracting the top web results with one Tavily request.
+
+        Args:
+            urls (List[str]): The result urls, best first.
+        """
+        if not self.enabled:
+            return
+        urls = [url for url in urls[:self.top_k] if ("web", url) not in self._cache]
+        if not urls:
+            return
+
+        def fetch():
+            from tools.tavily_search_tool import get_tavily_client
+
+            with resource_stage("prefetch web"):
+                response = get_tavily_client().extract(urls, include_images=False, extract_depth="advanced")
+            return {item.get("url"): item for item in response.get("results", [])}
+
+        batch = self._pool.submit(fetch)
+        with self._lock:
+            for url in urls:
+                self._cache[("web", url)] = batch
+            self.stats["prefetched"] += len(urls)
+            while len(self._cache) > self.cache_size:
+                self._evict(*self._cache.popitem(last=False))
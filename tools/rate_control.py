@@ -0,0 +1,209 @@
+import email.utils
+import os
+import random
+import time
+from functools import wraps
+from threading import Condition
+from typing import Dict, Optional
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+THROTTLED_METHODS = ("_chat", "_structured", "_chat_with_tools")
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    # railtracks wraps provider errors in LLMError, so look through the whole chain.
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status
+        if "RateLimit" in type(error).__name__:
+            return 429
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        headers = getattr(error, "litellm_response_headers", None)
+        if headers is None and getattr(error, "response", None) is not None:
+            headers = getattr(error.response, "headers", None)
+        if headers:
+            value = headers.get("retry-after-ms")
+            if value is not None:
+                try:
+                    return float(value) / 1000
+                except ValueError:
+                    pass
+            value = headers.get("retry-after")
+            if value is not None:
+                try:
+                    return float(value)
+                except ValueError:
+                    parsed = email.utils.parsedate_to_datetime(value)
+                    if parsed is not None:
+                        return max(0.0, parsed.timestamp() - time.time())
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class AIMDController:
+    """
+    Adapts how many calls to one model may be in flight with additive increase, multiplicative decrease.
+
+    Every successful call raises the limit by `increase / limit`, i.e. by about `increase`
+    per window of calls, as long as the average latency stays under the optional latency
+    target. A 429 or 5xx response multiplies the limit by `decrease` and the call is retried
+    after the Retry-After delay, or an exponential backoff with jitter if the provider sent
+    none. Only calls started after the last decrease adapt the limit, so a burst of failures
+    from one window cuts it once and calls sent at the old limit do not raise it again.
+    Callers block in `acquire` while the limit is reached.
+
+    Model calls run on worker threads, so the controller is thread-safe rather than async.
+    """
+
+    def __init__(self, name: str, initial: float = None, minimum: float = 1, maximum: float = None,
+                 increase: float = 1.0, decrease: float = 0.5, max_retries: int = None,
+                 latency_target: float = None):
+        """
+        Args:
+            name (str): The model the controller is for, used in reports.
+            initial (float, optional): The starting limit. Defaults to `LLM_INITIAL_CONCURRENCY` or 4.
+            minimum (float): The lowest limit.
+            maximum (float, optional): The highest limit. Defaults to `LLM_MAX_CONCURRENCY` or 32.
+            increase (float): The additive increase per window of successful calls.
+            decrease (float): The factor the limit is multiplied by on a 429 or 5xx.
+            max_retries (int, optional): Retries per call. Defaults to `LLM_MAX_RETRIES` or 5.
+            latency_target (float, optional): Average latency in seconds above which the limit stops
+                growing. Defaults to `LLM_LATENCY_TARGET`, unset meaning no target.
+        """
+        self.name = name
+        self.limit = float(initial if initial is not None else os.getenv("LLM_INITIAL_CONCURRENCY", "4"))
+        self.minimum = minimum
+        self.maximum = float(maximum if maximum is not None else os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("LLM_MAX_RETRIES", "5"))
+        target = latency_target if latency_target is not None else os.getenv("LLM_LATENCY_TARGET")
+        self.latency_target = float(target) if target else None
+        self.in_flight = 0
+        self.counts: Dict[str, int] = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0,
+                                       "rate_limited": 0, "server_errors": 0, "decreases": 0}
+        self.latency = 0.0
+        self.peak_limit = self.limit
+        self._epoch = 0
+        self._condition = Condition()
+
+    def acquire(self) -> int:
+        """
+        Waits for a free slot and takes it.
+
+        Returns:
+            int: The number of decreases so far, to be passed back to `release`.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    def release(self, epoch: int, latency: float = None, status: int = None):
+        """
+        Frees a slot and adapts the limit to how the call went.
+
+        Args:
+            epoch (int): The value returned by `acquire`.
+            latency (float, optional): The duration of a successful call in seconds.
+            status (int, optional): The HTTP status of a failed call.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if status in RETRYABLE_STATUS_CODES:
+                self.counts["rate_limited" if status == 429 else "server_errors"] += 1
+                if epoch == self._epoch:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.counts["decreases"] += 1
+                    self._epoch += 1
+            elif latency is not None:
+                self.latency = latency if self.latency == 0.0 else 0.8 * self.latency + 0.2 * latency
+                if epoch == self._epoch and (self.latency_target is None or self.latency <= self.latency_target):
+                    self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+                    self.peak_limit = max(self.peak_limit, self.limit)
+            self._condition.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func` once a slot is free, retrying on 429 and 5xx responses.
+
+        Args:
+            func: The model method to call.
+            *args: Its positional arguments.
+            **kwargs: Its keyword arguments.
+
+        Returns:
+            The result of `func`.
+        """
+        with self._condition:
+            self.counts["calls"] += 1
+        for attempt in range(self.max_retries + 1):
+            epoch = self.acquire()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                status = _status_code(e)
+                self.release(epoch, status=status)
+                if status not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    with self._condition:
+                        self.counts["failed"] += 1
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                with self._condition:
+                    self.counts["retries"] += 1
+                print(f"{self.name}: HTTP {status}, retrying in {delay:.1f}s "
+                      f"(attempt {attempt + 1}/{self.max_retries}, limit {self.limit:.1f})")
+                time.sleep(delay)
+                continue
+            self.release(epoch, latency=time.perf_counter() - start)
+            with self._condition:
+                self.counts["succeeded"] += 1
+            return result
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the current limit, calls in flight, average latency and call counts.
+
+        Returns:
+            Dict[str, float]: The statistics of the controller.
+        """
+        with self._condition:
+            return {"model": self.name, "limit": round(self.limit, 2), "peak_limit": round(self.peak_limit, 2),
+                    "in_flight": self.in_flight, "latency": round(self.latency, 3), **self.counts}
+
+    def wrap(self, model):
+        """
+        Routes the model's completion methods through the controller.
+
+        The instance methods are replaced rather than registered as hooks, because agent
+        nodes remove all model hooks when they finish.
+
+        Args:
+            model: The model to throttle, e.g. an `rt.llm.PortKeyLLM`.
+
+        Returns:
+            The same model.
+        """
+        for name in THROTTLED_METHODS:
+            method = getattr(model, name)
+
+            @wraps(method)
+            def throttled(*args, _method=method, **kwargs):
+                return self.call(_method, *args, **kwargs)
+
+            setattr(model, name, throttled)
+        return model
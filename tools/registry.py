@@ -0,0 +1,205 @@
+import os
+import time
+from contextlib import contextmanager
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, List
+
+import railtracks as rt
+
+from singleton import SingletonMeta
+from tools.cassette import Cassette
+from tools.rate_control import AIMDController
+
+DEFAULT_MODEL = "@openai/gpt-4.1-2025-04-14"
+# Note taking runs once per paragraph, so it defaults to a smaller, faster model.
+DEFAULT_STAGE_MODELS = {"notes": "@openai/gpt-4.1-mini-2025-04-14"}
+STAGES = ("coordinator", "arxiv", "websearch", "notes", "relevance", "summary", "writing", "critique")
+
+
+class Registry(metaclass=SingletonMeta):
+    """
+    A process-wide cache of LLM clients and agent nodes.
+
+    Clients are created lazily once per model name and then shared, so their HTTP
+    connection pools stay warm between tool calls. Every client's calls go through an
+    `AIMDController` for its model, unless `LLM_RATE_CONTROL` is "0", and through the
+    `Cassette` when recording or replaying. Agent nodes are created lazily once per key
+    (name, model and whatever configuration distinguishes them) and reused. The time
+    spent in setup is recorded per label.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._llms: Dict[str, Any] = {}
+        self._agents: Dict[Hashable, Any] = {}
+        self.controllers: Dict[str, AIMDController] = {}
+        self.stage_timings: Dict[str, Dict[str, List[float]]] = {}
+        self.setup_timings: Dict[str, List[float]] = {}
+
+    def get_llm(self, model_name: str = None, client: str = None):
+        """
+        Returns the shared PortKey client of a model, creating it on first use.
+
+        Args:
+            model_name (str, optional): The PortKey model name. Defaults to the `MODEL`
+                environment variable.
+            client (str, optional): The name of a separate client of the model, for a caller
+                that modifies its client, e.g. "coordinator" for the history compaction of
+                the Research Coordinator. Separate clients share the model's `AIMDController`.
+
+        Returns:
+            rt.llm.PortKeyLLM: The shared client.
+        """
+        if model_name is None:
+            model_name = os.getenv("MODEL", DEFAULT_MODEL)
+        key = model_name if client is None else f"{model_name}#{client}"
+        with self._lock:
+            if key not in self._llms:
+                Cassette().prepare_model()
+                llm = Cassette().wrap(rt.llm.PortKeyLLM(model_name))
+                if os.getenv("LLM_RATE_CONTROL", "1") != "0":
+                    if model_name not in self.controllers:
+                        self.controllers[model_name] = AIMDController(model_name)
+                    self.controllers[model_name].wrap(llm)
+                self._llms[key] = llm
+            return self._llms[key]
+
+    def get_agent(self, key: Hashable, factory: Callable[[], Any]):
+        """
+        Returns the agent node stored under `key`, building it with `factory` on first use.
+
+        Args:
+            key (Hashable): Identifies the agent and its configuration, e.g.
+                ("note-taking agent", model_name).
+            factory (Callable[[], Any]): Builds the agent node.
+
+        Returns:
+            The shared agent node.
+        """
+        with self._lock:
+            if key not in self._agents:
+                self._agents[key] = factory()
+            return self._agents[key]
+
+    @contextmanager
+    def timed_setup(self, label: str):
+        """
+        Records how long the wrapped setup block takes under `label`.
+
+        Args:
+            label (str): The name of the tool or function doing the setup.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                timings = self.setup_timings.setdefault(label, [])
+                timings.append(elapsed)
+            print(f"Setup for {label} took {elapsed * 1000:.2f} ms (call {len(timings)})")
+
+    def setup_report(self) -> str:
+        """
+        Summarizes the recorded setup latencies.
+
+        Returns:
+            str: One line per label with the first-call latency and the mean of later calls.
+        """
+        lines = []
+        with self._lock:
+            for label, timings in self.setup_timings.items():
+                first = timings[0] * 1000
+                later = timings[1:]
+                mean_later = sum(later) / len(later) * 1000 if later else 0.0
+                lines.append(f"{label}: first {first:.2f} ms, later mean {mean_later:.2f} ms over {len(later)} calls")
+        return "\n".join(lines)
+
+    @contextmanager
+    def timed_stage(self, stage: str, model_name: str):
+        """
+        Records how long one LLM call of a pipeline stage takes, per stage and model.
+
+        Args:
+            stage (str): The stage, e.g. "notes".
+            model_name (str): The model the call went to.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_timings.setdefault(stage, {}).setdefault(model_name, []).append(elapsed)
+
+    def stage_report(self) -> str:
+        """
+        Summarizes the recorded stage latencies.
+
+        Returns:
+            str: One line per stage and model with the number of calls, the mean and the total latency.
+        """
+        lines = []
+        with self._lock:
+            for stage, models in self.stage_timings.items():
+                for model_name, timings in models.items():
+                    lines.append(f"{stage} ({model_name}): {len(timings)} calls, mean {sum(timings) / len(timings):.2f}s, "
+                                 f"total {sum(timings):.1f}s")
+        return "\n".join(lines)
+
+    def rate_control_report(self) -> str:
+        """
+        Summarizes the state of every model's concurrency controller.
+
+        Returns:
+            str: One line per model with its current and peak limit, latency and retry counts.
+        """
+        lines = []
+        with self._lock:
+            controllers = list(self.controllers.values())
+        for controller in controllers:
+            stats = controller.stats()
+            lines.append(f"{stats['model']}: limit {stats['limit']} (peak {stats['peak_limit']}), "
+                         f"{stats['in_flight']} in flight, latency {stats['latency']}s, "
+                         f"{stats['succeeded']}/{stats['calls']} succeeded, {stats['retries']} retries, "
+                         f"{stats['rate_limited']} rate limited, {stats['server_errors']} server errors")
+        return "\n".join(lines)
+
+
+def get_llm(model_name: str = None, client: str = None):
+    """Shortcut for `Registry().get_llm`."""
+    return Registry().get_llm(model_name, client)
+
+
+def stage_model_name(stage: str) -> str:
+    """
+    Returns the model configured for a pipeline stage.
+
+    The model is read from `MODEL_<STAGE>` (e.g. `MODEL_NOTES`), falling back to the stage
+    default in `DEFAULT_STAGE_MODELS` and then to `MODEL`.
+
+    Args:
+        stage (str): One of `STAGES`.
+
+    Returns:
+        str: The PortKey model name.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}.")
+    return (os.getenv(f"MODEL_{stage.upper()}") or DEFAULT_STAGE_MODELS.get(stage)
+            or os.getenv("MODEL", DEFAULT_MODEL))
+
+
+def get_stage_llm(stage: str, client: str = None):
+    """Returns the shared client, or the separate `client`, of the model configured for a pipeline stage."""
+    return Registry().get_llm(stage_model_name(stage), client)
+
+
+def get_agent(key: Hashable, factory: Callable[[], Any]):
+    """Shortcut for `Registry().get_agent`."""
+    return Registry().get_agent(key, factory)
+
+
+def model_key(model) -> str:
+    """Returns the name used to key agents built on `model`."""
+    return model.model_name()
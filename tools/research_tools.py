@@ -1,58 +1,205 @@
 import asyncio
+import json
 import os
-from typing import List
+import shutil
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
-import fitz  # PyMuPDF
 import railtracks as rt
-from docuglean import parse_pdf
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
-from tools.util_tools import think_tool
+from tools.cassette import Cassette
+from tools.chunking import load_pdf_chunks, skim_chunk_indices
+from tools.evidence import EvidenceStore, Paragraph
+from tools.knowledge_base import KnowledgeBase, brief_fingerprint, document_key, extraction_fingerprint
+from tools.registry import DEFAULT_MODEL, Registry, get_agent, get_llm, get_stage_llm, model_key, stage_model_name
+from tools.resource_monitor import ResourceMonitor, instrumented, resource_stage
+from tools.util_tools import think_tool, count_tokens, session_path, report_progress
+from tools.work_queue import WorkQueue, gather_batch, get_work_queue, run_worker
 
 
-def highlight_sentences_in_pdf(input_pdf_path, output_pdf_path, sentences_to_highlight,notes):
+def collect_annotations(doc, evidence, document_name: str = ""):
     """
-    Highlight a list of sentences in a PDF.
+    Works out the highlight and sticky-note annotations of a document from its evidence records.
+
+    Sentences are located with a fuzzy, normalized n-gram match against every sentence span
+    of the document, so quotes the LLM lightly rewrote are still highlighted. Matches scoring
+    below the `HIGHLIGHT_MATCH_THRESHOLD` environment variable (default 0.75) are skipped.
+    Notes are placed next to the paragraph they were taken on; empty notes, e.g. of paragraphs
+    irrelevant to the brief, get no sticky note.
+
+    Args:
+        doc (fitz.Document): The open source document.
+        evidence (List[EvidenceRecord]): The note and sentence records of the document.
+        document_name (str): The name used when reporting match statistics.
+
+    Returns:
+        Tuple[List[dict], dict]: The annotations as plain dictionaries, and the match statistics
+        of the document, see `match_sentences_in_pdf`.
+    """
+    from tools.sentence_index import match_sentences_in_pdf
+
+    sentences = [record for record in evidence if record.kind == "sentence"]
+    matches, stats = match_sentences_in_pdf(
+        doc, [record.text for record in sentences], [record.page for record in sentences],
+        threshold=float(os.getenv("HIGHLIGHT_MATCH_THRESHOLD", "0.75")),
+        document_name=document_name)
+    annotations = [
+        {"type": "highlight", "page": match.page, "rects": [list(rect) for rect in match.rects],
+         "text": match.sentence, "score": round(match.score, 4)}
+        for match in matches
+    ]
+    for record in evidence:
+        if record.kind == "note" and record.text.strip():
+            # Place sticky note near top-right of paragraph
+            annotations.append({"type": "note", "page": record.page,
+                                "point": [record.bbox[2] + 5, record.bbox[1]], "text": record.text})
+    return annotations, stats
+
+
+def apply_annotations(doc, annotations):
+    """
+    Adds highlight and sticky-note annotations produced by `collect_annotations` to a document.
+
+    Args:
+        doc (fitz.Document): The open document to annotate.
+        annotations (List[dict]): The annotations.
+    """
+    import fitz  # PyMuPDF
+
+    for annotation in annotations:
+        page = doc[annotation["page"]]
+        if annotation["type"] == "highlight":
+            page.add_highlight_annot([fitz.Rect(rect) for rect in annotation["rects"]])
+        elif annotation["type"] == "note":
+            page.add_text_annot(fitz.Point(annotation["point"]), annotation["text"])
+
+
+def write_annotation_sidecar(input_pdf_path, sidecar_path, annotations):
+    """
+    Writes the annotations of a document to a small JSON sidecar file.
+
+    Args:
+        input_pdf_path (str): Path to the source PDF the annotations belong to.
+        sidecar_path (str): Path of the JSON file to write.
+        annotations (List[dict]): The annotations.
+    """
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        json.dump({"source": input_pdf_path, "annotations": annotations}, f)
+
+
+def save_annotated_pdf(input_pdf_path, output_pdf_path, annotations, mode: str = "compressed"):
+    """
+    Writes an annotated copy of a PDF.
+
+    Args:
+        input_pdf_path (str): Path to the source PDF.
+        output_pdf_path (str): Path where the annotated PDF will be saved.
+        annotations (List[dict]): The annotations to add.
+        mode (str): "full" rewrites the whole document as before, "compressed" rewrites it
+            with garbage collection and deflate, and "incremental" copies the source file
+            and appends the annotations as an incremental update, so the original bytes
+            are never re-serialized. Documents that cannot be saved incrementally (e.g.
+            repaired on open) fall back to "compressed".
+    """
+    import fitz  # PyMuPDF
+
+    if mode == "incremental":
+        shutil.copyfile(input_pdf_path, output_pdf_path)
+        doc = fitz.open(output_pdf_path)
+        if doc.can_save_incrementally():
+            apply_annotations(doc, annotations)
+            doc.save(output_pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            doc.close()
+            return
+        doc.close()
+        mode = "compressed"
+    doc = fitz.open(input_pdf_path)
+    apply_annotations(doc, annotations)
+    if mode == "full":
+        doc.save(output_pdf_path)
+    else:
+        doc.save(output_pdf_path, garbage=3, deflate=True, deflate_images=True, deflate_fonts=True)
+    doc.close()
+
+
+def highlight_sentences_in_pdf(input_pdf_path, output_pdf_path, evidence):
+    """
+    Highlight important sentences and attach notes in a PDF from their evidence records.
+
+    The annotations are always exported next to the output as `<output>.annotations.json`.
+    How the highlighted PDF itself is written is chosen by the `HIGHLIGHT_SAVE_MODE`
+    environment variable: "compressed" (default), "incremental" or "full" (see
+    `save_annotated_pdf`), or "sidecar" to only export the annotations and render the
+    highlighted copy later on demand with `render_highlighted_pdf`.
 
     Args:
         input_pdf_path (str): Path to the input PDF file.
         output_pdf_path (str): Path where the highlighted PDF will be saved.
-        sentences_to_highlight (List[str]): List of sentences to highlight.
+        evidence (List[EvidenceRecord]): The note and sentence records of the document.
+
+    Returns:
+        dict: The match statistics of the document, see `match_sentences_in_pdf`.
     """
+    import fitz  # PyMuPDF
+
+    mode = os.getenv("HIGHLIGHT_SAVE_MODE", "compressed")
     doc = fitz.open(input_pdf_path)
+    annotations, stats = collect_annotations(doc, evidence, os.path.basename(input_pdf_path))
+    doc.close()
 
-    notes_iter = iter(notes)
-    for page in doc:
-        for sentence in sentences_to_highlight:
-            # Search for the sentence on the page
-            text_instances = page.search_for(sentence)
-            for inst in text_instances:
-                 page.add_highlight_annot(inst)
-        blocks = page.get_text("blocks")
-        for i,block in enumerate(blocks):
-            x0, y0, x1, y1, text, block_no, block_type = block
+    sidecar_path = output_pdf_path + ".annotations.json"
+    write_annotation_sidecar(input_pdf_path, sidecar_path, annotations)
+    if mode == "sidecar":
+        print(f"Saved annotations as {sidecar_path}")
+        return stats
 
-            # Only process text blocks
-            if block_type != 0:
-                continue
+    save_annotated_pdf(input_pdf_path, output_pdf_path, annotations, mode)
+    print(f"Saved highlighted PDF as {output_pdf_path}")
+    return stats
 
-            paragraph = text.strip()
-            if not paragraph:
-                continue
 
-            # Place sticky note near top-right of paragraph
-            note_position = fitz.Point(x1 + 5, y0)
-            note = next(notes_iter, None)
-            if note:
-                page.add_text_annot(
-                    note_position,
-                    note
-                )
+def render_highlighted_pdf(sidecar_path, output_pdf_path=None, mode: str = "compressed") -> str:
+    """
+    Renders a highlighted PDF from an annotation sidecar file.
 
+    Args:
+        sidecar_path (str): Path to a `<pdf>.annotations.json` file.
+        output_pdf_path (str, optional): Where to write the PDF. Defaults to the sidecar
+            path without its `.annotations.json` suffix.
+        mode (str): How to write the PDF, see `save_annotated_pdf`.
 
+    Returns:
+        str: The path of the rendered PDF.
+    """
+    with open(sidecar_path, encoding="utf-8") as f:
+        sidecar = json.load(f)
+    if output_pdf_path is None:
+        output_pdf_path = sidecar_path.removesuffix(".annotations.json")
+    save_annotated_pdf(sidecar["source"], output_pdf_path, sidecar["annotations"], mode)
+    return output_pdf_path
 
-    doc.save(output_pdf_path)
-    print(f"Saved highlighted PDF as {output_pdf_path}")
+
+@rt.function_node
+@instrumented("render_highlighted_paper")
+def render_highlighted_paper(annotation_file: str) -> str:
+    """
+    Render the highlighted copy of a paper from its annotation file.
+
+    Highlighted papers are only stored as small `.annotations.json` files when
+    the highlight save mode is "sidecar". Use this tool when the user wants to
+    open the highlighted PDF of a paper.
+
+    Args:
+        annotation_file (str): Path to the paper's `.annotations.json` file in
+            the highlighted_papers directory.
+
+    Returns:
+        str: A message with the path of the rendered PDF.
+    """
+    output_pdf_path = render_highlighted_pdf(annotation_file)
+    return f"Rendered highlighted PDF at {output_pdf_path}"
 
 # def highlight_sentences_in_pdf(input_pdf_path, output_pdf_path, sentences_to_highlight):
 #     """
@@ -66,36 +213,37 @@ def highlight_sentences_in_pdf(input_pdf_path, output_pdf_path, sentences_to_hig
 
 
 
-def load_pdf_paragraphs(pdf_path: str):
+def load_pdf_paragraphs(pdf_path: str) -> List[Paragraph]:
     """
-    Loads a PDF and extracts text split into paragraphs.
+    Loads a PDF and extracts its text blocks as paragraphs.
+
+    Every paragraph keeps the page and block rectangle it was extracted from, and its
+    character offset in the document text (the paragraphs joined by blank lines).
 
     Args:
         pdf_path (str): Path to the PDF file.
 
     Returns:
-        List[str]: A list of paragraphs extracted from the PDF.
+        List[Paragraph]: The paragraphs of the PDF in reading order.
     """
+    import fitz  # PyMuPDF
+
     doc = fitz.open(pdf_path)
-    full_text = ""
+    paragraphs = []
+    offset = 0
 
-    # Step 1: Extract text from all pages
-    for page in doc:
-        text = page.get_text("text")  # plain text extraction
-        full_text += "\n" + text
+    for page_number, page in enumerate(doc):
+        for x0, y0, x1, y1, text, block_no, block_type in page.get_text("blocks"):
+            # Only process text blocks
+            if block_type != 0:
+                continue
+            text = text.replace("\r", "").strip()
+            if not text:
+                continue
+            paragraphs.append(Paragraph(text, page_number, (x0, y0, x1, y1), offset))
+            offset += len(text) + 2
 
     doc.close()
-
-    # Step 2: Normalize whitespace
-    cleaned = full_text.replace("\r", "")
-
-    # Step 3: Split into paragraphs
-    paragraphs = [
-        p.strip()
-        for p in cleaned.split("\n\n")
-        if p.strip()
-    ]
-
     return paragraphs
 
 
@@ -170,6 +318,8 @@ Critical workflow requirements:
 
 * **Use the Think tool** whenever reasoning, planning, breaking down complex information, or resolving ambiguities is required.
 
+* **Use the `retrieve_evidence` tool** to look up the exact passages and notes from the papers that support a claim or a section, instead of relying only on the summaries.
+
 * **Every time you produce a report—whether it is an initial draft, a revised draft, or the final version—you must call the `generate_report` tool**.  
   This tool must always be used to output any report version.
 
@@ -237,6 +387,246 @@ Be objective, thorough, and focused on ensuring the final report adheres to the
 """
 
 
+OUTLINE_AGENT_SYSTEM_PROMPT = """
+You are the Outline Agent. You are given the user's research brief and a numbered digest of the
+paper summaries that are available for a research report.
+
+Your task is to plan the **body** of the report:
+
+* Propose a report title and between 3 and 8 body sections that together cover the research brief.
+* Give every section a short heading and a one or two sentence goal describing what it must cover.
+* For every section, list the numbers of the papers whose summaries are relevant to it. A paper may be
+  used by several sections, and every paper should be used by at least one section if it is relevant.
+* Do not plan an Introduction or a Conclusion; they are written separately.
+* Order the sections so that the report has a logical flow.
+"""
+
+SECTION_WRITER_SYSTEM_PROMPT = """
+You are a Section Writing Agent. You write **one section** of a larger research report.
+
+You are given the user's research brief, the outline of the whole report, the heading and goal of your
+section, and the summaries of the papers relevant to it.
+
+* Write only the body of your section in Markdown, without repeating its heading.
+* Synthesize the summaries into a coherent narrative that fulfils the section goal.
+* Stay within the scope of your section; other sections cover the rest of the outline.
+* Preserve key insights, technical details and results, and mention which paper they come from.
+* Do not introduce unsupported, speculative or extraneous information.
+"""
+
+FRAMING_WRITER_SYSTEM_PROMPT = """
+You are a Writing Agent that frames a research report whose body has already been written.
+
+You are given the user's research brief, the report title and the opening of every body section.
+Write only the requested part of the report in Markdown, without a heading:
+
+* An **Introduction** contextualizes the research topic, states the objectives and previews the sections.
+* A **Conclusion** summarizes the main takeaways and their relevance to the user's research goals.
+
+Keep it consistent with the body sections and do not introduce unsupported information.
+"""
+
+TERMINOLOGY_SYSTEM_PROMPT = """
+You are an editor checking a research report whose sections were written independently.
+
+List the concepts, methods, datasets and metrics that different sections name differently, e.g. an
+abbreviation in one section and the full name in another, or two synonyms for the same method.
+For each, pick the name to use throughout the report. Only list real inconsistencies.
+"""
+
+SMOOTHING_SYSTEM_PROMPT = """
+You are an editor smoothing one section of a research report whose sections were written independently.
+
+* Rework the opening and closing sentences so the section follows on from the previous section and
+  leads into the next one, without repeating them.
+* Replace every listed variant name with its preferred name.
+* Leave the rest of the section unchanged: keep every claim, figure, citation and paragraph.
+* Return only the Markdown body of the section, without its heading.
+"""
+
+TERMINOLOGY_USER_PROMPT = """
+Check the terminology of the research report below.
+
+{report}
+"""
+
+SMOOTHING_USER_PROMPT = """
+Smooth the section "{heading}" of the research report "{title}".
+
+## Report outline
+{outline}
+
+## End of the previous section
+{previous}
+
+## Start of the next section
+{next}
+
+## Terminology to use
+{terms}
+
+## Section
+{content}
+"""
+
+OUTLINE_USER_PROMPT = """
+Plan the body of a research report.
+
+## Research brief
+{user_research_brief}
+
+## Available papers
+{digest}
+"""
+
+SECTION_USER_PROMPT = """
+Write one section of the research report "{title}".
+
+## Research brief
+{user_research_brief}
+
+## Report outline
+{outline}
+
+## Your section
+Heading: {heading}
+Goal: {goal}
+
+## Relevant summaries
+{summaries}
+
+## Retrieved evidence
+Passages and notes from the papers that match this section. Prefer them for exact claims and figures.
+{evidence}
+"""
+
+FRAMING_USER_PROMPT = """
+Write the {part} of the research report "{title}".
+
+## Research brief
+{user_research_brief}
+
+## Body sections
+{sections}
+"""
+
+SECTION_CRITIQUE_SYSTEM_PROMPT = """
+You are the Critique Agent. You review selected sections of a research report against the user's research brief.
+
+* Evaluate only the sections you are given; the outline shows the rest of the report for context.
+* Identify missing requirements, misalignments with the brief, inaccuracies, unsupported claims, unclear reasoning
+  and structural problems.
+* Report every problem as a separate issue tied to the heading of the section it occurs in, using the heading
+  exactly as written. Each issue must be specific and actionable.
+* Do not report stylistic preferences that would not materially improve the report.
+* Set `approved` to true if the reviewed sections need no further changes.
+"""
+
+SECTION_REVISION_SYSTEM_PROMPT = """
+You are a Section Revision Agent. You revise one section of a research report to resolve the issues raised by a critique.
+
+* Resolve every listed issue, using only the provided source material.
+* Keep everything that was not criticized unchanged where possible.
+* Return only the revised Markdown body of the section, without its heading.
+"""
+
+SECTION_CRITIQUE_USER_PROMPT = """
+Review the following sections of the research report "{title}".
+
+## Research brief
+{user_research_brief}
+
+## Report outline
+{outline}
+
+## Sections to review
+{sections}
+"""
+
+SECTION_REVISION_USER_PROMPT = """
+Revise the section "{heading}" of the research report "{title}".
+
+## Research brief
+{user_research_brief}
+
+## Current section
+{content}
+
+## Issues to resolve
+{issues}
+
+## Source material
+{sources}
+"""
+
+NOTE_TAKING_USER_PROMPT = """
+Take notes for the following paragraph making sure its relevant to the research brief.
+## Paragraph
+{paragraph}
+## Research brief.
+{user_research_brief}
+"""
+
+EXTRACTION_USER_PROMPT = """
+Take notes for the following paragraph. There is no research brief: note its key points, methods,
+findings and results so the notes can serve any research brief later.
+## Paragraph
+{paragraph}
+"""
+
+NOTE_RELEVANCE_SYSTEM_PROMPT = """
+You are a research triage agent. You are given numbered notes taken on the paragraphs of one
+research paper, and the user's research brief.
+
+Return the numbers of the notes whose content is relevant to the research brief. Leave out notes
+on content the brief does not ask about, such as background unrelated to its topic.
+"""
+
+NOTE_RELEVANCE_USER_PROMPT = """
+This is the user research brief.
+## Research brief.
+{user_research_brief}
+## Notes
+{notes}
+"""
+
+SUMMARIZATION_USER_PROMPT = """
+This is the user research brief.
+## Research brief.
+{user_research_brief}
+## Notes
+{notes}
+"""
+
+SKIM_ASSESSMENT_SYSTEM_PROMPT = """
+You are a research triage agent. You are given the notes taken on the abstract, introduction
+and conclusion of one research paper, and the user's research brief.
+
+1. Rate how relevant the paper is to the research brief on a scale from 0 (unrelated) to 10
+   (directly addresses it). Rate on what the paper is about, not on how well it is written.
+2. Summarize what the paper contributes, focusing on what is relevant to the research brief.
+   Only use what the notes support.
+"""
+
+SKIM_ASSESSMENT_USER_PROMPT = """
+This is the user research brief.
+## Research brief.
+{user_research_brief}
+## Notes on the abstract, introduction and conclusion
+{notes}
+"""
+
+SUMMARY_REDUCE_USER_PROMPT = """
+This is the user research brief.
+## Research brief.
+{user_research_brief}
+## Partial summaries
+The following are summaries of consecutive parts of the same paper, in reading order.
+Combine them into one summary of the whole paper.
+{summaries}
+"""
+
+
 class ReportSchema(BaseModel):
     report: str = Field(description="This field stores the report generated by the llm.")
 
@@ -250,6 +640,49 @@ class SummarizationSchema(BaseModel):
     summary: str = Field(description="This field is to store the summaries the llm or agent generates")
 
 
+class SkimAssessmentSchema(BaseModel):
+    relevance: int = Field(ge=0, le=10, description="How relevant the paper is to the research brief, from 0 (unrelated) to 10 (directly addresses it).")
+    summary: str = Field(description="A summary of the paper's contributions that are relevant to the research brief.")
+
+
+class NoteRelevanceSchema(BaseModel):
+    relevant_notes: List[int] = Field(description="The numbers of the notes that are relevant to the research brief.")
+
+
+class CritiqueIssue(BaseModel):
+    section: str = Field(description="The heading of the section the issue occurs in, exactly as written in the report.")
+    issue: str = Field(description="A specific, actionable description of the problem.")
+
+
+class SectionCritiqueSchema(BaseModel):
+    issues: List[CritiqueIssue] = Field(description="The issues found in the reviewed sections.")
+    approved: bool = Field(description="True if the reviewed sections need no further changes.")
+
+
+class TermChoice(BaseModel):
+    preferred: str = Field(description="The name to use throughout the report.")
+    variants: List[str] = Field(description="The other names the report uses for the same concept.")
+
+
+class TerminologySchema(BaseModel):
+    terms: List[TermChoice] = Field(description="The concepts named inconsistently across sections, with the name to use.")
+
+
+class OutlineSection(BaseModel):
+    heading: str = Field(description="The heading of the section.")
+    goal: str = Field(description="What the section must cover, in one or two sentences.")
+    paper_numbers: List[int] = Field(description="The numbers of the papers whose summaries are relevant to the section.")
+
+
+class OutlineSchema(BaseModel):
+    title: str = Field(description="The title of the report.")
+    sections: List[OutlineSection] = Field(description="The body sections of the report, in order.")
+
+
+class SectionSchema(BaseModel):
+    content: str = Field(description="The Markdown body of the section, without its heading.")
+
+
 @rt.function_node
 def generate_research_brief(research_brief: str) -> str:
     """Return a formatted research brief.
@@ -292,6 +725,7 @@ async def generate_report(report: str, markdown_file: str) -> str:
         str: A formatted string indicating that the report has been generated
              and saved, followed by the full report content.
     """
+    markdown_file = session_path(markdown_file)
     # Ensure the directory exists
     os.makedirs(os.path.dirname(markdown_file), exist_ok=True)
 
@@ -313,7 +747,280 @@ def write_markdown(text: str, file_path: str):
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(text)
 
-async def write_report(summary_for_papers,model,user_research_brief):
+def _first_paragraph(text: str, max_chars: int = 600) -> str:
+    paragraph = text.strip().split("\n\n")[0]
+    if len(paragraph) > max_chars:
+        paragraph = paragraph[:max_chars].rsplit(" ", 1)[0] + " ..."
+    return paragraph
+
+
+def _last_paragraph(text: str, max_chars: int = 600) -> str:
+    paragraph = text.strip().split("\n\n")[-1]
+    if len(paragraph) > max_chars:
+        paragraph = "... " + paragraph[-max_chars:].split(" ", 1)[-1]
+    return paragraph
+
+
+def _stitch_report(title: str, sections) -> str:
+    parts = [f"# {title}"]
+    for heading, content in sections:
+        parts.extend([f"## {heading}", content.strip()])
+    return "\n\n".join(parts) + "\n"
+
+
+def _normalize_heading(heading: str) -> str:
+    return " ".join(heading.strip().strip("#").split()).lower()
+
+
+def _estimate_tokens(system_prompt: str, prompt: str, output: str) -> Tuple[int, int]:
+    return count_tokens(system_prompt) + count_tokens(prompt), count_tokens(output)
+
+
+async def revise_report_sections(model, title: str, sections, sources, user_research_brief: str,
+                                 max_rounds: int = None, critique_model=None):
+    """
+    Runs a bounded, section-scoped critique and revision loop over a drafted report.
+
+    The first round critiques every section. The critique returns issues tied to section
+    headings, matched ignoring "#" marks, whitespace and case; an issue on a heading that
+    several sections share applies to each of them. Only the sections with issues are
+    rewritten (concurrently), and the next round
+    re-critiques only the sections whose text actually changed. The loop stops when the
+    critique approves the reviewed sections, reports no issues, no section changes, or
+    `max_rounds` critique rounds have run. Token use of every round is estimated and printed.
+
+    Args:
+        model: The LLM used by the revision agent.
+        title (str): The report title.
+        sections (List[Tuple[str, str]]): The (heading, Markdown body) pairs, in report order.
+        sources (List[str]): The source material every section was written from, in the same order.
+        user_research_brief (str): The user's research brief.
+        max_rounds (int, optional): The maximum number of critique rounds. Defaults to the
+            `REPORT_MAX_REVISION_ROUNDS` environment variable, or 2.
+        critique_model (optional): The LLM used by the critique agent. Defaults to the model
+            of the "critique" stage.
+
+    Returns:
+        Tuple[List[Tuple[str, str]], List[Dict[str, int]]]: The revised sections, and per-round statistics
+        with the number of reviewed, flagged and changed sections and the estimated input and output tokens.
+    """
+    if max_rounds is None:
+        max_rounds = int(os.getenv("REPORT_MAX_REVISION_ROUNDS", "2"))
+    with Registry().timed_setup("revise_report_sections"):
+        critique_model = critique_model or get_stage_llm("critique")
+        critique_agent = get_agent(("Section Critique Agent", model_key(critique_model)), lambda: rt.agent_node(
+            name="Section Critique Agent", llm=critique_model, system_message=SECTION_CRITIQUE_SYSTEM_PROMPT,
+            output_schema=SectionCritiqueSchema))
+        revision_agent = get_agent(("Section Revision Agent", model_key(model)), lambda: rt.agent_node(
+            name="Section Revision Agent", llm=model, system_message=SECTION_REVISION_SYSTEM_PROMPT,
+            output_schema=SectionSchema))
+    headings = [heading for heading, _ in sections]
+    contents = [content for _, content in sections]
+    outline_text = "\n".join(f"- {heading}" for heading in headings)
+    to_review = list(range(len(sections)))
+    rounds = []
+    for round_number in range(1, max_rounds + 1):
+        round_stats = {"round": round_number, "reviewed": len(to_review), "flagged": 0, "changed": 0,
+                       "input_tokens": 0, "output_tokens": 0}
+        rounds.append(round_stats)
+        reviewed = "\n\n".join(f"## {headings[index]}\n{contents[index]}" for index in to_review)
+        prompt = SECTION_CRITIQUE_USER_PROMPT.format(title=title, user_research_brief=user_research_brief,
+                                                     outline=outline_text, sections=reviewed)
+        critique = (await rt.call(critique_agent, prompt)).structured
+        input_tokens, output_tokens = _estimate_tokens(SECTION_CRITIQUE_SYSTEM_PROMPT, prompt,
+                                                       critique.model_dump_json())
+        round_stats["input_tokens"] += input_tokens
+        round_stats["output_tokens"] += output_tokens
+
+        issues_by_section = {}
+        for issue in critique.issues:
+            for index in to_review:
+                if _normalize_heading(headings[index]) == _normalize_heading(issue.section):
+                    issues_by_section.setdefault(index, []).append(issue.issue)
+        round_stats["flagged"] = len(issues_by_section)
+        if critique.approved or not issues_by_section:
+            break
+
+        async def revise(index, issues):
+            prompt = SECTION_REVISION_USER_PROMPT.format(
+                title=title, user_research_brief=user_research_brief, heading=headings[index],
+                content=contents[index], issues="\n".join(f"- {issue}" for issue in issues), sources=sources[index])
+            content = (await rt.call(revision_agent, prompt)).structured.content
+            return index, content, _estimate_tokens(SECTION_REVISION_SYSTEM_PROMPT, prompt, content)
+
+        revisions = await asyncio.gather(*[revise(index, issues) for index, issues in issues_by_section.items()])
+        changed = []
+        for index, content, (input_tokens, output_tokens) in revisions:
+            round_stats["input_tokens"] += input_tokens
+            round_stats["output_tokens"] += output_tokens
+            if content.strip() != contents[index].strip():
+                contents[index] = content
+                changed.append(index)
+        round_stats["changed"] = len(changed)
+        if not changed:
+            break
+        to_review = sorted(changed)
+
+    for round_stats in rounds:
+        print(f"Revision round {round_stats['round']}: reviewed {round_stats['reviewed']}, "
+              f"flagged {round_stats['flagged']}, changed {round_stats['changed']} sections, "
+              f"~{round_stats['input_tokens']} input / ~{round_stats['output_tokens']} output tokens")
+    return list(zip(headings, contents)), rounds
+
+
+async def smooth_report_sections(model, title: str, sections):
+    """
+    Smooths independently written sections into one report.
+
+    One call reads the stitched report and lists the concepts its sections name
+    differently, with the name to use. Every section is then smoothed concurrently: it
+    sees only its neighbours' closing and opening paragraphs and that terminology, reworks
+    its own opening and closing sentences into transitions and uses the preferred names.
+    A smoothed section that comes back less than half as long as the original is treated
+    as truncated and the original kept.
+
+    Args:
+        model: The LLM used by the editing agents.
+        title (str): The report title.
+        sections (List[Tuple[str, str]]): The (heading, Markdown body) pairs, in report order.
+
+    Returns:
+        List[Tuple[str, str]]: The smoothed sections, in the same order.
+    """
+    with Registry().timed_setup("smooth_report_sections"):
+        terminology_agent = get_agent(("Terminology Agent", model_key(model)), lambda: rt.agent_node(
+            name="Terminology Agent", llm=model, system_message=TERMINOLOGY_SYSTEM_PROMPT,
+            output_schema=TerminologySchema))
+        smoothing_agent = get_agent(("Smoothing Agent", model_key(model)), lambda: rt.agent_node(
+            name="Smoothing Agent", llm=model, system_message=SMOOTHING_SYSTEM_PROMPT, output_schema=SectionSchema))
+    terms = (await rt.call(terminology_agent, TERMINOLOGY_USER_PROMPT.format(
+        report=_stitch_report(title, sections)))).structured.terms
+    terms_text = "\n".join(f"- {term.preferred} (not {', '.join(term.variants)})" for term in terms if term.variants)
+    outline_text = "\n".join(f"- {heading}" for heading, _ in sections)
+
+    async def smooth(index):
+        heading, content = sections[index]
+        previous = (f"### {sections[index - 1][0]}\n{_last_paragraph(sections[index - 1][1])}"
+                    if index > 0 else "This is the first section.")
+        following = (f"### {sections[index + 1][0]}\n{_first_paragraph(sections[index + 1][1])}"
+                     if index + 1 < len(sections) else "This is the last section.")
+        smoothed = (await rt.call(smoothing_agent, SMOOTHING_USER_PROMPT.format(
+            heading=heading, title=title, outline=outline_text, previous=previous, next=following,
+            terms=terms_text or "No inconsistencies were found.", content=content))).structured.content
+        if len(smoothed.strip()) < len(content.strip()) / 2:
+            print(f"Smoothing shortened the section '{heading}' too much, keeping it as written")
+            return heading, content
+        return heading, smoothed
+
+    smoothed = await asyncio.gather(*[smooth(index) for index in range(len(sections))])
+    print(f"Smoothed {len(sections)} sections, unified {len(terms)} terms")
+    return list(smoothed)
+
+
+async def write_report_by_sections(summary_for_papers, model, user_research_brief, markdown_file: str = None,
+                                   index=None) -> str:
+    """
+    Writes the research report section by section instead of in a single agent loop.
+
+    An outline is planned first from a short digest of every summary. The body sections are
+    then drafted concurrently, each from only the summaries the outline assigned to it, and
+    the Introduction and Conclusion are written concurrently from the openings of the
+    drafted sections. Every prompt therefore holds a handful of summaries at most. When an
+    index is given, each section also receives the passages retrieved for its heading and
+    goal. The draft then goes through `revise_report_sections`, is smoothed across section
+    boundaries by `smooth_report_sections` unless `REPORT_SMOOTHING` is "0", and is written
+    to disk once.
+
+    Args:
+        summary_for_papers (List[Tuple[str, str]]): (paper path, summary) pairs.
+        model: The LLM used by all writing agents.
+        user_research_brief (str): The user's research brief.
+        markdown_file (str, optional): Where to write the report. Defaults to the
+            `REPORT_PATH` environment variable, or "output/research_report.md".
+        index (VectorIndex, optional): The index of paragraphs and notes of the papers.
+
+    Returns:
+        str: The stitched Markdown report.
+    """
+    from tools.retrieval_tools import format_evidence
+
+    if markdown_file is None:
+        markdown_file = session_path(os.getenv("REPORT_PATH", os.path.join("output", "research_report.md")))
+    with Registry().timed_setup("write_report_by_sections"):
+        outline_agent = get_agent(("Outline Agent", model_key(model)), lambda: rt.agent_node(
+            name="Outline Agent", llm=model, system_message=OUTLINE_AGENT_SYSTEM_PROMPT, output_schema=OutlineSchema))
+        section_agent = get_agent(("Section Writing Agent", model_key(model)), lambda: rt.agent_node(
+            name="Section Writing Agent", llm=model, system_message=SECTION_WRITER_SYSTEM_PROMPT,
+            output_schema=SectionSchema))
+        framing_agent = get_agent(("Framing Writing Agent", model_key(model)), lambda: rt.agent_node(
+            name="Framing Writing Agent", llm=model, system_message=FRAMING_WRITER_SYSTEM_PROMPT,
+            output_schema=SectionSchema))
+
+    digest = "\n".join(
+        f"{number}. {os.path.basename(path)}: {_first_paragraph(summary)}"
+        for number, (path, summary) in enumerate(summary_for_papers, start=1)
+    )
+    outline_response = await rt.call(outline_agent, OUTLINE_USER_PROMPT.format(user_research_brief=user_research_brief,
+                                                                                digest=digest))
+    outline = outline_response.structured
+    outline_text = "\n".join(f"- {section.heading}: {section.goal}" for section in outline.sections)
+    print(f"Planned {len(outline.sections)} sections for '{outline.title}'")
+
+    sources = []
+    for section in outline.sections:
+        numbers = [n for n in dict.fromkeys(section.paper_numbers) if 1 <= n <= len(summary_for_papers)]
+        sources.append("\n\n".join(
+            f"### {os.path.basename(summary_for_papers[n - 1][0])}\n{summary_for_papers[n - 1][1]}" for n in numbers
+        ) or "No summaries were assigned.")
+
+    evidence = [[] for _ in outline.sections]
+    if index is not None:
+        top_k = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+        evidence = index.search([f"{section.heading}. {section.goal}" for section in outline.sections], top_k)
+
+    async def draft_section(section, section_sources, section_evidence):
+        response = await rt.call(section_agent, SECTION_USER_PROMPT.format(
+            title=outline.title, user_research_brief=user_research_brief, outline=outline_text,
+            heading=section.heading, goal=section.goal, summaries=section_sources,
+            evidence=format_evidence(section_evidence) or "No evidence was retrieved."))
+        return response.structured.content
+
+    bodies = await asyncio.gather(*[
+        draft_section(section, section_sources, section_evidence)
+        for section, section_sources, section_evidence in zip(outline.sections, sources, evidence)
+    ])
+
+    openings = "\n\n".join(
+        f"### {section.heading}\n{_first_paragraph(body)}" for section, body in zip(outline.sections, bodies)
+    )
+
+    async def draft_framing(part):
+        response = await rt.call(framing_agent, FRAMING_USER_PROMPT.format(
+            part=part, title=outline.title, user_research_brief=user_research_brief, sections=openings))
+        return response.structured.content
+
+    introduction, conclusion = await asyncio.gather(draft_framing("Introduction"), draft_framing("Conclusion"))
+
+    sections = ([("Introduction", introduction)]
+                + [(section.heading, body) for section, body in zip(outline.sections, bodies)]
+                + [("Conclusion", conclusion)])
+    sources = [openings] + sources + [openings]
+
+    sections, _ = await revise_report_sections(model, outline.title, sections, sources, user_research_brief)
+    if os.getenv("REPORT_SMOOTHING", "1") != "0":
+        sections = await smooth_report_sections(model, outline.title, sections)
+    report = _stitch_report(outline.title, sections)
+
+    os.makedirs(os.path.dirname(markdown_file) or ".", exist_ok=True)
+    write_markdown(report, markdown_file)
+    print(f"Report saved to {markdown_file}")
+    return report
+
+
+def build_writing_agent(model, max_rounds, critique_model=None):
+    from tools.retrieval_tools import retrieve_evidence
+
+    critique_model = critique_model or model
     critique_manifest = rt.ToolManifest(
         description=CRITIQUE_AGENT_DESCRIPTION,
         parameters=[
@@ -324,9 +1031,509 @@ async def write_report(summary_for_papers,model,user_research_brief):
             )
         ]
     )
-    critique_agent = rt.agent_node(name="CRITIQUE AGENT",llm=model,system_message=CRITIQUE_AGENT_SYSTEM_PROMPT,manifest=critique_manifest)
-    write_agent = rt.agent_node(name="Writing Agent ",llm=model,system_message=WRITING_AGENT_SYSTEM_PROMPT,tool_nodes=[generate_report,critique_agent,think_tool])
-    writing_agent_response = await rt.call(write_agent,WRITING_AGENT_USER_PROMPT.format(user_research_brief=user_research_brief,summaries=summary_for_papers))
+    critique_agent = rt.agent_node(name="CRITIQUE AGENT",llm=critique_model,system_message=CRITIQUE_AGENT_SYSTEM_PROMPT,manifest=critique_manifest)
+    return rt.agent_node(name="Writing Agent ",llm=model,system_message=WRITING_AGENT_SYSTEM_PROMPT,tool_nodes=[generate_report,critique_agent,think_tool,retrieve_evidence],
+                         max_tool_calls=3 * (max_rounds + 1))
+
+
+async def write_report(summary_for_papers,model,user_research_brief,index=None):
+    if os.getenv("REPORT_MODE", "agent") == "sections":
+        return await write_report_by_sections(summary_for_papers, model, user_research_brief, index=index)
+    # Each revision round is roughly a think, a generate_report and a critique call.
+    max_rounds = int(os.getenv("REPORT_MAX_REVISION_ROUNDS", "2"))
+    with Registry().timed_setup("write_report"):
+        critique_model = get_stage_llm("critique")
+        write_agent = get_agent(("Writing Agent", model_key(model), model_key(critique_model), max_rounds),
+                                lambda: build_writing_agent(model, max_rounds, critique_model))
+    with Registry().timed_stage("writing", model_key(model)):
+        writing_agent_response = await rt.call(write_agent,WRITING_AGENT_USER_PROMPT.format(user_research_brief=user_research_brief,summaries=summary_for_papers))
+
+def chunk_notes_by_tokens(notes_list: List[str], max_tokens: int) -> List[List[str]]:
+    """
+    Groups consecutive notes into chunks whose combined size stays within a token budget.
+
+    A single note larger than the budget is kept on its own rather than split, so
+    no note is ever cut in half.
+
+    Args:
+        notes_list (List[str]): The notes of one paper, in reading order.
+        max_tokens (int): The token budget of a chunk.
+
+    Returns:
+        List[List[str]]: The notes grouped into chunks, preserving order.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for note in notes_list:
+        note_tokens = count_tokens(note)
+        if current and current_tokens + note_tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(note)
+        current_tokens += note_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def get_note_taking_agent(model):
+    """Returns the shared note-taking agent on `model`."""
+    return get_agent(("note-taking agent", model_key(model)), lambda: rt.agent_node(
+        name="note-taking agent", llm=model, system_message=NOTE_TAKING_SYSTEM_PROMPT, output_schema=NotesSchema))
+
+
+def _is_structured_output_error(error: BaseException) -> bool:
+    # railtracks wraps a structured output that fails to parse or validate in LLMError, so look through the chain.
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (ValidationError, json.JSONDecodeError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+async def take_note(reading_agent, paragraph_text: str, user_research_brief: Optional[str], label: str = "",
+                    escalation_agent=None) -> NotesSchema:
+    """
+    Takes notes on one paragraph, retrying once with `escalation_agent` if the structured
+    output fails to parse or validate. Other errors, e.g. rate limits after the controller's
+    retries or timeouts, are raised rather than moved to the larger model.
+
+    Args:
+        reading_agent: The note-taking agent node.
+        paragraph_text (str): The text of the paragraph.
+        user_research_brief (Optional[str]): The user's research brief, or None for brief-independent notes.
+        label (str): A prefix for the progress messages.
+        escalation_agent (optional): The note-taking agent to retry a failed paragraph with.
+
+    Returns:
+        NotesSchema: The notes of the paragraph.
+    """
+    if user_research_brief is None:
+        prompt = EXTRACTION_USER_PROMPT.format(paragraph=paragraph_text)
+    else:
+        prompt = NOTE_TAKING_USER_PROMPT.format(paragraph=paragraph_text, user_research_brief=user_research_brief)
+    try:
+        with Registry().timed_stage("notes", model_key(reading_agent.get_llm())):
+            response = await rt.call(reading_agent, prompt)
+    except Exception as e:
+        if escalation_agent is None or not _is_structured_output_error(e):
+            raise
+        print(f"{label}: escalating a paragraph after {type(e).__name__}: {e}")
+        with Registry().timed_stage("notes escalation", model_key(escalation_agent.get_llm())):
+            response = await rt.call(escalation_agent, prompt)
+    return response.structured
+
+
+async def handle_note_task(payload: dict) -> dict:
+    """
+    Runs a note-taking task of the work queue, see `take_paragraph_notes`.
+
+    Args:
+        payload (dict): The "paragraph", "user_research_brief" and "label" of the task.
+
+    Returns:
+        dict: The notes, as `NotesSchema.model_dump()`.
+    """
+    reading_agent, escalation_agent, _ = get_reading_agents()
+    notes = await take_note(reading_agent, payload["paragraph"], payload["user_research_brief"],
+                            payload.get("label", ""), escalation_agent)
+    return notes.model_dump()
+
+
+async def take_paragraph_notes(reading_agent, paragraphs: List[Paragraph], user_research_brief: Optional[str],
+                               label: str = "", concurrency: int = None,
+                               escalation_agent=None) -> List[NotesSchema]:
+    """
+    Takes notes on the paragraphs of one paper concurrently.
+
+    At most `concurrency` paragraphs are in flight at once; how many of those reach the
+    provider at the same time is decided by the model's concurrency controller, which
+    backs off on rate limits. A paragraph whose structured output fails to parse or
+    validate is retried once with `escalation_agent`, usually on a larger model.
+
+    With a `WORK_QUEUE` configured, every paragraph becomes a durable task instead, so
+    workers started with `worker.py` in other processes or on other machines share the
+    work. This process runs `WORK_QUEUE_LOCAL_WORKERS` (default `concurrency`) workers on
+    the paper's own tasks, so reading also progresses without remote workers.
+
+    Args:
+        reading_agent: The note-taking agent node.
+        paragraphs (List[Paragraph]): The paragraphs of the paper, in reading order.
+        user_research_brief (Optional[str]): The user's research brief, or None for brief-independent notes.
+        label (str): A prefix for the progress messages, e.g. "paper 1/3 (paper.pdf)".
+        concurrency (int, optional): The number of paragraphs in flight. Defaults to the
+            `PARAGRAPH_CONCURRENCY` environment variable, or 16.
+        escalation_agent (optional): The note-taking agent to retry failed paragraphs with.
+
+    Returns:
+        List[NotesSchema]: The notes of every paragraph, in the order of `paragraphs`.
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv("PARAGRAPH_CONCURRENCY", "16"))
+    queue = get_work_queue()
+    if queue is not None:
+        return await take_paragraph_notes_on_queue(queue, paragraphs, user_research_brief, label, concurrency)
+    slots = asyncio.Semaphore(max(1, concurrency))
+    finished = 0
+
+    async def take_notes(paragraph):
+        nonlocal finished
+        async with slots:
+            notes = await take_note(reading_agent, paragraph.text, user_research_brief, label, escalation_agent)
+        finished += 1
+        report_progress(f"{label}: paragraph {finished}/{len(paragraphs)}")
+        return notes
+
+    return await asyncio.gather(*[take_notes(paragraph) for paragraph in paragraphs])
+
+
+async def take_paragraph_notes_on_queue(queue: WorkQueue, paragraphs: List[Paragraph], user_research_brief: Optional[str],
+                                        label: str, concurrency: int) -> List[NotesSchema]:
+    """
+    Takes notes on the paragraphs of one paper through the work queue, see `take_paragraph_notes`.
+
+    Returns:
+        List[NotesSchema]: The notes of every paragraph, in the order of `paragraphs`.
+    """
+    batch = uuid.uuid4().hex
+    await asyncio.to_thread(queue.enqueue, batch, [
+        {"kind": "notes", "paragraph": paragraph.text, "user_research_brief": user_research_brief, "label": label}
+        for paragraph in paragraphs])
+    local_workers = int(os.getenv("WORK_QUEUE_LOCAL_WORKERS", str(concurrency)))
+    workers = None
+    if local_workers > 0:
+        workers = asyncio.create_task(run_worker(queue, handle_note_task, local_workers, batch=batch))
+    try:
+        results = await gather_batch(queue, batch, progress=lambda finished, total: report_progress(
+            f"{label}: paragraph {finished}/{total}"))
+    finally:
+        if workers is not None:
+            workers.cancel()
+        await asyncio.to_thread(queue.delete_batch, batch)
+    return [NotesSchema(**result) for result in results]
+
+
+async def summarize_notes(summarizing_agent, notes_list: List[str], user_research_brief: str,
+                          max_chunk_tokens: int = None, fan_out: int = None) -> str:
+    """
+    Summarizes the notes of one paper with a parallel map-reduce over token-bounded chunks.
+
+    Notes are grouped into chunks of at most `max_chunk_tokens` tokens and every chunk
+    is summarized concurrently. The chunk summaries are then combined in a tree: each
+    reduce step merges groups of `fan_out` summaries in parallel until one remains.
+    When all the notes fit into a single chunk this is exactly one summarization call
+    over the whole `notes_list`, as for short papers.
+
+    Args:
+        summarizing_agent: The agent node used for both the map and the reduce calls.
+        notes_list (List[str]): The notes of the paper, in reading order.
+        user_research_brief (str): The user's research brief.
+        max_chunk_tokens (int, optional): Token budget of a chunk. Defaults to the
+            `SUMMARY_CHUNK_TOKENS` environment variable, or 6000. A value of 0 or less
+            disables chunking.
+        fan_out (int, optional): Number of summaries merged per reduce call. Defaults
+            to the `SUMMARY_FAN_OUT` environment variable, or 4.
+
+    Returns:
+        str: The summary of the paper.
+    """
+    if max_chunk_tokens is None:
+        max_chunk_tokens = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+    if fan_out is None:
+        fan_out = int(os.getenv("SUMMARY_FAN_OUT", "4"))
+    fan_out = max(2, fan_out)
+
+    if max_chunk_tokens <= 0:
+        chunks = [notes_list]
+    else:
+        chunks = chunk_notes_by_tokens(notes_list, max_chunk_tokens)
+
+    async def summarize(prompt):
+        with Registry().timed_stage("summary", model_key(summarizing_agent.get_llm())):
+            response = await rt.call(summarizing_agent, prompt)
+        return response.structured.summary
+
+    if len(chunks) <= 1:
+        return await summarize(SUMMARIZATION_USER_PROMPT.format(user_research_brief=user_research_brief,
+                                                                notes=notes_list))
+
+    print(f"Summarizing {len(notes_list)} notes in {len(chunks)} chunks (fan-out {fan_out})")
+    summaries = await asyncio.gather(*[
+        summarize(SUMMARIZATION_USER_PROMPT.format(user_research_brief=user_research_brief, notes=chunk))
+        for chunk in chunks
+    ])
+    while len(summaries) > 1:
+        groups = [summaries[i:i + fan_out] for i in range(0, len(summaries), fan_out)]
+        summaries = await asyncio.gather(*[
+            summarize(SUMMARY_REDUCE_USER_PROMPT.format(user_research_brief=user_research_brief,
+                                                        summaries="\n\n".join(group)))
+            if len(group) > 1 else asyncio.sleep(0, result=group[0])
+            for group in groups
+        ])
+    return summaries[0]
+
+
+@dataclass
+class PaperReading:
+    """
+    The paragraphs of one paper with their notes, and the summary of those notes.
+
+    A paper only skimmed in tiered reading keeps the skimmed paragraphs; `relevance` is the
+    score its skim got, None if it was not skimmed.
+    """
+    paragraphs: List[Paragraph]
+    notes: List[NotesSchema]
+    summary: str
+    relevance: Optional[int] = None
+    skimmed: bool = False
+
+
+def get_reading_agents():
+    """
+    Returns the agents that read a paper, each on the model of its stage.
+
+    Returns:
+        Tuple: The note-taking agent, the note-taking agent on the escalation model (None
+        when escalation is off or uses the same model) and the summarization agent.
+    """
+    notes_model_name = stage_model_name("notes")
+    notes_model = get_llm(notes_model_name)
+    summary_model = get_stage_llm("summary")
+    reading_agent = get_note_taking_agent(notes_model)
+    # A paragraph the small notes model fails on is retried once on the escalation model.
+    escalation_model_name = os.getenv("MODEL_NOTES_ESCALATION", os.getenv("MODEL", DEFAULT_MODEL))
+    escalation_agent = None
+    if escalation_model_name and escalation_model_name != notes_model_name:
+        escalation_agent = get_note_taking_agent(get_llm(escalation_model_name))
+    summarizing_agent = get_agent(("summarization-agent", model_key(summary_model)), lambda: rt.agent_node(
+        name="summarization-agent", llm=summary_model, system_message=SUMMARIZATION_SYSTEM_PROMPT,
+        output_schema=SummarizationSchema))
+    return reading_agent, escalation_agent, summarizing_agent
+
+
+def get_skim_agent():
+    """Returns the agent that rates a skimmed paper's relevance and summarizes it, on the "relevance" stage model."""
+    model = get_stage_llm("relevance")
+    return get_agent(("skim-assessment-agent", model_key(model)), lambda: rt.agent_node(
+        name="skim-assessment-agent", llm=model, system_message=SKIM_ASSESSMENT_SYSTEM_PROMPT,
+        output_schema=SkimAssessmentSchema))
+
+
+def get_note_relevance_agent():
+    """Returns the agent that selects the notes relevant to a brief, on the "relevance" stage model."""
+    model = get_stage_llm("relevance")
+    return get_agent(("note-relevance-agent", model_key(model)), lambda: rt.agent_node(
+        name="note-relevance-agent", llm=model, system_message=NOTE_RELEVANCE_SYSTEM_PROMPT,
+        output_schema=NoteRelevanceSchema))
+
+
+async def select_relevant_notes(notes: List[NotesSchema], user_research_brief: str,
+                                max_chunk_tokens: int = None) -> List[NotesSchema]:
+    """
+    Keeps the brief-independent notes of a paper that are relevant to a brief.
+
+    The notes are numbered and grouped into chunks of at most `max_chunk_tokens` tokens, and
+    one call per chunk, all concurrent, returns the numbers of the relevant notes. This costs
+    a few calls per paper instead of one per paragraph.
+
+    Args:
+        notes (List[NotesSchema]): The notes of the paper's paragraphs, in reading order.
+        user_research_brief (str): The user's research brief.
+        max_chunk_tokens (int, optional): Token budget of a chunk. Defaults to the
+            `SUMMARY_CHUNK_TOKENS` environment variable, or 6000.
+
+    Returns:
+        List[NotesSchema]: The notes in the same order, with empty notes for paragraphs not
+        relevant to the brief.
+    """
+    if max_chunk_tokens is None:
+        max_chunk_tokens = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+    relevance_agent = get_note_relevance_agent()
+    numbered = [f"[{number}] {note.notes}" for number, note in enumerate(notes, start=1) if note.notes.strip()]
+    chunks = chunk_notes_by_tokens(numbered, max_chunk_tokens) if max_chunk_tokens > 0 else [numbered]
+
+    async def select(chunk):
+        with Registry().timed_stage("relevance", model_key(relevance_agent.get_llm())):
+            response = await rt.call(relevance_agent, NOTE_RELEVANCE_USER_PROMPT.format(
+                user_research_brief=user_research_brief, notes="\n".join(chunk)))
+        return response.structured.relevant_notes
+
+    relevant = set()
+    for numbers in await asyncio.gather(*[select(chunk) for chunk in chunks if chunk]):
+        relevant.update(numbers)
+    return [note if number in relevant else NotesSchema(notes="", important_sentences=[])
+            for number, note in enumerate(notes, start=1)]
+
+
+async def note_paragraphs(paragraphs: List[Paragraph], user_research_brief: str, label: str = "",
+                          document: str = None, extraction: str = None) -> List[NotesSchema]:
+    """
+    Takes the notes of a paper's paragraphs for a brief.
+
+    Without a `document`, notes are taken on every paragraph against the brief. With the
+    `KnowledgeBase` keys of the document, notes are taken without the brief, only on the
+    paragraphs never noted before, and stored; `select_relevant_notes` then keeps those
+    relevant to the brief. A paper read before for another brief thus costs a few relevance
+    calls instead of a call per paragraph.
+
+    Args:
+        paragraphs (List[Paragraph]): The paragraphs, in reading order.
+        user_research_brief (str): The user's research brief.
+        label (str): A prefix for the progress messages.
+        document (str, optional): The key returned by `document_key`.
+        extraction (str, optional): The value of `extraction_fingerprint`.
+
+    Returns:
+        List[NotesSchema]: The notes of every paragraph, in the order of `paragraphs`.
+    """
+    reading_agent, escalation_agent, _ = get_reading_agents()
+    if document is None:
+        return await take_paragraph_notes(reading_agent, paragraphs, user_research_brief, label,
+                                          escalation_agent=escalation_agent)
+    knowledge_base = KnowledgeBase()
+    stored = knowledge_base.get_paragraph_notes(document, extraction)
+    missing = [paragraph for paragraph in paragraphs if paragraph.start not in stored]
+    if len(missing) < len(paragraphs):
+        report_progress(f"{label}: reusing the notes of {len(paragraphs) - len(missing)}/{len(paragraphs)} "
+                        f"paragraphs from the knowledge base")
+    if missing:
+        taken = await take_paragraph_notes(reading_agent, missing, None, label, escalation_agent=escalation_agent)
+        new_notes = {paragraph.start: note.model_dump() for paragraph, note in zip(missing, taken)}
+        knowledge_base.put_paragraph_notes(document, extraction, new_notes)
+        stored = {**stored, **new_notes}
+    report_progress(f"{label}: selecting the notes relevant to the brief")
+    return await select_relevant_notes([NotesSchema(**stored[paragraph.start]) for paragraph in paragraphs],
+                                       user_research_brief)
+
+
+async def read_paper_tiered(paragraphs: List[Paragraph], user_research_brief: str, label: str = "",
+                            threshold: int = None, document: str = None, extraction: str = None) -> PaperReading:
+    """
+    Skims a paper and reads it in full only if the skim finds it relevant enough.
+
+    Notes are first taken on the abstract, introduction and conclusion chunks only, see
+    `skim_chunk_indices`. One call then rates the paper's relevance to the brief from 0 to
+    10 and summarizes the skim notes. Below `threshold` the skim notes and that summary are
+    kept; otherwise the remaining chunks are read and all notes summarized as in a full read.
+
+    Args:
+        paragraphs (List[Paragraph]): The chunks of the paper, in reading order.
+        user_research_brief (str): The user's research brief.
+        label (str): A prefix for the progress messages.
+        threshold (int, optional): The relevance needed for a full read. Defaults to
+            `READING_RELEVANCE_THRESHOLD` or 6.
+        document (str, optional): The `KnowledgeBase` key of the paper, see `note_paragraphs`.
+        extraction (str, optional): The extraction settings of the paper, see `note_paragraphs`.
+
+    Returns:
+        PaperReading: The reading, with the skimmed paragraphs only if the paper was not read in full.
+    """
+    if threshold is None:
+        threshold = int(os.getenv("READING_RELEVANCE_THRESHOLD", "6"))
+    _, _, summarizing_agent = get_reading_agents()
+    skim_agent = get_skim_agent()
+    skimmed = skim_chunk_indices(paragraphs)
+    skim_paragraphs = [paragraphs[index] for index in skimmed]
+    skim_notes = await note_paragraphs(skim_paragraphs, user_research_brief, f"{label} (skim)", document, extraction)
+    with Registry().timed_stage("relevance", model_key(skim_agent.get_llm())):
+        response = await rt.call(skim_agent, SKIM_ASSESSMENT_USER_PROMPT.format(
+            user_research_brief=user_research_brief, notes=[note.notes for note in skim_notes]))
+    assessment = response.structured
+    if len(skimmed) == len(paragraphs):
+        report_progress(f"{label}: relevance {assessment.relevance}/10, the skim covered the whole paper")
+        return PaperReading(paragraphs, skim_notes, assessment.summary, assessment.relevance)
+    if assessment.relevance < threshold:
+        report_progress(f"{label}: relevance {assessment.relevance}/10, keeping the notes of "
+                        f"{len(skimmed)}/{len(paragraphs)} chunks")
+        return PaperReading(skim_paragraphs, skim_notes, assessment.summary, assessment.relevance, skimmed=True)
+
+    report_progress(f"{label}: relevance {assessment.relevance}/10, reading in full")
+    rest = [index for index in range(len(paragraphs)) if index not in set(skimmed)]
+    rest_notes = await note_paragraphs([paragraphs[index] for index in rest], user_research_brief, label,
+                                       document, extraction)
+    notes_by_index = {**dict(zip(skimmed, skim_notes)), **dict(zip(rest, rest_notes))}
+    notes = [notes_by_index[index] for index in range(len(paragraphs))]
+    report_progress(f"{label}: summarizing")
+    summary = await summarize_notes(summarizing_agent, [note.notes for note in notes if note.notes.strip()],
+                                    user_research_brief)
+    return PaperReading(paragraphs, notes, summary, assessment.relevance)
+
+
+async def read_paper(file: str, user_research_brief: str, label: str = "") -> PaperReading:
+    """
+    Splits a paper into chunks, takes notes on them and summarizes the notes.
+
+    Papers are split with the structure-aware chunker of `tools.chunking`, which drops
+    boilerplate and the references and sizes chunks by tokens. Set `PDF_CHUNKING=blocks` to
+    take notes on every raw text block instead.
+
+    With `READING_MODE=tiered` the paper is skimmed first and only read in full if it is
+    relevant enough, see `read_paper_tiered`.
+
+    Paragraphs, notes and summaries are kept in the persistent `KnowledgeBase`. A paper read
+    in an earlier session is not split again and its brief-independent notes are reused, so
+    another brief only costs the relevance and summary pass, see `note_paragraphs`. If it was
+    read for the same brief and reading mode its notes and summary are reused without any LLM
+    call.
+
+    Args:
+        file (str): The path of the PDF.
+        user_research_brief (str): The user's research brief.
+        label (str): A prefix for the progress messages.
+
+    Returns:
+        PaperReading: The paragraphs, their notes and the summary.
+    """
+    tiered = os.getenv("READING_MODE", "full") == "tiered"
+    knowledge_base = KnowledgeBase() if KnowledgeBase.enabled() else None
+    paragraphs = None
+    document = extraction = None
+    if knowledge_base is not None:
+        document = document_key(file)
+        extraction = extraction_fingerprint()
+        brief = brief_fingerprint(user_research_brief)
+        if tiered:
+            # A skim keeps fewer notes than a full read, so tiered readings are stored apart.
+            brief += f":tiered:{os.getenv('READING_RELEVANCE_THRESHOLD', '6')}"
+        paragraphs = knowledge_base.get_paragraphs(document, extraction)
+        if paragraphs is not None:
+            stored = knowledge_base.get_reading(document, extraction, brief)
+            if stored is not None:
+                report_progress(f"{label}: reusing the notes of {document} from the knowledge base")
+                notes, summary = stored
+                by_start = {paragraph.start: paragraph for paragraph in paragraphs}
+                noted = [by_start[note["start"]] for note in notes] if notes and "start" in notes[0] else paragraphs
+                return PaperReading(noted, [NotesSchema(**note) for note in notes], summary,
+                                    skimmed=len(noted) < len(paragraphs))
+    if paragraphs is None:
+        with resource_stage("parse pdf"):
+            if os.getenv("PDF_CHUNKING", "sections") == "blocks":
+                paragraphs = load_pdf_paragraphs(file)
+            else:
+                paragraphs = load_pdf_chunks(file)
+        if knowledge_base is not None:
+            knowledge_base.put_paragraphs(document, extraction, paragraphs)
+
+    if tiered:
+        reading = await read_paper_tiered(paragraphs, user_research_brief, label, document=document,
+                                          extraction=extraction)
+    else:
+        _, _, summarizing_agent = get_reading_agents()
+        notes = await note_paragraphs(paragraphs, user_research_brief, label, document, extraction)
+        report_progress(f"{label}: summarizing")
+        summary = await summarize_notes(summarizing_agent, [note.notes for note in notes if note.notes.strip()],
+                                        user_research_brief)
+        reading = PaperReading(paragraphs, notes, summary)
+    if knowledge_base is not None:
+        knowledge_base.put_reading(document, extraction, brief,
+                                   [{"start": paragraph.start, **note.model_dump()}
+                                    for paragraph, note in zip(reading.paragraphs, reading.notes)], reading.summary)
+    return reading
+
 
 # @rt.function_node
 # async def read_write_notes_for_papers_in_a_directory(directory: str, user_research_brief: str):
@@ -399,6 +1606,7 @@ async def write_report(summary_for_papers,model,user_research_brief):
 #     return f"Finished reading all papers and done writing the report "
 
 @rt.function_node
+@instrumented("read_write_notes_for_papers_in_a_directory")
 async def read_write_notes_for_papers_in_a_directory(user_research_brief:str):
     """
     Reads a collection of papers stored in a virtual directory and prepares them
@@ -421,45 +1629,75 @@ async def read_write_notes_for_papers_in_a_directory(user_research_brief:str):
     Raises:
         KeyError: If the directory does not exist in the virtual file system.
     """
-    highlighted_papers_dir = "highlighted_papers"
+    from tools.retrieval_tools import VectorIndex
+
+    highlighted_papers_dir = session_path("highlighted_papers")
     os.makedirs(highlighted_papers_dir, exist_ok=True)
-    model = rt.llm.PortKeyLLM(os.getenv("MODEL", "@openai/gpt-4.1-2025-04-14"))
-    reading_agent = rt.agent_node(name="note-taking agent", llm=model, system_message=NOTE_TAKING_SYSTEM_PROMPT,
-                                  output_schema=NotesSchema)
-    summarizing_agent = rt.agent_node(name="summarization-agent", llm=model, system_message=SUMMARIZATION_SYSTEM_PROMPT,
-                                      output_schema=SummarizationSchema)
+    with Registry().timed_setup("read_write_notes_for_papers_in_a_directory"):
+        model = get_stage_llm("writing")
+        get_reading_agents()
+        if os.getenv("READING_MODE", "full") == "tiered":
+            get_skim_agent()
     vfs = rt.context.get("vfs")
+    ingest = rt.context.get("ingest", False)
     summary_for_papers = []
-    for entry in vfs:
-        file = entry.get("path")
-        file_name = os.path.basename(file)
-        if file:
-            paragraphs = load_pdf_paragraphs(file)
-            notes_list = []
-            sentences_list = []
-            for paragraph in paragraphs:
-                await asyncio.sleep(60)
-                USER_PROMPT = f"""
-                Take notes for the following paragraph making sure its relevant to the research brief.
-                ## Paragraph
-                {paragraph}
-                ## Research brief.
-                {user_research_brief}
-                """
-                reading_agent_response = await rt.call(reading_agent, USER_PROMPT)
-                notes_list.append(reading_agent_response.structured.notes)
-                sentences = reading_agent_response.structured.important_sentences
-                sentences_list.extend(sentences)
-            output_highlighted_path = os.path.join(highlighted_papers_dir, file_name)
-            highlight_sentences_in_pdf(file,output_highlighted_path,sentences_list,notes_list)
-            SUMMARIZATION_USER_PROMPT = f"""
-            This is the user research brief.
-            ## Research brief.
-            {user_research_brief}
-            ## Notes
-            {notes_list}
-            """
-            summarising_agent_response = await rt.call(summarizing_agent, SUMMARIZATION_USER_PROMPT)
-            summary_for_papers.append((file, summarising_agent_response.structured.summary))
-    await write_report(summary_for_papers, model, user_research_brief)
+    skimmed_papers = 0
+    index = VectorIndex()
+    evidence_store = EvidenceStore()
+    rt.context.put("evidence_store", evidence_store)
+    try:
+        for paper_number, entry in enumerate(vfs, start=1):
+            file = entry.get("path")
+            file_name = os.path.basename(file)
+            if file:
+                label = f"paper {paper_number}/{len(vfs)} ({file_name})"
+                # With streaming ingest the paper may already have been read while the rest downloaded.
+                ingested = ingest.get(file, rt.context.get("research_brief", user_research_brief)) if ingest else None
+                reading = None
+                if ingested is not None:
+                    report_progress(f"{label}: waiting for streaming ingest")
+                    try:
+                        reading = await asyncio.wrap_future(ingested)
+                    except Exception as e:
+                        print(f"Streaming ingest of {file_name} failed ({e}), reading it again")
+                if reading is None:
+                    reading = await read_paper(file, user_research_brief, label)
+                paragraphs = reading.paragraphs
+                skimmed_papers += reading.skimmed
+                # Irrelevant paragraphs have empty notes, which would only be indexed as zero vectors.
+                noted_paragraphs = []
+                for paragraph, notes in zip(paragraphs, reading.notes):
+                    if notes.notes.strip():
+                        noted_paragraphs.append((paragraph, notes.notes))
+                        evidence_store.add_note(file, paragraph, notes.notes)
+                    for sentence in notes.important_sentences:
+                        evidence_store.add_sentence(file, paragraph, sentence)
+                report_progress(f"{label}: highlighting")
+                output_highlighted_path = os.path.join(highlighted_papers_dir, file_name)
+                with resource_stage("highlight"):
+                    highlight_sentences_in_pdf(file, output_highlighted_path, evidence_store.for_document(file))
+                summary_for_papers.append((file, reading.summary))
+                with resource_stage("index"):
+                    index.add([paragraph.text for paragraph in paragraphs],
+                              [{"source": file, "kind": "paragraph", "page": paragraph.page, "bbox": paragraph.bbox,
+                                "start": paragraph.start} for paragraph in paragraphs])
+                    index.add([note for _, note in noted_paragraphs],
+                              [{"source": file, "kind": "note", "page": paragraph.page, "bbox": paragraph.bbox,
+                                "start": paragraph.start} for paragraph, _ in noted_paragraphs])
+    finally:
+        # Stops the streaming ingest's worker thread and session.
+        if ingest:
+            ingest.close()
+    index.save(session_path(os.getenv("VECTOR_INDEX_DIR", "vector_index")))
+    rt.context.put("vector_index", index)
+    report_progress("writing the report")
+    await write_report(summary_for_papers, model, user_research_brief, index=index)
+    print(Registry().rate_control_report())
+    print(Registry().stage_report())
+    if os.getenv("READING_MODE", "full") == "tiered":
+        print(f"Tiered reading: {skimmed_papers} of {len(summary_for_papers)} papers only skimmed")
+    print(ResourceMonitor().format_report())
+    ResourceMonitor().write_report(session_path("resource_report.json"))
+    if Cassette().enabled:
+        print(Cassette().report())
     return f"Finished reading all papers and done writing the report "
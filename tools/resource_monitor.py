@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from threading import RLock
+from typing import Dict, Optional
+
+from singleton import SingletonMeta
+
+
+@dataclass
+class ResourceSample:
+    """A snapshot of the process's resource usage."""
+    wall: float
+    cpu: float
+    thread_cpu: float
+    rss: int
+    fds: Optional[int]
+    read_bytes: Optional[int]
+    write_bytes: Optional[int]
+
+
+@dataclass
+class StageResources:
+    """The resources used by every run of one stage, summed or maximized over its runs."""
+    calls: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    thread_cpu: float = 0.0
+    peak_rss: int = 0
+    max_rss_growth: int = 0
+    max_fds: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+
+def _read_proc(path: str) -> Dict[str, int]:
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            parts = value.split()
+            if parts and parts[0].isdigit():
+                values[key] = int(parts[0])
+    return values
+
+
+def sample_resources() -> ResourceSample:
+    """
+    Samples the current RSS, CPU time, open file descriptors and storage bytes of the process.
+
+    On Linux the values come from /proc/self; elsewhere RSS falls back to the peak RSS
+    reported by `resource` (0 on Windows, which has no `resource` module) and file
+    descriptors and bytes are unknown (None).
+
+    Returns:
+        ResourceSample: The sample.
+    """
+    wall, cpu, thread_cpu = time.perf_counter(), time.process_time(), time.thread_time()
+    try:
+        rss = _read_proc("/proc/self/status")["VmRSS"] * 1024
+        fds = len(os.listdir("/proc/self/fd"))
+        io = _read_proc("/proc/self/io")
+        read_bytes, write_bytes = io.get("read_bytes"), io.get("write_bytes")
+    except (OSError, KeyError):
+        rss, fds, read_bytes, write_bytes = peak_rss(), None, None, None
+    return ResourceSample(wall, cpu, thread_cpu, rss, fds, read_bytes, write_bytes)
+
+
+def peak_rss() -> int:
+    """Returns the highest RSS of the process so far, in bytes, or 0 where it is unknown."""
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module.
+        return 0
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class ResourceMonitor(metaclass=SingletonMeta):
+    """
+    Records the memory, CPU and I/O cost of every pipeline stage and tool node of a run.
+
+    Stages are measured with `stage` (or the `resource_stage` / `instrumented` helpers),
+    which samples the process before and after and adds the difference to the stage's
+    totals. RSS, file descriptors and bytes are process-wide, so stages running at the same
+    time share them; the thread CPU time is exact for synchronous stages. With
+    `RESOURCE_TRACEMALLOC=1` Python allocations are traced and the report lists the
+    `RESOURCE_TRACEMALLOC_TOP` (default 10) largest allocation sites. `RESOURCE_MONITOR=0`
+    turns sampling off.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self.enabled = os.getenv("RESOURCE_MONITOR", "1") != "0"
+        self.stages: Dict[str, StageResources] = {}
+        self.start = sample_resources()
+        if os.getenv("RESOURCE_TRACEMALLOC", "0") == "1" and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.getenv("RESOURCE_TRACEMALLOC_FRAMES", "1")))
+
+    def record(self, stage: str, before: ResourceSample, after: ResourceSample, synchronous: bool = True):
+        """
+        Adds the difference between two samples to a stage.
+
+        Args:
+            stage (str): The stage, e.g. "parse pdf".
+            before (ResourceSample): The sample taken when the stage started.
+            after (ResourceSample): The sample taken when it finished.
+            synchronous (bool): Whether the stage ran on a single thread, making its thread CPU time meaningful.
+        """
+        with self._lock:
+            totals = self.stages.setdefault(stage, StageResources())
+            totals.calls += 1
+            totals.wall += after.wall - before.wall
+            totals.cpu += after.cpu - before.cpu
+            if synchronous:
+                totals.thread_cpu += after.thread_cpu - before.thread_cpu
+            totals.peak_rss = max(totals.peak_rss, after.rss)
+            totals.max_rss_growth = max(totals.max_rss_growth, after.rss - before.rss)
+            if after.fds is not None:
+                totals.max_fds = max(totals.max_fds, before.fds, after.fds)
+            if after.read_bytes is not None:
+                totals.read_bytes += after.read_bytes - before.read_bytes
+                totals.write_bytes += after.write_bytes - before.write_bytes
+
+    @contextmanager
+    def stage(self, stage: str, synchronous: bool = True):
+        """
+        Measures the wrapped block as one run of `stage`.
+
+        Args:
+            stage (str): The stage, e.g. "highlight".
+            synchronous (bool): False for blocks that await, whose thread CPU time is not recorded.
+        """
+        if not self.enabled:
+            yield
+            return
+        before = sample_resources()
+        try:
+            yield
+        finally:
+            self.record(stage, before, sample_resources(), synchronous)
+
+    def report(self) -> Dict:
+        """
+        Returns the resources of the run so far.
+
+        Returns:
+            Dict: The process totals since the monitor started, one entry per stage and, with
+            tracemalloc, the current and peak traced memory and the top allocation sites.
+        """
+        now = sample_resources()
+        with self._lock:
+            stages = {name: asdict(totals) for name, totals in self.stages.items()}
+        report = {
+            "process": {
+                "wall": now.wall - self.start.wall, "cpu": now.cpu - self.start.cpu, "rss": now.rss,
+                "peak_rss": peak_rss(), "fds": now.fds,
+                "read_bytes": None if now.read_bytes is None else now.read_bytes - self.start.read_bytes,
+                "write_bytes": None if now.write_bytes is None else now.write_bytes - self.start.write_bytes,
+            },
+            "stages": stages,
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:int(os.getenv("RESOURCE_TRACEMALLOC_TOP", "10"))]
+            report["tracemalloc"] = {
+                "current": current, "peak": peak,
+                "top": [{"site": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in top],
+            }
+        return report
+
+    def format_report(self) -> str:
+        """
+        Formats `report` for the console.
+
+        Returns:
+            str: One line for the process and one per stage, followed by the top allocation sites if traced.
+        """
+        report = self.report()
+        process = report["process"]
+        lines = [f"process: {process['wall']:.1f}s wall, {process['cpu']:.1f}s CPU, RSS {_mb(process['rss'])} "
+                 f"(peak {_mb(process['peak_rss'])}), {process['fds']} fds, read {_mb(process['read_bytes'])}, "
+                 f"written {_mb(process['write_bytes'])}"]
+        for name, totals in sorted(report["stages"].items(), key=lambda item: -item[1]["cpu"]):
+            lines.append(f"{name}: {totals['calls']} runs, {totals['wall']:.1f}s wall, {totals['cpu']:.1f}s CPU "
+                         f"({totals['thread_cpu']:.1f}s on its thread), peak RSS {_mb(totals['peak_rss'])}, "
+                         f"max growth {_mb(totals['max_rss_growth'])}, max {totals['max_fds']} fds, "
+                         f"read {_mb(totals['read_bytes'])}, written {_mb(totals['write_bytes'])}")
+        if "tracemalloc" in report:
+            traced = report["tracemalloc"]
+            lines.append(f"tracemalloc: {_mb(traced['current'])} traced (peak {_mb(traced['peak'])})")
+            lines.extend(f"  {_mb(site['size'])} in {site['count']} blocks: {site['site']}" for site in traced["top"])
+        return "\n".join(lines)
+
+    def write_report(self, path: str):
+        """
+        Writes `report` as JSON.
+
+        Args:
+            path (str): The file to write.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def _mb(value: Optional[int]) -> str:
+    return "n/a" if value is None else f"{value / (1 << 20):.1f} MB"
+
+
+def resource_stage(stage: str, synchronous: bool = True):
+    """
+    Measures a block as one run of a stage, see `ResourceMonitor.stage`.
+
+    Args:
+        stage (str): The stage, e.g. "parse pdf".
+        synchronous (bool): False for blocks that await.
+    """
+    return ResourceMonitor().stage(stage, synchronous)
+
+
+def instrumented(stage: str):
+    """
+    Measures every call of a function as one run of a stage.
+
+    Apply it below `@rt.function_node` to measure a tool node; the signature and
+    docstring the tool schema is built from are kept.
+
+    Args:
+        stage (str): The stage, usually the name of the tool.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def measured(*args, **kwargs):
+                with resource_stage(stage, synchronous=False):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def measured(*args, **kwargs):
+                with resource_stage(stage):
+                    return func(*args, **kwargs)
+        return measured
+
+    return decorator
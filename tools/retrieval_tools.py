@@ -0,0 +1,227 @@
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import railtracks as rt
+
+from tools.util_tools import session_path
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Embeds text into fixed-size dense vectors with the hashing trick.
+
+    Every word n-gram (or character n-gram) is hashed with CRC32 into one of `dimensions`
+    buckets with a hash-derived sign. Counts are log-scaled and every vector is L2
+    normalized, so a dot product between two embeddings is their cosine similarity. No
+    model has to be downloaded and embeddings are identical across processes.
+    """
+
+    def __init__(self, dimensions: int = 2048, analyzer: str = "word", ngram_range: Tuple[int, int] = (1, 2)):
+        """
+        Args:
+            dimensions (int): The size of the embedding vectors.
+            analyzer (str): "word" to hash word n-grams or "char" to hash character n-grams.
+            ngram_range (Tuple[int, int]): The smallest and largest n-gram size to hash.
+        """
+        if analyzer not in ("word", "char"):
+            raise ValueError(f"Unknown analyzer {analyzer!r}, expected 'word' or 'char'.")
+        self.dimensions = dimensions
+        self.analyzer = analyzer
+        self.ngram_range = ngram_range
+
+    def ngrams(self, text: str) -> List[str]:
+        """
+        Splits a text into the n-grams that are hashed.
+
+        Args:
+            text (str): The text to split.
+
+        Returns:
+            List[str]: The word or character n-grams of the lower-cased text.
+        """
+        text = text.lower()
+        low, high = self.ngram_range
+        if self.analyzer == "word":
+            tokens = WORD_PATTERN.findall(text)
+            joiner = " "
+        else:
+            tokens = list(" ".join(text.split()))
+            joiner = ""
+        grams = []
+        for n in range(low, high + 1):
+            grams.extend(joiner.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds a batch of texts.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), dimensions) with L2-normalized rows.
+        """
+        rows, buckets, signs = [], [], []
+        for row, text in enumerate(texts):
+            for gram in self.ngrams(text):
+                digest = zlib.crc32(gram.encode("utf-8"))
+                rows.append(row)
+                buckets.append(digest % self.dimensions)
+                signs.append(1.0 if digest & 0x80000000 else -1.0)
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.array(rows), np.array(buckets)), np.array(signs, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class VectorIndex:
+    """
+    An in-memory (or memory-mapped) embedding index with batched top-k cosine search.
+
+    Vectors are stored as one float32 matrix next to a list of metadata records, one per
+    row. `save` writes them as `vectors.npy` and `records.json`; `load` can memory-map the
+    vectors so that large indexes are paged in by the OS instead of read into memory.
+    """
+
+    def __init__(self, embedder: HashingEmbedder = None):
+        self.embedder = embedder or HashingEmbedder()
+        self.vectors = np.zeros((0, self.embedder.dimensions), dtype=np.float32)
+        self.records: List[Dict[str, Any]] = []
+        self._pending: List[np.ndarray] = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, texts: List[str], metadata: List[Dict[str, Any]] = None):
+        """
+        Embeds and adds a batch of texts to the index.
+
+        Args:
+            texts (List[str]): The texts to index.
+            metadata (List[Dict[str, Any]], optional): One metadata dictionary per text, such as
+                its source document and kind. The text itself is stored under "text".
+        """
+        if not texts:
+            return
+        metadata = metadata or [{} for _ in texts]
+        self._pending.append(self.embedder.embed(texts))
+        self.records.extend({**meta, "text": text} for text, meta in zip(texts, metadata))
+
+    def _matrix(self) -> np.ndarray:
+        if self._pending:
+            self.vectors = np.concatenate([np.asarray(self.vectors), *self._pending])
+            self._pending = []
+        return self.vectors
+
+    def search(self, queries: List[str], k: int = 5) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Finds the `k` most similar indexed texts for every query in one vectorized pass.
+
+        Args:
+            queries (List[str]): The query texts.
+            k (int): The number of results per query.
+
+        Returns:
+            List[List[Tuple[float, Dict[str, Any]]]]: For every query, (cosine score, record)
+            pairs sorted from most to least similar.
+        """
+        matrix = self._matrix()
+        if not queries or len(matrix) == 0:
+            return [[] for _ in queries]
+        k = min(k, len(matrix))
+        scores = self.embedder.embed(queries) @ matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(float(score), self.records[i]) for score, i in zip(row_scores, row)]
+            for row_scores, row in zip(top_scores, top)
+        ]
+
+    def save(self, directory: str):
+        """
+        Writes the index to `directory` as `vectors.npy` and `records.json`.
+
+        Args:
+            directory (str): The directory to write to. It is created if it does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), self._matrix())
+        with open(os.path.join(directory, "records.json"), "w", encoding="utf-8") as f:
+            json.dump({"dimensions": self.embedder.dimensions, "analyzer": self.embedder.analyzer,
+                       "ngram_range": list(self.embedder.ngram_range), "records": self.records}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "VectorIndex":
+        """
+        Loads an index written by `save`.
+
+        Args:
+            directory (str): The directory the index was saved to.
+            mmap (bool): If True, the vectors are memory-mapped read-only instead of read into memory.
+
+        Returns:
+            VectorIndex: The loaded index.
+        """
+        with open(os.path.join(directory, "records.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(HashingEmbedder(data["dimensions"], data["analyzer"], tuple(data["ngram_range"])))
+        index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index.records = data["records"]
+        return index
+
+
+def format_evidence(results: List[Tuple[float, Dict[str, Any]]]) -> str:
+    """
+    Formats search results as a numbered list of quoted passages with their sources.
+
+    Args:
+        results (List[Tuple[float, Dict[str, Any]]]): The (score, record) pairs of one query.
+
+    Returns:
+        str: The formatted evidence.
+    """
+    lines = []
+    for number, (score, record) in enumerate(results, start=1):
+        source = os.path.basename(record.get("source", "unknown"))
+        lines.append(f"{number}. [{source}, {record.get('kind', 'text')}, score {score:.2f}] {record['text']}")
+    return "\n".join(lines)
+
+
+@rt.function_node
+def retrieve_evidence(query: str, k: int = 5) -> str:
+    """
+    Retrieve the passages and notes from the papers read in this session that best match a query.
+
+    Use this to find the exact supporting evidence for a claim or a section of the report
+    instead of relying only on the paper summaries.
+
+    Args:
+        query (str): A description of the evidence you are looking for.
+        k (int): The number of passages to return.
+
+    Returns:
+        str: A numbered list of passages, each with its source paper and similarity score.
+    """
+    index = rt.context.get("vector_index", False)
+    if not index:
+        index_dir = session_path(os.getenv("VECTOR_INDEX_DIR", "vector_index"))
+        if not os.path.exists(os.path.join(index_dir, "records.json")):
+            return "No papers have been indexed yet."
+        index = VectorIndex.load(index_dir)
+    results = index.search([query], k)[0]
+    if not results:
+        return "No evidence found."
+    return format_evidence(results)
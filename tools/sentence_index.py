@@ -0,0 +1,187 @@
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from tools.retrieval_tools import HashingEmbedder
+
+Rect = Tuple[float, float, float, float]
+
+QUOTE_TABLE = str.maketrans({
+    "‘": "'", "’": "'", "‚": "'", "‛": "'",
+    "“": '"', "”": '"', "„": '"', "‟": '"',
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "­": "",
+})
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text for fuzzy matching.
+
+    Applies Unicode compatibility folding (ligatures), straightens quotes and dashes, joins
+    words hyphenated across line breaks, lower-cases, drops punctuation and collapses
+    whitespace.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = unicodedata.normalize("NFKC", text).translate(QUOTE_TABLE)
+    text = re.sub(r"(\w)-\s*\n\s*(\w)", r"\1\2", text)
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+@dataclass(frozen=True, slots=True)
+class SentenceMatch:
+    """The best matching span of a document for one sentence."""
+    sentence: str
+    score: float
+    page: int
+    text: str
+    rects: Tuple[Rect, ...]
+
+
+class SentenceIndex:
+    """
+    A per-document character n-gram index of sentence spans for fuzzy highlighting.
+
+    Candidate spans are the sentences of every page, reconstructed from PyMuPDF words,
+    and every pair of consecutive sentences. All candidates are embedded once, and the
+    sentences to find are scored against all of them with a single matrix product, so
+    an LLM-rewritten quote (joined lines, fixed hyphenation, straight quotes) still finds
+    its span, with the line rectangles to highlight.
+    """
+
+    def __init__(self, doc: "fitz.Document", embedder: HashingEmbedder = None):
+        """
+        Args:
+            doc (fitz.Document): The open document to index.
+            embedder (HashingEmbedder, optional): The embedder for the normalized spans.
+                Defaults to character trigrams in 4096 dimensions.
+        """
+        self.embedder = embedder or HashingEmbedder(dimensions=4096, analyzer="char", ngram_range=(3, 3))
+        self.pages: List[int] = []
+        self.texts: List[str] = []
+        self.rects: List[Tuple[Rect, ...]] = []
+        for page_number, page in enumerate(doc):
+            sentences = self._page_sentences(page.get_text("words"))
+            for i, (text, rects) in enumerate(sentences):
+                self._add_candidate(page_number, text, rects)
+                if i + 1 < len(sentences):
+                    next_text, next_rects = sentences[i + 1]
+                    self._add_candidate(page_number, text + " " + next_text, rects + next_rects)
+        self.vectors = self.embedder.embed([normalize_text(text) for text in self.texts])
+        self.page_array = np.array(self.pages, dtype=np.int32)
+
+    def _add_candidate(self, page: int, text: str, rects: Tuple[Rect, ...]):
+        self.pages.append(page)
+        self.texts.append(text)
+        self.rects.append(rects)
+
+    @staticmethod
+    def _page_sentences(words) -> List[Tuple[str, Tuple[Rect, ...]]]:
+        sentences = []
+        current = []
+
+        def flush():
+            if not current:
+                return
+            text = ""
+            lines = {}
+            for x0, y0, x1, y1, word, block_no, line_no, _ in current:
+                if text.endswith("-"):
+                    text = text[:-1] + word
+                else:
+                    text = f"{text} {word}" if text else word
+                key = (block_no, line_no)
+                if key in lines:
+                    lx0, ly0, lx1, ly1 = lines[key]
+                    lines[key] = (min(lx0, x0), min(ly0, y0), max(lx1, x1), max(ly1, y1))
+                else:
+                    lines[key] = (x0, y0, x1, y1)
+            sentences.append((text, tuple(lines.values())))
+            current.clear()
+
+        for word in words:
+            if current and word[5] != current[-1][5]:
+                flush()
+            current.append(word)
+            if SENTENCE_END.search(word[4]) and len(current) >= 3:
+                flush()
+        flush()
+        return sentences
+
+    def __len__(self):
+        return len(self.texts)
+
+    def match(self, sentences: Sequence[str], pages: Sequence[int] = None,
+              page_bonus: float = 0.02) -> List[SentenceMatch]:
+        """
+        Finds the best matching span for every sentence in one vectorized pass.
+
+        Args:
+            sentences (Sequence[str]): The sentences to find.
+            pages (Sequence[int], optional): The page each sentence is expected on, e.g. from
+                its evidence record. Candidates on that page get a small bonus when ranking, which
+                breaks ties between repeated sentences. Use -1 for unknown.
+            page_bonus (float): The ranking bonus for candidates on the expected page.
+
+        Returns:
+            List[SentenceMatch]: One match per sentence, with the raw cosine similarity score in
+            [0, 1] of its best candidate; the page bonus never counts towards the score.
+        """
+        if not sentences or not self.texts:
+            return [SentenceMatch(sentence, 0.0, -1, "", ()) for sentence in sentences]
+        scores = self.embedder.embed([normalize_text(sentence) for sentence in sentences]) @ self.vectors.T
+        ranking = scores
+        if pages is not None:
+            ranking = scores + page_bonus * (np.asarray(pages)[:, None] == self.page_array[None, :])
+        best = ranking.argmax(axis=1)
+        return [
+            SentenceMatch(sentence, float(min(scores[row, i], 1.0)), self.pages[i], self.texts[i], self.rects[i])
+            for row, (sentence, i) in enumerate(zip(sentences, best))
+        ]
+
+
+def match_sentences_in_pdf(doc: "fitz.Document", sentences: Sequence[str], pages: Sequence[int] = None,
+                           threshold: float = 0.75, document_name: str = "") -> Tuple[List[SentenceMatch], dict]:
+    """
+    Builds the sentence index of a document and matches sentences against it.
+
+    Args:
+        doc (fitz.Document): The open document.
+        sentences (Sequence[str]): The sentences to find.
+        pages (Sequence[int], optional): The expected page of every sentence.
+        threshold (float): The minimum score for a match to be kept.
+        document_name (str): The name used when reporting statistics.
+
+    Returns:
+        Tuple[List[SentenceMatch], dict]: The accepted matches, and statistics with the number
+        of sentences and matches, the match rate, and the indexing and matching time in seconds.
+    """
+    start = time.perf_counter()
+    index = SentenceIndex(doc)
+    indexed = time.perf_counter()
+    matches = [match for match in index.match(sentences, pages) if match.score >= threshold]
+    finished = time.perf_counter()
+    stats = {
+        "document": document_name,
+        "sentences": len(sentences),
+        "matched": len(matches),
+        "match_rate": len(matches) / len(sentences) if sentences else 1.0,
+        "candidates": len(index),
+        "index_seconds": indexed - start,
+        "match_seconds": finished - indexed,
+    }
+    print(f"Matched {stats['matched']}/{stats['sentences']} sentences ({stats['match_rate']:.0%}) "
+          f"in {document_name} against {stats['candidates']} spans: "
+          f"index {stats['index_seconds']:.3f}s, match {stats['match_seconds']:.3f}s")
+    return matches, stats
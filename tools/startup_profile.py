@@ -0,0 +1,67 @@
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Imports a module in a fresh interpreter with `-X importtime` and parses the result.
+
+    Args:
+        module (str): The module to import, e.g. "agents".
+
+    Returns:
+        List[Tuple[str, int, int, int]]: (module name, self microseconds, cumulative
+        microseconds, nesting depth) for every module imported, in import order.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def startup_report(module: str, top: int = 25) -> str:
+    """
+    Builds a report of the slowest imports of a module.
+
+    The report lists the total import time, the cumulative time of every direct
+    dependency of the module, and the `top` modules with the highest self time.
+
+    Args:
+        module (str): The module to profile.
+        top (int): How many modules to list by self time.
+
+    Returns:
+        str: The formatted report.
+    """
+    entries = profile_imports(module)
+    total = next((cumulative for name, _, cumulative, _ in entries if name == module), 0)
+    lines = [f"Importing {module} took {total / 1000:.1f} ms ({len(entries)} modules)", "",
+             "Direct dependencies (cumulative):"]
+    # -X importtime prints dependencies before the module that imported them.
+    direct = []
+    position = next((i for i, entry in enumerate(entries) if entry[0] == module and entry[3] == 0), -1)
+    for entry in reversed(entries[:position]):
+        if entry[3] == 0:
+            break
+        if entry[3] == 1:
+            direct.append(entry)
+    direct.sort(key=lambda entry: entry[2], reverse=True)
+    for name, _, cumulative, _ in direct:
+        lines.append(f"  {cumulative / 1000:10.1f} ms  {name}")
+    lines.extend(["", f"Top {top} modules by self time:"])
+    for name, self_us, _, _ in sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]:
+        lines.append(f"  {self_us / 1000:10.1f} ms  {name}")
+    return "\n".join(lines)
@@ -1,10 +1,15 @@
 import os
-from typing import List
+from functools import lru_cache
+from typing import Dict, List
 
 import railtracks as rt
-from tavily import TavilyClient
 
-TAVILY_API_KEY = os.getenv('TAVILY_API_KEY')
+from tools.cassette import RecordedClient
+from tools.ingest import start_ingest
+from tools.prefetch import Prefetcher
+from tools.resource_monitor import instrumented, resource_stage
+from tools.triage import download_budget_status, refund_download_budget, spend_download_budget, triage_results
+from tools.util_tools import session_path
 
 import re
 
@@ -14,10 +19,27 @@ def sanitize_filename(name: str) -> str:
     return re.sub(r'[\\/*?:"<>|]', "_", name)
 
 
-import fitz
 import textwrap
 
 
+@lru_cache(maxsize=1)
+def get_tavily_client():
+    """
+    Returns a Tavily client shared by all tools, importing the Tavily SDK on first use.
+
+    Searches and extractions go through the `Cassette`, so they can be recorded and replayed.
+
+    Returns:
+        RecordedClient: A proxy of a client authenticated with the `TAVILY_API_KEY` environment variable.
+    """
+    def create():
+        from tavily import TavilyClient
+
+        return TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+
+    return RecordedClient("tavily", create, ("search", "extract"))
+
+
 def write_text_to_pdf(text: str, output_path: str, max_chars_per_line: int = 90):
     """
     Writes text into a PDF with automatic line wrapping.
@@ -27,6 +49,7 @@ def write_text_to_pdf(text: str, output_path: str, max_chars_per_line: int = 90)
         output_path: Path to save the PDF.
         max_chars_per_line: Approximate wrap width based on font size and page width.
     """
+    import fitz
 
     pdf = fitz.open()
     page = pdf.new_page()
@@ -52,7 +75,7 @@ def write_text_to_pdf(text: str, output_path: str, max_chars_per_line: int = 90)
 
 
 def extract(urls):
-    tavily_client = TavilyClient(TAVILY_API_KEY)
+    tavily_client = get_tavily_client()
     response = tavily_client.extract(urls)
     for result in response["results"]:
         print(f"URL: {result['url']}")
@@ -60,6 +83,7 @@ def extract(urls):
 
 
 @rt.function_node
+@instrumented("download_articles")
 def download_articles(urls: List[str], directory:str):
     """
     Downloads articles from the given list of web search URLs and saves them to the specified directory.
@@ -71,11 +95,30 @@ def download_articles(urls: List[str], directory:str):
     Returns:
         str: A message indicating which articles are being downloaded and the target directory.
     """
+    directory = session_path(directory)
     os.makedirs(directory, exist_ok=True)
     vfs = rt.context.get("vfs")
-    tavily_client = TavilyClient(TAVILY_API_KEY)
-    response = tavily_client.extract(urls, include_images=False, extract_depth="advanced")
-    results = response.get("results", [])
+    downloaded = {entry["url"] for entry in vfs if "url" in entry}
+    already = [url for url in urls if url in downloaded]
+    urls, skipped = spend_download_budget([url for url in urls if url not in already])
+    results = []
+    missing = []
+    for url in urls:
+        prefetched = Prefetcher().take(("web", url))
+        if prefetched is not None:
+            results.append(prefetched)
+        else:
+            missing.append(url)
+    if missing:
+        try:
+            tavily_client = get_tavily_client()
+            response = tavily_client.extract(missing, include_images=False, extract_depth="advanced")
+        except Exception:
+            refund_download_budget(len(missing))
+            raise
+        results.extend(response.get("results", []))
+    # Only the articles that came back count against the budget.
+    refund_download_budget(len(urls) - len(results))
     initial_length = len(vfs)
     for idx, item in enumerate(results):
         url = item.get("url", f"unknown_{idx}")
@@ -85,14 +128,21 @@ def download_articles(urls: List[str], directory:str):
             content = "No content found "
         safe_filename = sanitize_filename(title)
         output_path = os.path.join(directory, safe_filename + ".pdf")
-        write_text_to_pdf(content, output_path)
+        with resource_stage("render article pdf"):
+            write_text_to_pdf(content, output_path)
         vfs_entry = {
             "url": url,
             "description": title,
             "path": output_path,
         }
         vfs.append(vfs_entry)
-    return f"Downloaded {len(vfs) - initial_length} articles into {directory}, this is state of the directory: {vfs} which has the name of the file and its location."
+        start_ingest(output_path)
+    message = f"Downloaded {len(vfs) - initial_length} articles into {directory}, this is state of the directory: {vfs} which has the name of the file and its location."
+    if skipped:
+        message += f" Skipped {skipped} because the download budget of the research brief is used up."
+    if already:
+        message += f" {already} were downloaded before."
+    return message
 
 
 # @rt.function_node
@@ -147,7 +197,7 @@ def execute_web_search(query: str):
         str: A formatted string summarizing the search results, including title, content,
         and URL for each entry.
     """
-    tavily_client = TavilyClient(TAVILY_API_KEY)
+    tavily_client = get_tavily_client()
     response = tavily_client.search(
         query=query,
         max_results=5
@@ -164,6 +214,7 @@ def execute_web_search(query: str):
 
 
 @rt.function_node
+@instrumented("execute_web_search_main")
 def execute_web_search_main(query: str):
     """
     Executes a web search using the Tavily API and returns a summary of results.
@@ -180,25 +231,51 @@ def execute_web_search_main(query: str):
         str: A formatted string summarizing the search results, including title, content,
         and URL for each entry.
     """
-    tavily_client = TavilyClient(TAVILY_API_KEY)
+    return format_web_results(search_web(query))
+
+
+def search_web(query: str, max_results: int = 5) -> List[Dict[str, str]]:
+    """
+    Searches the web with Tavily.
+
+    Args:
+        query (str): The search query.
+        max_results (int): The maximum number of results.
+
+    Returns:
+        List[Dict[str, str]]: The title, content and url of every result.
+    """
+    tavily_client = get_tavily_client()
     response = tavily_client.search(
         query=query,
-        max_results=5
+        max_results=max_results
     )
-    test_result = []
-    for result in response["results"]:
-        entry_dict = {
-            "title": result["title"],
-            "content": result["content"],
-            "url": result["url"],
-        }
-        test_result.append(entry_dict)
-    return f"These are the initial results: {test_result}"
+    return [{"title": result["title"], "content": result["content"], "url": result["url"]}
+            for result in response["results"]]
+
+
+def format_web_results(results: List[Dict[str, str]]) -> str:
+    """
+    Ranks web search results by the research brief, prefetches them and formats them for the agent.
+
+    Kept apart from the search so that callers caching the search results still triage and
+    prefetch on every call. The results are copied, not changed.
+
+    Args:
+        results (List[Dict[str, str]]): The results of `search_web`.
+
+    Returns:
+        str: The title, content and url of every result, followed by the download budget.
+    """
+    test_result = triage_results([dict(result) for result in results], "url", ("title", "content"))
+    Prefetcher().prefetch_web([entry["url"] for entry in test_result])
+    budget = download_budget_status()
+    return f"These are the initial results: {test_result}" + (f"\n\n{budget}" if budget else "")
 
 
 @rt.function_node
 def download_web_articles(query: str, directory: str) -> str:
-    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+    tavily_client = get_tavily_client()
 
     response = tavily_client.search(
         query=query,
@@ -1,49 +1,145 @@
-from typing import List
+from threading import Lock
+from typing import List, Optional
 
 import railtracks as rt
 from pydantic import BaseModel, Field
 
+TODO_STATUSES = ("pending", "in-progress", "done", "failed")
+OPEN_STATUSES = ("pending", "in-progress")
+
+_todo_lock = Lock()
+
 
 class Todo(BaseModel):
     content: str = Field(description="A todo that needs to be done.")
-    status: str = Field(description="Status of the todo, in-progress, done, or failed.")
+    status: str = Field(default="pending", description="Status of the todo, pending, in-progress, done, or failed.")
+
+
+class TodoItem(Todo):
+    id: str = Field(description="The stable id of the todo, e.g. \"t3\".")
+
+
+def _get_todo() -> List[TodoItem]:
+    todo = rt.context.get("todo", False)
+    if not todo:
+        todo = []
+        rt.context.put("todo", todo)
+    return todo
+
+
+def _next_id() -> str:
+    next_id = rt.context.get("todo_next_id", 1)
+    rt.context.put("todo_next_id", next_id + 1)
+    return f"t{next_id}"
+
+
+def format_todo(todo: List[TodoItem]) -> str:
+    """
+    Formats todo items one per line, e.g. "t3 [in-progress] Download the selected papers".
+
+    Args:
+        todo (List[TodoItem]): The items.
+
+    Returns:
+        str: The compact listing.
+    """
+    return "\n".join(f"{item.id} [{item.status}] {item.content}" for item in todo)
+
 
 @rt.function_node
-def write_todo(todo:List[Todo]):
-    """Store a list of Todo items in the railtracks context.
+def add_todo(todo: List[Todo]) -> str:
+    """Add tasks to the Todo list stored in the railtracks context.
 
-    Each Todo item includes:
-        - content (str): A description of the task.
-        - status (str): The task status, one of: "in-progress", "done", or "failed".
+    Every task gets a stable id such as "t3" that `update_todo` and `remove_todo` refer to.
+    Existing tasks are kept, so only send the new ones.
 
     Args:
         todo (List[Todo]):
-            A list of Todo objects, each containing a task description
-            and its current status.
+            The new tasks, each with a description (content) and a status, one of
+            "pending" (the default), "in-progress", "done", or "failed".
+
+    Returns:
+        str: The ids of the added tasks, or a message naming an invalid status.
+    """
+    invalid = [item.status for item in todo if item.status not in TODO_STATUSES]
+    if invalid:
+        return f"Invalid status {invalid[0]!r}. Use one of: {', '.join(TODO_STATUSES)}."
+    with _todo_lock:
+        items = _get_todo()
+        added = [TodoItem(id=_next_id(), content=item.content, status=item.status) for item in todo]
+        items.extend(added)
+    return f"Added:\n{format_todo(added)}"
+
+
+@rt.function_node
+def update_todo(todo_id: str, status: Optional[str] = None, content: Optional[str] = None) -> str:
+    """Change the status or the description of one task on the Todo list.
+
+    Args:
+        todo_id (str): The id of the task, e.g. "t3".
+        status (str, optional): The new status, one of "pending", "in-progress", "done", or "failed".
+        content (str, optional): The new description of the task.
 
     Returns:
-        str: A confirmation message indicating that the Todo list has
-        been updated, including the stored items.
+        str: The updated task, or a message if the id or the status is unknown.
     """
-    rt.context.put("todo",todo)
-    return f"Updated Todo List:{todo}"
+    if status is not None and status not in TODO_STATUSES:
+        return f"Invalid status {status!r}. Use one of: {', '.join(TODO_STATUSES)}."
+    with _todo_lock:
+        for item in _get_todo():
+            if item.id == todo_id.strip():
+                if status is not None:
+                    item.status = status
+                if content:
+                    item.content = content
+                return f"Updated: {format_todo([item])}"
+    return f"No todo with id {todo_id}. Use `read_todo` to see the ids."
+
 
 @rt.function_node
-def read_todo():
-    """Retrieve the stored Todo list from the railtracks context.
+def remove_todo(todo_ids: List[str]) -> str:
+    """Remove tasks from the Todo list, e.g. ones that are no longer needed.
 
-    Each Todo item includes:
-        - content (str): A description of the task.
-        - status (str): The task status, one of: "in-progress", "done", or "failed".
+    Args:
+        todo_ids (List[str]): The ids of the tasks, e.g. ["t2", "t5"].
 
     Returns:
-        str: A formatted string representing the current stored Todo
-        list. If no todos are stored, returns a message indicating
-        that none were found.
+        str: The ids that were removed and those that were not found.
     """
-    todo = rt.context.get("todo",[])
-    if todo:
-        return f"Current Todo List {todo}"
-    else:
-        return "No todo found"
+    wanted = {todo_id.strip() for todo_id in todo_ids}
+    with _todo_lock:
+        items = _get_todo()
+        removed = [item.id for item in items if item.id in wanted]
+        items[:] = [item for item in items if item.id not in wanted]
+    missing = sorted(wanted - set(removed))
+    message = f"Removed: {', '.join(removed) if removed else 'nothing'}."
+    if missing:
+        message += f" Not found: {', '.join(missing)}."
+    return message
 
+
+@rt.function_node
+def read_todo(status: str = "open") -> str:
+    """Retrieve the Todo list from the railtracks context, one task per line as "<id> [<status>] <content>".
+
+    Args:
+        status (str, optional): Which tasks to list: "open" (pending and in-progress, the default),
+            "all", or a single status such as "done" or "failed".
+
+    Returns:
+        str: The matching tasks with a count of the other ones, or a message
+        indicating that none were found.
+    """
+    with _todo_lock:
+        todo = list(_get_todo())
+    if not todo:
+        return "No todo found"
+    if status == "all":
+        selected = todo
+    elif status == "open":
+        selected = [item for item in todo if item.status in OPEN_STATUSES]
+    else:
+        selected = [item for item in todo if item.status == status]
+    hidden = len(todo) - len(selected)
+    listing = format_todo(selected) if selected else f"No {status} todos."
+    return listing + (f"\n({hidden} other todos not shown)" if hidden else "")
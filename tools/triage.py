@@ -0,0 +1,149 @@
+import hashlib
+import os
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+import railtracks as rt
+
+STOPWORDS = frozenset("""
+a about above after again against all also an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having here how i if in into
+is it its itself just more most no nor not of off on once only or other our out over own same should so some such
+than that the their them then there these they this those through to too under until up very was we were what when
+where which while who whom why will with would you your paper papers work approach propose proposed show results
+study use using used based new method methods
+""".split())
+
+_budget_lock = Lock()
+
+
+def _content_words(text: str) -> str:
+    from tools.retrieval_tools import WORD_PATTERN
+    return " ".join(word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS and len(word) > 2)
+
+
+def relevance_scores(brief: str, texts: List[str]) -> List[float]:
+    """
+    Scores texts against a research brief by the cosine similarity of their hashed word n-grams.
+
+    Stopwords are removed first, so the score reflects shared content words and phrases.
+    The brief and all texts are embedded in one batch with `HashingEmbedder`; nothing is
+    downloaded and no LLM is called.
+
+    Args:
+        brief (str): The research brief.
+        texts (List[str]): The texts to score, e.g. the titles and abstracts of search results.
+
+    Returns:
+        List[float]: One score between 0 and 1 per text.
+    """
+    # Imported here so that importing the agents does not load numpy before anything is searched.
+    from tools.retrieval_tools import HashingEmbedder
+    if not texts:
+        return []
+    vectors = HashingEmbedder().embed([_content_words(brief)] + [_content_words(text) for text in texts])
+    return [max(0.0, float(score)) for score in vectors[1:] @ vectors[0]]
+
+
+def _brief_key(brief: str) -> str:
+    return hashlib.sha1(brief.encode("utf-8")).hexdigest()[:12]
+
+
+def triage_results(results: List[Dict[str, Any]], key_field: str, text_fields: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """
+    Ranks search results by their relevance to the research brief of the session.
+
+    Every result gets a "relevance" score and the scores are remembered in the context
+    under "triage_scores", so the download tools can spend the budget on the best ones.
+    Without a research brief in the context, the results are returned as they are.
+
+    Args:
+        results (List[Dict[str, Any]]): The search results.
+        key_field (str): The field identifying a result for download, e.g. "paper_id" or "url".
+        text_fields (Tuple[str, ...]): The fields scored against the brief, e.g. ("title", "abstract").
+
+    Returns:
+        List[Dict[str, Any]]: The results, most relevant first.
+    """
+    brief = rt.context.get("research_brief", "")
+    if not brief or not results:
+        return results
+    scores = relevance_scores(brief, [" ".join(str(result.get(field, "")) for field in text_fields)
+                                      for result in results])
+    triage_scores = rt.context.get("triage_scores", False)
+    if not triage_scores:
+        triage_scores = {}
+        rt.context.put("triage_scores", triage_scores)
+    for result, score in zip(results, scores):
+        result["relevance"] = round(score, 3)
+        triage_scores[result[key_field]] = score
+    return sorted(results, key=lambda result: result["relevance"], reverse=True)
+
+
+def download_budget_status() -> str:
+    """
+    Describes how much of the download budget of the current brief is left.
+
+    Returns:
+        str: A sentence for the search results, or "" when there is no brief or no budget.
+    """
+    budget = int(os.getenv("DOWNLOAD_BUDGET", "10"))
+    brief = rt.context.get("research_brief", "")
+    if budget <= 0 or not brief:
+        return ""
+    used = rt.context.get("download_budget_used", {}).get(_brief_key(brief), 0)
+    return (f"Download budget: {max(0, budget - used)} of {budget} papers and articles left for this research brief. "
+            f"Only download the most relevant results.")
+
+
+def spend_download_budget(keys: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Takes as many downloads as the budget of the current research brief allows.
+
+    The budget is `DOWNLOAD_BUDGET` (default 10, 0 for no limit) papers and articles per
+    brief, counted in the context under "download_budget_used". When the request is larger
+    than what is left, the results with the highest triage scores are kept. The keys are
+    reserved before downloading so parallel calls cannot overspend; give back the ones that
+    fail with `refund_download_budget`.
+
+    Args:
+        keys (List[str]): The paper ids or urls requested for download.
+
+    Returns:
+        Tuple[List[str], List[str]]: The keys to download, in the requested order, and the skipped keys.
+    """
+    budget = int(os.getenv("DOWNLOAD_BUDGET", "10"))
+    brief = rt.context.get("research_brief", "")
+    if budget <= 0 or not brief:
+        return list(keys), []
+    with _budget_lock:
+        used_by_brief = rt.context.get("download_budget_used", False)
+        if not used_by_brief:
+            used_by_brief = {}
+            rt.context.put("download_budget_used", used_by_brief)
+        used = used_by_brief.get(_brief_key(brief), 0)
+        remaining = max(0, budget - used)
+        if len(keys) > remaining:
+            scores = rt.context.get("triage_scores", {})
+            ranked = sorted(keys, key=lambda key: scores.get(key, 0.0), reverse=True)
+            allowed = set(ranked[:remaining])
+        else:
+            allowed = set(keys)
+        used_by_brief[_brief_key(brief)] = used + len(allowed)
+    return [key for key in keys if key in allowed], [key for key in keys if key not in allowed]
+
+
+def refund_download_budget(count: int):
+    """
+    Gives back budget reserved by `spend_download_budget` for downloads that failed.
+
+    Args:
+        count (int): The number of downloads that failed.
+    """
+    brief = rt.context.get("research_brief", "")
+    if count <= 0 or int(os.getenv("DOWNLOAD_BUDGET", "10")) <= 0 or not brief:
+        return
+    with _budget_lock:
+        used_by_brief = rt.context.get("download_budget_used", {})
+        key = _brief_key(brief)
+        used_by_brief[key] = max(0, used_by_brief.get(key, 0) - count)
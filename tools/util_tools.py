@@ -1,3 +1,6 @@
+import os
+from functools import lru_cache
+
 import railtracks as rt
 
 @rt.function_node
@@ -13,3 +16,64 @@ def think_tool(thought: str) -> str:
         str: A formatted string containing the provided thought.
     """
     return f"Thought: {thought}"
+
+
+def session_path(*parts: str) -> str:
+    """
+    Resolves a path inside the output directory of the current session.
+
+    The output directory is the "output_dir" entry of the railtracks context, so
+    concurrent sessions (e.g. batch runs) write to separate directories. Without
+    one, paths are relative to the working directory as before.
+
+    Args:
+        *parts (str): The path components, e.g. ("highlighted_papers", "paper.pdf").
+
+    Returns:
+        str: The path joined onto the session's output directory.
+    """
+    return os.path.join(rt.context.get("output_dir", "."), *parts)
+
+
+def report_progress(message: str):
+    """
+    Reports the progress of a long-running tool to whoever is watching it.
+
+    Background jobs put a callback under "progress" in the railtracks context; without
+    one, the message is only printed.
+
+    Args:
+        message (str): A short description of the current step, e.g. "paper 2/5: paragraph 10/84".
+    """
+    print(message)
+    callback = rt.context.get("progress", False)
+    if callback:
+        callback(message)
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # No tokenizer available (e.g. offline without a cached BPE file).
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens in a piece of text using the tiktoken encoding of the
+    GPT-4.1 family, falling back to a ~4 characters per token estimate when
+    the tokenizer is unavailable.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The number of tokens in the text.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
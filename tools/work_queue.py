@@ -0,0 +1,505 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    batch TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_batch ON tasks (batch, position);
+"""
+
+
+@dataclass
+class QueuedTask:
+    """A task claimed from a work queue, leased to one worker until it completes, fails or the lease expires."""
+    id: str
+    batch: str
+    position: int
+    payload: Dict[str, Any]
+    attempts: int
+
+
+@dataclass
+class TaskState:
+    """The state of one task of a batch, as returned by `WorkQueue.batch_states`."""
+    status: str
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+class WorkQueue(ABC):
+    """
+    A durable queue of JSON tasks shared by worker processes, possibly on other machines.
+
+    Tasks are enqueued in batches and gathered back in their enqueue order. A worker
+    claims a task with a lease of `lease` seconds, renews it while working and completes
+    or fails it. A failed task is retried after `retry_delay` seconds; a task whose lease
+    expires, e.g. because its worker died, is handed to the next worker. Either way a
+    task is claimed at most `max_attempts` times before it is marked failed. A task can
+    run more than once, so handlers must be idempotent; the first result is kept.
+    """
+
+    def __init__(self, lease: float = None, max_attempts: int = None, retry_delay: float = None):
+        """
+        Args:
+            lease (float, optional): The lease of a claim in seconds. Defaults to `WORK_QUEUE_LEASE` or 300.
+            max_attempts (int, optional): The number of claims before a task fails. Defaults to
+                `WORK_QUEUE_MAX_ATTEMPTS` or 3.
+            retry_delay (float, optional): The delay before a failed task is claimable again. Defaults to
+                `WORK_QUEUE_RETRY_DELAY` or 5.
+        """
+        self.lease = float(lease if lease is not None else os.getenv("WORK_QUEUE_LEASE", "300"))
+        self.max_attempts = int(max_attempts if max_attempts is not None
+                                else os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+        self.retry_delay = float(retry_delay if retry_delay is not None
+                                 else os.getenv("WORK_QUEUE_RETRY_DELAY", "5"))
+
+    @abstractmethod
+    def enqueue(self, batch: str, payloads: List[Dict[str, Any]]) -> List[str]:
+        """
+        Adds a batch of tasks.
+
+        Args:
+            batch (str): The batch the tasks belong to.
+            payloads (List[Dict[str, Any]]): The JSON-serializable payloads, in the order results are gathered.
+
+        Returns:
+            List[str]: The task ids.
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, batch: str = None) -> Optional[QueuedTask]:
+        """
+        Leases the oldest claimable task.
+
+        Args:
+            worker (str): The id of the claiming worker.
+            batch (str, optional): Only claim tasks of this batch.
+
+        Returns:
+            Optional[QueuedTask]: The task, or None if no task is claimable.
+        """
+
+    @abstractmethod
+    def renew(self, task_id: str, worker: str) -> bool:
+        """
+        Extends the lease of a claimed task by `lease` seconds.
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+
+    @abstractmethod
+    def complete(self, task_id: str, worker: str, result: Dict[str, Any]):
+        """Stores the result of a task, unless another worker completed it first."""
+
+    @abstractmethod
+    def fail(self, task_id: str, worker: str, error: str):
+        """Releases a task after an error, to be retried or, after `max_attempts` claims, marked failed."""
+
+    @abstractmethod
+    def batch_states(self, batch: str) -> List[TaskState]:
+        """
+        Returns the state of every task of a batch.
+
+        Args:
+            batch (str): The batch.
+
+        Returns:
+            List[TaskState]: One state per task, in enqueue order.
+        """
+
+    @abstractmethod
+    def delete_batch(self, batch: str):
+        """Removes a batch and all its tasks."""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    A `WorkQueue` in a SQLite database, for workers in several processes of one machine or on a shared disk.
+
+    Claims run in an immediate transaction, so two processes never lease the same task.
+    """
+
+    def __init__(self, path: str = None, **kwargs):
+        """
+        Args:
+            path (str, optional): The database file. Defaults to `WORK_QUEUE_PATH` or "work_queue.sqlite".
+            **kwargs: The lease and retry settings of `WorkQueue`.
+        """
+        super().__init__(**kwargs)
+        self._lock = Lock()
+        self.path = path or os.getenv("WORK_QUEUE_PATH", "work_queue.sqlite")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def enqueue(self, batch: str, payloads: List[Dict[str, Any]]) -> List[str]:
+        now = time.time()
+        rows = [(uuid.uuid4().hex, batch, position, json.dumps(payload), "queued", self.max_attempts, now, now)
+                for position, payload in enumerate(payloads)]
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "INSERT INTO tasks (id, batch, position, payload, status, max_attempts, available_at, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def claim(self, worker: str, batch: str = None) -> Optional[QueuedTask]:
+        now = time.time()
+        batch_filter, parameters = ("AND batch = ?", (batch,)) if batch else ("", ())
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "UPDATE tasks SET status = 'failed', error = 'lease expired on the last attempt' "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts", (now,))
+                row = self._connection.execute(
+                    "SELECT id, batch, position, payload, attempts FROM tasks "
+                    "WHERE ((status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?)) "
+                    f"{batch_filter} ORDER BY created, position LIMIT 1", (now, now) + parameters).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE tasks SET status = 'leased', worker = ?, attempts = attempts + 1, lease_expires = ? "
+                        "WHERE id = ?", (worker, now + self.lease, row[0]))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return QueuedTask(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+
+    def renew(self, task_id: str, worker: str) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease, task_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: str, worker: str, result: Dict[str, Any]):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE tasks SET status = 'done', worker = ?, result = ?, error = NULL "
+                "WHERE id = ? AND status != 'done'", (worker, json.dumps(result), task_id))
+
+    def fail(self, task_id: str, worker: str, error: str):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                "error = ?, available_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (error, time.time() + self.retry_delay, task_id, worker))
+
+    def batch_states(self, batch: str) -> List[TaskState]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, result, error FROM tasks WHERE batch = ? ORDER BY position", (batch,)).fetchall()
+        return [TaskState(status, json.loads(result) if result is not None else None, error)
+                for status, result, error in rows]
+
+    def delete_batch(self, batch: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM tasks WHERE batch = ?", (batch,))
+
+
+class RedisWorkQueue(WorkQueue):
+    """
+    A `WorkQueue` on a Redis server, for workers on several machines.
+
+    Only plain commands and MULTI transactions are used, no Lua scripts, so any
+    Redis-compatible server (Valkey, KeyDB, Dragonfly) or an in-memory stand-in with the
+    redis-py client interface can replace it. Under the key prefix every task is a hash,
+    every batch has a list of its task ids and a list of its ready tasks, and claimed
+    tasks move atomically to a "processing" list with their lease in a sorted set.
+    Expired leases and delayed retries are put back on the ready lists by whichever
+    worker claims next.
+    """
+
+    def __init__(self, url: str = None, client=None, prefix: str = None, **kwargs):
+        """
+        Args:
+            url (str, optional): The server, e.g. "redis://host:6379/0". Defaults to `WORK_QUEUE`.
+            client (optional): A client with the redis-py interface to use instead of connecting to `url`.
+            prefix (str, optional): The key prefix. Defaults to `WORK_QUEUE_PREFIX` or "work_queue".
+            **kwargs: The lease and retry settings of `WorkQueue`.
+        """
+        super().__init__(**kwargs)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or os.getenv("WORK_QUEUE"), decode_responses=True)
+        self.redis = client
+        self.prefix = prefix or os.getenv("WORK_QUEUE_PREFIX", "work_queue")
+        self._last_maintenance = 0.0
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def enqueue(self, batch: str, payloads: List[Dict[str, Any]]) -> List[str]:
+        now = time.time()
+        ids = [uuid.uuid4().hex for _ in payloads]
+        pipeline = self.redis.pipeline()
+        for position, (task_id, payload) in enumerate(zip(ids, payloads)):
+            pipeline.hset(self._key("task", task_id), mapping={
+                "batch": batch, "position": position, "payload": json.dumps(payload), "status": "queued",
+                "attempts": 0, "max_attempts": self.max_attempts, "queued_at": now})
+        if ids:
+            pipeline.rpush(self._key("batch", batch), *ids)
+            pipeline.rpush(self._key("queue", batch), *ids)
+        pipeline.sadd(self._key("batches"), batch)
+        pipeline.execute()
+        return ids
+
+    def _requeue(self, task_id: str, now: float, error: str):
+        # Removing the id from the processing list is the guard: only one worker requeues a task.
+        if not self.redis.lrem(self._key("processing"), 0, task_id):
+            self.redis.zrem(self._key("leases"), task_id)
+            return
+        self.redis.zrem(self._key("leases"), task_id)
+        task = self.redis.hmget(self._key("task", task_id), "batch", "attempts", "max_attempts")
+        if task[0] is None:
+            return
+        if int(task[1]) >= int(task[2]):
+            self.redis.hset(self._key("task", task_id), mapping={"status": "failed", "error": error})
+            return
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key("task", task_id), mapping={"status": "queued", "queued_at": now})
+        pipeline.rpush(self._key("queue", task[0]), task_id)
+        pipeline.execute()
+
+    def _maintain(self):
+        now = time.time()
+        if now - self._last_maintenance < 1:
+            return
+        self._last_maintenance = now
+        for task_id in self.redis.zrangebyscore(self._key("delayed"), "-inf", now):
+            if self.redis.zrem(self._key("delayed"), task_id):
+                batch = self.redis.hget(self._key("task", task_id), "batch")
+                if batch is not None:
+                    self.redis.rpush(self._key("queue", batch), task_id)
+        for task_id in self.redis.zrangebyscore(self._key("leases"), "-inf", now):
+            self._requeue(task_id, now, "lease expired on the last attempt")
+        # A worker that died between taking a task and writing its lease leaves it without one.
+        for task_id in self.redis.lrange(self._key("processing"), 0, -1):
+            if self.redis.zscore(self._key("leases"), task_id) is None:
+                status, queued_at = self.redis.hmget(self._key("task", task_id), "status", "queued_at")
+                if status == "queued" and float(queued_at) + self.lease < now:
+                    self._requeue(task_id, now, "lease expired on the last attempt")
+
+    def claim(self, worker: str, batch: str = None) -> Optional[QueuedTask]:
+        self._maintain()
+        batches = [batch] if batch else sorted(self.redis.smembers(self._key("batches")))
+        task_id = None
+        for candidate in batches:
+            task_id = self.redis.lmove(self._key("queue", candidate), self._key("processing"), "LEFT", "RIGHT")
+            if task_id is not None:
+                break
+        if task_id is None:
+            return None
+        expires = time.time() + self.lease
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key("task", task_id), mapping={"status": "leased", "worker": worker,
+                                                           "lease_expires": expires})
+        pipeline.hincrby(self._key("task", task_id), "attempts", 1)
+        pipeline.zadd(self._key("leases"), {task_id: expires})
+        pipeline.hmget(self._key("task", task_id), "batch", "position", "payload")
+        _, attempts, _, (task_batch, position, payload) = pipeline.execute()
+        return QueuedTask(task_id, task_batch, int(position), json.loads(payload), int(attempts))
+
+    def _holds(self, task_id: str, worker: str) -> bool:
+        status, holder = self.redis.hmget(self._key("task", task_id), "status", "worker")
+        return status == "leased" and holder == worker
+
+    def renew(self, task_id: str, worker: str) -> bool:
+        if not self._holds(task_id, worker):
+            return False
+        expires = time.time() + self.lease
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key("task", task_id), "lease_expires", expires)
+        pipeline.zadd(self._key("leases"), {task_id: expires})
+        pipeline.execute()
+        return True
+
+    def complete(self, task_id: str, worker: str, result: Dict[str, Any]):
+        if self.redis.hget(self._key("task", task_id), "status") in (None, "done"):
+            return
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key("task", task_id), mapping={"status": "done", "worker": worker,
+                                                           "result": json.dumps(result)})
+        pipeline.hdel(self._key("task", task_id), "error")
+        pipeline.zrem(self._key("leases"), task_id)
+        pipeline.zrem(self._key("delayed"), task_id)
+        pipeline.lrem(self._key("processing"), 0, task_id)
+        pipeline.execute()
+
+    def fail(self, task_id: str, worker: str, error: str):
+        if not self._holds(task_id, worker):
+            return
+        attempts, max_attempts = self.redis.hmget(self._key("task", task_id), "attempts", "max_attempts")
+        pipeline = self.redis.pipeline()
+        pipeline.zrem(self._key("leases"), task_id)
+        pipeline.lrem(self._key("processing"), 0, task_id)
+        if int(attempts) >= int(max_attempts):
+            pipeline.hset(self._key("task", task_id), mapping={"status": "failed", "error": error})
+        else:
+            pipeline.hset(self._key("task", task_id), mapping={"status": "queued", "error": error,
+                                                               "queued_at": time.time()})
+            pipeline.zadd(self._key("delayed"), {task_id: time.time() + self.retry_delay})
+        pipeline.execute()
+
+    def batch_states(self, batch: str) -> List[TaskState]:
+        ids = self.redis.lrange(self._key("batch", batch), 0, -1)
+        pipeline = self.redis.pipeline()
+        for task_id in ids:
+            pipeline.hmget(self._key("task", task_id), "status", "result", "error")
+        return [TaskState(status or "missing", json.loads(result) if result is not None else None, error)
+                for status, result, error in pipeline.execute()]
+
+    def delete_batch(self, batch: str):
+        ids = self.redis.lrange(self._key("batch", batch), 0, -1)
+        pipeline = self.redis.pipeline()
+        for task_id in ids:
+            pipeline.delete(self._key("task", task_id))
+            pipeline.zrem(self._key("leases"), task_id)
+            pipeline.zrem(self._key("delayed"), task_id)
+            pipeline.lrem(self._key("processing"), 0, task_id)
+        pipeline.delete(self._key("batch", batch), self._key("queue", batch))
+        pipeline.srem(self._key("batches"), batch)
+        pipeline.execute()
+
+
+@lru_cache(maxsize=None)
+def _open_work_queue(setting: str) -> WorkQueue:
+    if setting == "sqlite":
+        return SQLiteWorkQueue()
+    if setting.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(setting)
+    raise ValueError(f"Unknown WORK_QUEUE {setting!r}: use \"sqlite\" or a redis:// URL.")
+
+
+def get_work_queue() -> Optional[WorkQueue]:
+    """
+    Returns the work queue configured by `WORK_QUEUE`.
+
+    Returns:
+        Optional[WorkQueue]: A `SQLiteWorkQueue` for "sqlite", a `RedisWorkQueue` for a redis:// URL,
+        or None when the variable is unset, i.e. work is done in-process.
+    """
+    setting = os.getenv("WORK_QUEUE", "")
+    if not setting or setting == "off":
+        return None
+    return _open_work_queue(setting)
+
+
+def worker_id() -> str:
+    """Returns an id for a worker of this process, e.g. "host-1234-5f3a"."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+
+
+async def run_worker(queue: WorkQueue, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                     concurrency: int = 1, batch: str = None, poll: float = None, worker: str = None):
+    """
+    Claims and runs tasks until cancelled.
+
+    `concurrency` tasks run at once. While a task runs its lease is renewed every third of
+    the lease, so slow tasks are not handed to another worker. When no task is claimable
+    the worker polls every `poll` seconds (default `WORK_QUEUE_POLL` or 1).
+
+    Args:
+        queue (WorkQueue): The queue.
+        handler (Callable): An async function taking a payload and returning the JSON-serializable result.
+        concurrency (int): The number of tasks run at once.
+        batch (str, optional): Only run tasks of this batch.
+        poll (float, optional): The polling interval in seconds.
+        worker (str, optional): The worker id. Defaults to `worker_id()`.
+    """
+    poll = float(poll if poll is not None else os.getenv("WORK_QUEUE_POLL", "1"))
+    worker = worker or worker_id()
+
+    async def keep_lease(task: QueuedTask):
+        while True:
+            await asyncio.sleep(queue.lease / 3)
+            if not await asyncio.to_thread(queue.renew, task.id, worker):
+                return
+
+    async def run(task: QueuedTask):
+        renewal = asyncio.create_task(keep_lease(task))
+        try:
+            result = await handler(task.payload)
+        except Exception as e:
+            await asyncio.to_thread(queue.fail, task.id, worker, f"{type(e).__name__}: {e}")
+            print(f"Worker {worker}: task {task.id} failed on attempt {task.attempts}: {type(e).__name__}: {e}")
+        else:
+            await asyncio.to_thread(queue.complete, task.id, worker, result)
+        finally:
+            renewal.cancel()
+
+    async def slot():
+        while True:
+            task = await asyncio.to_thread(queue.claim, worker, batch)
+            if task is None:
+                await asyncio.sleep(poll)
+            else:
+                await run(task)
+
+    await asyncio.gather(*[slot() for _ in range(max(1, concurrency))])
+
+
+async def gather_batch(queue: WorkQueue, batch: str, poll: float = None,
+                       progress: Callable[[int, int], None] = None) -> List[Dict[str, Any]]:
+    """
+    Waits until every task of a batch is done and returns their results in enqueue order.
+
+    Args:
+        queue (WorkQueue): The queue.
+        batch (str): The batch.
+        poll (float, optional): The polling interval in seconds. Defaults to `WORK_QUEUE_POLL` or 1.
+        progress (Callable[[int, int], None], optional): Called with the finished and total tasks when they change.
+
+    Returns:
+        List[Dict[str, Any]]: The results.
+
+    Raises:
+        RuntimeError: If a task failed on every attempt.
+    """
+    poll = float(poll if poll is not None else os.getenv("WORK_QUEUE_POLL", "1"))
+    reported = -1
+    while True:
+        states = await asyncio.to_thread(queue.batch_states, batch)
+        failed = [(position, state.error) for position, state in enumerate(states) if state.status == "failed"]
+        if failed:
+            position, error = failed[0]
+            raise RuntimeError(f"Task {position} of batch {batch} failed: {error}")
+        finished = sum(state.status == "done" for state in states)
+        if progress is not None and finished != reported:
+            reported = finished
+            progress(finished, len(states))
+        if finished == len(states):
+            return [state.result for state in states]
+        await asyncio.sleep(poll)
+
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import os
+
+import railtracks as rt
+from dotenv import load_dotenv
+
+from tools.research_tools import handle_note_task
+from tools.work_queue import get_work_queue, run_worker, worker_id
+
+load_dotenv()
+
+HANDLERS = {"notes": handle_note_task}
+
+
+async def handle_task(payload: dict) -> dict:
+    """
+    Runs a task of the work queue with the handler of its "kind".
+
+    Args:
+        payload (dict): The task payload.
+
+    Returns:
+        dict: The result of the handler.
+    """
+    handler = HANDLERS.get(payload.get("kind"))
+    if handler is None:
+        raise ValueError(f"No handler for tasks of kind {payload.get('kind')!r}")
+    return await handler(payload)
+
+
+async def run(concurrency: int, timeout: float):
+    """
+    Works on the tasks of the `WORK_QUEUE` until interrupted.
+
+    Args:
+        concurrency (int): The number of tasks run at once.
+        timeout (float): The session timeout in seconds.
+    """
+    queue = get_work_queue()
+    if queue is None:
+        raise SystemExit("Set WORK_QUEUE to \"sqlite\" or a redis:// URL to run a worker.")
+    worker = worker_id()
+    print(f"Worker {worker} running {concurrency} tasks at a time on {type(queue).__name__}")
+    with rt.Session(timeout=timeout, name=f"worker-{worker}"):
+        await run_worker(queue, handle_task, concurrency, worker=worker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run paragraph note-taking tasks from the shared work queue.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("PARAGRAPH_CONCURRENCY", "16")),
+                        help="Number of tasks run at the same time.")
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("WORKER_SESSION_TIMEOUT", "86400")),
+                        help="Session timeout of the worker in seconds.")
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.timeout))
+
+
+if __name__ == "__main__":
+    main()